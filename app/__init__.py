@@ -1,12 +1,18 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from flask_migrate import Migrate
 import os
+import time
+from .replicas import SesionEnrutada
 
-db = SQLAlchemy()
+# Las lecturas de las vistas @solo_lectura pueden ir a una réplica (ver app/replicas.py)
+db = SQLAlchemy(session_options={'class_': SesionEnrutada})
 login_manager = LoginManager()
+migrate = Migrate()
 
 def create_app():
+    inicio = time.perf_counter()
     app = Flask(__name__)
     
     # Configuración
@@ -26,63 +32,101 @@ def create_app():
     
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # Pool de conexiones configurable por entorno (ver app/conexiones.py)
+    from .conexiones import opciones_motor, configurar_motor
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones_motor(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    # Paginación de listados
+    app.config['PACIENTES_POR_PAGINA'] = int(os.environ.get('PACIENTES_POR_PAGINA', 50))
+    app.config['CITAS_POR_PAGINA'] = int(os.environ.get('CITAS_POR_PAGINA', 50))
+    app.config['HISTORIA_ENTRADAS_POR_PAGINA'] = int(os.environ.get('HISTORIA_ENTRADAS_POR_PAGINA', 20))
+
+    # Versiones de historia: copia completa cada N versiones y caché de reconstrucciones
+    app.config['HISTORIA_VERSIONES_CHECKPOINT'] = int(os.environ.get('HISTORIA_VERSIONES_CHECKPOINT', 20))
+    app.config['HISTORIA_VERSIONES_CACHE'] = int(os.environ.get('HISTORIA_VERSIONES_CACHE', 128))
+
+    # Búsqueda de texto en historias: resultados mostrados y coincidencias recientes que se puntúan
+    app.config['HISTORIA_BUSQUEDA_RESULTADOS'] = int(os.environ.get('HISTORIA_BUSQUEDA_RESULTADOS', 50))
+    app.config['HISTORIA_BUSQUEDA_CANDIDATOS'] = int(os.environ.get('HISTORIA_BUSQUEDA_CANDIDATOS', 5000))
+
+    # Agenda: duración de las citas de médicos sin horario y alcance de la búsqueda de cupos
+    app.config['AGENDA_DURACION_CITA'] = int(os.environ.get('AGENDA_DURACION_CITA', 20))
+    app.config['AGENDA_DIAS_BUSQUEDA'] = int(os.environ.get('AGENDA_DIAS_BUSQUEDA', 14))
+    app.config['AGENDA_VENTANA_DIAS'] = int(os.environ.get('AGENDA_VENTANA_DIAS', 7))
+    app.config['AGENDA_CUPOS_MAXIMO'] = int(os.environ.get('AGENDA_CUPOS_MAXIMO', 50))
+
+    # Sugerencias por consulta en los campos con autocompletado
+    app.config['AUTOCOMPLETAR_LIMITE'] = int(os.environ.get('AUTOCOMPLETAR_LIMITE', 20))
+
+    # Importación masiva de pacientes: filas por lote y carpeta de reportes de errores
+    app.config['IMPORTACION_LOTE'] = int(os.environ.get('IMPORTACION_LOTE', 1000))
+    app.config['IMPORTACION_DIRECTORIO'] = os.environ.get(
+        'IMPORTACION_DIRECTORIO', os.path.join(app.instance_path, 'importaciones')
+    )
+
+    # GET condicional (ETag / Last-Modified / 304) en listados, tiquetes y PDF
+    app.config['RESPUESTAS_CONDICIONALES'] = os.environ.get('RESPUESTAS_CONDICIONALES', '1') == '1'
+
+    # Réplicas de lectura: se registran como binds antes de crear los motores
+    from .replicas import replicas
+    replicas.init_app(app)
+
     # Inicializar extensiones
     db.init_app(app)
+    # Migraciones de esquema (Alembic); render_as_batch permite ALTER TABLE en SQLite
+    migrate.init_app(app, db, directory=os.path.join(os.path.dirname(app.root_path), 'migrations'),
+                     render_as_batch=True)
+    from .metricas import metricas
+    with app.app_context():
+        # Crea el motor (sin conectar) y registra WAL/busy_timeout o el timeout por transacción
+        configurar_motor(db.engine)
+        # Consultas, plantillas y PDF por petición: Server-Timing, /metrics y log de lentitud
+        metricas.init_app(app, db.engine)
+        replicas.configurar_motores(configurar_motor, metricas)
     login_manager.init_app(app)
     login_manager.login_view = 'main.index'
     login_manager.login_message = 'Por favor inicia sesión para acceder a esta página.'
     login_manager.login_message_category = 'warning'
 
+    # Cola de generación de PDF en segundo plano y caché de PDF generados
+    from .cola_pdf import cola_pdf
+    from .cache_pdf import cache_pdf
+    cola_pdf.init_app(app)
+    cache_pdf.init_app(app)
+
+    # Estáticos con huella, precomprimidos y con caché inmutable (ver app/estaticos.py)
+    from .estaticos import estaticos
+    estaticos.init_app(app)
+
     # Importar modelos
-    from .models import Usuario, Rol
+    from . import models
+
+    # Usuario autenticado y su rol en caché (sin consultas por petición)
+    from .cache_usuarios import cache_usuarios
+    cache_usuarios.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
-        return Usuario.query.get(int(user_id))
+        return cache_usuarios.cargar(int(user_id))
+
+    # Permisos por rol (también disponibles en las plantillas)
+    from .permisos import tiene_permiso
+    app.jinja_env.globals['tiene_permiso'] = tiene_permiso
 
     # Registrar el blueprint
     from .routes import main
     app.register_blueprint(main)
 
-    with app.app_context():
-        # Crear directorio instance solo si usamos SQLite
-        if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
-            os.makedirs(os.path.join(app.instance_path), exist_ok=True)
-        
-        # Crear todas las tablas
-        db.create_all()
-        
-        # Crear roles por defecto si no existen
-        if not Rol.query.first():
-            roles_por_defecto = [
-                {'nombre': 'admin', 'descripcion': 'Administrador del sistema'},
-                {'nombre': 'medico', 'descripcion': 'Profesional médico'},
-                {'nombre': 'enfermeria', 'descripcion': 'Personal de enfermería'},
-                {'nombre': 'recepcionista', 'descripcion': 'Personal de recepción'}
-            ]
-            for rol_data in roles_por_defecto:
-                rol = Rol(nombre=rol_data['nombre'], descripcion=rol_data['descripcion'])
-                db.session.add(rol)
-            db.session.commit()
-            print("✅ Roles por defecto creados")
-
-        # Crear admin por defecto si no existe
-        from werkzeug.security import generate_password_hash
-        if not Usuario.query.filter_by(email='admin@ipsfulano.com').first():
-            rol_admin = Rol.query.filter_by(nombre='admin').first()
-            if rol_admin:
-                admin = Usuario(
-                    nombre='Administrador',
-                    email='admin@ipsfulano.com',
-                    password=generate_password_hash('admin123'),
-                    rol_id=rol_admin.id,
-                    activo=True,
-                    password_cambiada=False
-                )
-                db.session.add(admin)
-                db.session.commit()
-                print("✅ Usuario admin creado")
-                print("   Email: admin@ipsfulano.com")
-                print("   Contraseña: admin123")
-
-    return app
\ No newline at end of file
+    # Comandos de CLI: `flask ips inicializar` crea tablas, índices y datos iniciales
+    from .comandos import ips_cli
+    app.cli.add_command(ips_cli)
+
+    # Crear directorio instance solo si usamos SQLite
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        os.makedirs(os.path.join(app.instance_path), exist_ok=True)
+
+    # El arranque no toca la base de datos: los workers quedan listos de inmediato
+    app.config['TIEMPO_ARRANQUE_MS'] = round((time.perf_counter() - inicio) * 1000, 1)
+    app.logger.info('Aplicación iniciada en %.1f ms', app.config['TIEMPO_ARRANQUE_MS'])
+
+    return app
@@ -0,0 +1,211 @@
+from bisect import bisect_right
+from datetime import datetime, date, timedelta
+from flask import current_app
+from app import db
+from .conexiones import bloquear_fila
+
+
+DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+
+# Restricción de exclusión de la tabla cita en PostgreSQL (migración 0007);
+# las particiones de `flask ips particionar` la llevan cada una
+EXCLUSION_CITA = (
+    "EXCLUDE USING gist (medico_id WITH =,"
+    " tsrange(fecha, fecha + duracion_minutos * interval '1 minute') WITH &&)"
+    " WHERE (estado != 'Cancelada')"
+)
+
+
+# ============================================
+# CITAS OCUPADAS
+# ============================================
+def citas_ocupadas(medico_ids, desde, hasta):
+    """
+    {medico_id: [fechas ordenadas]} de las citas activas entre `desde` y `hasta`.
+    Es una consulta de rango sobre el índice (medico_id, fecha).
+    """
+    from .models import Cita
+
+    ocupadas = {}
+    if not medico_ids:
+        return ocupadas
+    filas = db.session.execute(
+        db.select(Cita.medico_id, Cita.fecha)
+        .where(Cita.medico_id.in_(medico_ids),
+               Cita.fecha >= desde,
+               Cita.fecha < hasta,
+               Cita.estado != 'Cancelada')
+        .order_by(Cita.medico_id, Cita.fecha)
+    )
+    for medico_id, fecha in filas:
+        ocupadas.setdefault(medico_id, []).append(fecha)
+    return ocupadas
+
+
+def _choca(fechas, inicio, duracion):
+    """Indica si alguna cita de `fechas` (ordenadas) se cruza con [inicio, inicio + duracion)"""
+    # Cada cita ocupa `duracion`: se cruza si empieza a menos de `duracion` de `inicio`
+    posicion = bisect_right(fechas, inicio - duracion)
+    return posicion < len(fechas) and fechas[posicion] < inicio + duracion
+
+
+# ============================================
+# CUPOS
+# ============================================
+def _cupos_horario(horario, dia):
+    """Horas de inicio de los cupos de `horario` en la fecha `dia`"""
+    duracion = timedelta(minutes=horario.duracion_minutos)
+    inicio = datetime.combine(dia, horario.hora_inicio)
+    fin = datetime.combine(dia, horario.hora_fin)
+    while inicio + duracion <= fin:
+        yield inicio
+        inicio += duracion
+
+
+def _horarios(**filtros):
+    """Horarios de médicos activos con el nombre del médico, en una consulta"""
+    from .models import HorarioMedico, Usuario
+
+    consulta = db.select(HorarioMedico, Usuario.nombre) \
+        .join(Usuario, HorarioMedico.medico_id == Usuario.id) \
+        .where(Usuario.activo == True)
+    for columna, valor in filtros.items():
+        consulta = consulta.where(getattr(HorarioMedico, columna) == valor)
+    return db.session.execute(consulta).all()
+
+
+def _duracion_por_defecto():
+    return timedelta(minutes=current_app.config.get('AGENDA_DURACION_CITA', 20))
+
+
+def proximos_cupos(especialidad_id, cantidad=5, desde=None, dias=None):
+    """
+    Los `cantidad` cupos libres más próximos de la especialidad, entre todos
+    sus médicos, a partir de `desde` (por defecto ahora) y hasta `dias` días
+    después. Cada cupo es un dict con medico_id, medico y fecha.
+
+    Las citas se leen por ventanas de AGENDA_VENTANA_DIAS días, de modo que
+    en horas pico, cuando los cupos están cerca, basta una consulta pequeña.
+    """
+    desde = desde or datetime.now()
+    dias = dias or current_app.config.get('AGENDA_DIAS_BUSQUEDA', 14)
+    ventana = current_app.config.get('AGENDA_VENTANA_DIAS', 7)
+
+    por_dia = {}
+    for horario, nombre in _horarios(especialidad_id=especialidad_id):
+        por_dia.setdefault(horario.dia_semana, []).append((horario, nombre))
+    if not por_dia:
+        return []
+    medico_ids = {horario.medico_id for lista in por_dia.values() for horario, _ in lista}
+    # Margen para ver las citas de la víspera que ocupan el primer cupo del día
+    margen = timedelta(minutes=max(
+        horario.duracion_minutos for lista in por_dia.values() for horario, _ in lista
+    ))
+
+    cupos = []
+    primer_dia = desde.date()
+    for inicio_ventana in range(0, dias, ventana):
+        dia_inicial = primer_dia + timedelta(days=inicio_ventana)
+        dia_final = primer_dia + timedelta(days=min(inicio_ventana + ventana, dias))
+        ocupadas = citas_ocupadas(
+            medico_ids,
+            datetime.combine(dia_inicial, datetime.min.time()) - margen,
+            datetime.combine(dia_final, datetime.min.time())
+        )
+        dia = dia_inicial
+        while dia < dia_final:
+            candidatos = []
+            for horario, nombre in por_dia.get(dia.weekday(), []):
+                duracion = timedelta(minutes=horario.duracion_minutos)
+                fechas = ocupadas.get(horario.medico_id, [])
+                for inicio in _cupos_horario(horario, dia):
+                    if inicio >= desde and not _choca(fechas, inicio, duracion):
+                        candidatos.append((inicio, nombre, horario.medico_id))
+            candidatos.sort()
+            for inicio, nombre, medico_id in candidatos[:cantidad - len(cupos)]:
+                cupos.append({'medico_id': medico_id, 'medico': nombre, 'fecha': inicio})
+            if len(cupos) >= cantidad:
+                return cupos
+            dia += timedelta(days=1)
+    return cupos
+
+
+def cupos_medico(medico_id, dia, especialidad_id=None):
+    """Cupos libres del médico en la fecha `dia`, en orden"""
+    filtros = {'medico_id': medico_id, 'dia_semana': dia.weekday()}
+    if especialidad_id is not None:
+        filtros['especialidad_id'] = especialidad_id
+    horarios = [horario for horario, _ in _horarios(**filtros)]
+    if not horarios:
+        return []
+
+    inicio_dia = datetime.combine(dia, datetime.min.time())
+    margen = timedelta(minutes=max(horario.duracion_minutos for horario in horarios))
+    fechas = citas_ocupadas(
+        [medico_id], inicio_dia - margen, inicio_dia + timedelta(days=1)
+    ).get(medico_id, [])
+    libres = set()
+    for horario in horarios:
+        duracion = timedelta(minutes=horario.duracion_minutos)
+        libres.update(
+            inicio for inicio in _cupos_horario(horario, dia)
+            if not _choca(fechas, inicio, duracion)
+        )
+    return sorted(libres)
+
+
+# ============================================
+# VALIDACIÓN AL AGENDAR
+# ============================================
+def bloquear_agenda(medico_id):
+    """
+    Serializa el agendamiento de un médico hasta el commit: dos recepciones
+    que agendan al mismo médico validan una después de la otra, así la
+    segunda ve la cita de la primera aunque empiecen a horas distintas.
+    Bloquea la fila del médico (ver bloquear_fila); va antes de validar_cupo.
+    """
+    from .models import Usuario
+    bloquear_fila(db.session, Usuario, medico_id)
+
+
+def validar_cupo(medico_id, especialidad_id, fecha):
+    """
+    (mensaje de error o None, duración de la cita en minutos).
+
+    Si el médico tiene horarios configurados, `fecha` debe ser el inicio de
+    un cupo de la especialidad ese día y la cita dura lo que ese cupo; si
+    no, se acepta cualquier hora con AGENDA_DURACION_CITA. En ambos casos no
+    puede cruzarse con otra cita activa del médico. Para las solicitudes
+    simultáneas hay que llamar antes a bloquear_agenda; en PostgreSQL la
+    restricción de exclusión de la tabla cita lo garantiza además.
+    """
+    from .models import HorarioMedico
+
+    duracion = _duracion_por_defecto()
+    tiene_horarios = db.session.scalar(
+        db.select(HorarioMedico.id).where(HorarioMedico.medico_id == medico_id).limit(1)
+    )
+    if tiene_horarios:
+        horarios = [
+            horario for horario, _ in _horarios(
+                medico_id=medico_id, especialidad_id=especialidad_id, dia_semana=fecha.weekday()
+            )
+        ]
+        horario = next((h for h in horarios if fecha in set(_cupos_horario(h, fecha.date()))), None)
+        if horario is None:
+            return 'La hora elegida no corresponde a un cupo del médico en esa especialidad', None
+        duracion = timedelta(minutes=horario.duracion_minutos)
+
+    minutos = duracion // timedelta(minutes=1)
+    fechas = citas_ocupadas([medico_id], fecha - duracion, fecha + duracion).get(medico_id, [])
+    if _choca(fechas, fecha, duracion):
+        return 'El médico ya tiene una cita a esa hora', minutos
+    return None, minutos
+
+
+def parsear_dia(valor):
+    """'AAAA-MM-DD' -> date, o None si no es válido"""
+    try:
+        return date.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,50 @@
+from app import db
+from .models import Paciente, Cita, Especialidad, Usuario
+from .archivo import con_archivo, total_archivado
+
+
+def estadisticas_generales():
+    """Totales del centro de reportes en una sola consulta"""
+    fila = db.session.execute(db.select(
+        db.select(db.func.count(Paciente.id)).where(Paciente.activo == True).scalar_subquery(),
+        db.select(db.func.count(Cita.id)).scalar_subquery(),
+        db.select(db.func.count(Especialidad.id)).scalar_subquery(),
+        db.select(db.func.count(Cita.id)).where(Cita.estado == 'Pendiente').scalar_subquery()
+    )).one()
+    return {
+        'total_pacientes': fila[0],
+        # Las archivadas salen del resumen guardado en memoria, sin recorrer el archivo
+        'total_citas': fila[1] + total_archivado(Cita),
+        'total_especialidades': fila[2],
+        'citas_pendientes': fila[3]
+    }
+
+
+def citas_por_especialidad():
+    """{especialidad_id: número de citas, archivadas incluidas}"""
+    C = con_archivo(Cita)
+    return dict(db.session.execute(
+        db.select(C.especialidad_id, db.func.count(C.id)).group_by(C.especialidad_id)
+    ).all())
+
+
+def medicos_por_especialidad():
+    """{especialidad_id: [nombres de médicos con citas en ella, archivadas incluidas]}"""
+    C = con_archivo(Cita)
+    medicos = {}
+    filas = db.session.execute(
+        db.select(C.especialidad_id, Usuario.nombre)
+        .join(Usuario, C.medico_id == Usuario.id)
+        .distinct()
+        .order_by(C.especialidad_id, Usuario.nombre)
+    )
+    for especialidad_id, nombre in filas:
+        medicos.setdefault(especialidad_id, []).append(nombre)
+    return medicos
+
+
+def usuarios_por_rol():
+    """{rol_id: número de usuarios}"""
+    return dict(db.session.execute(
+        db.select(Usuario.rol_id, db.func.count(Usuario.id)).group_by(Usuario.rol_id)
+    ).all())
@@ -0,0 +1,324 @@
+import re
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy.orm import aliased
+from app import db
+from .cache_pdf import cache_pdf, registrar_modificados
+from .paginacion import paginar_keyset
+
+
+# Citas que ya no cambian y se pueden archivar
+ESTADOS_CERRADOS = ('Realizada', 'Cancelada')
+
+# Modelo caliente -> nombre del modelo de su tabla de archivo
+ARCHIVOS = {'Cita': 'CitaArchivo', 'HistoriaEntrada': 'HistoriaEntradaArchivo'}
+
+
+def modelo_archivo(modelo):
+    from . import models
+    return getattr(models, ARCHIVOS[modelo.__name__])
+
+
+def restar_meses(fecha, meses):
+    """Mismo día `meses` meses antes (o el último día de ese mes)"""
+    anio, mes = divmod(fecha.year * 12 + fecha.month - 1 - meses, 12)
+    mes += 1
+    siguiente = date(anio + mes // 12, mes % 12 + 1, 1)
+    ultimo_dia = (siguiente - date(anio, mes, 1)).days
+    return fecha.replace(year=anio, month=mes, day=min(fecha.day, ultimo_dia))
+
+
+# ============================================
+# LECTURA: ARCHIVO SOLO CUANDO HACE FALTA
+# ============================================
+def _resumen_archivo(modelo):
+    """
+    (fecha más reciente, filas) de la tabla de archivo de `modelo`. Se guarda
+    por proceso mientras no cambie la versión del modelo de archivo (que
+    `archivar` incrementa), así las consultas normales no tocan el archivo.
+    """
+    archivo = modelo_archivo(modelo)
+    resumenes = current_app.extensions.setdefault('archivo', {})
+    version = cache_pdf.version(archivo.__name__)[0]
+    guardado = resumenes.get(archivo.__name__)
+    if guardado is None or guardado[0] != version:
+        fila = db.session.execute(db.select(db.func.max(archivo.fecha), db.func.count(archivo.id))).one()
+        guardado = resumenes[archivo.__name__] = (version, tuple(fila))
+    return guardado[1]
+
+
+def limite_archivo(modelo):
+    """Fecha de la fila archivada más reciente de `modelo`, o None si el archivo está vacío"""
+    ultima, total = _resumen_archivo(modelo)
+    return ultima if total else None
+
+
+def total_archivado(modelo):
+    return _resumen_archivo(modelo)[1]
+
+
+def necesita_archivo(modelo, desde=None):
+    """¿Un rango que empieza en `desde` (None = sin límite) alcanza filas archivadas?"""
+    limite = limite_archivo(modelo)
+    return limite is not None and (desde is None or desde <= limite)
+
+
+def con_archivo(modelo, desde=None):
+    """
+    Entidad para consultar `modelo` desde `desde`: el propio modelo si el
+    rango no llega al archivo, o un alias del modelo sobre
+    UNION ALL (tabla, archivo) que se usa igual (columnas, relaciones,
+    joinedload) y devuelve instancias del modelo.
+    """
+    if not necesita_archivo(modelo, desde):
+        return modelo
+    tabla, archivo = modelo.__table__, modelo_archivo(modelo).__table__
+    nombres = [columna.name for columna in tabla.columns]
+    union = db.union_all(
+        db.select(*[tabla.c[nombre] for nombre in nombres]),
+        db.select(*[archivo.c[nombre] for nombre in nombres])
+    ).subquery(f'{tabla.name}_con_archivo')
+    return aliased(modelo, union)
+
+
+def esta_archivada(modelo, id):
+    """¿La fila `id` de `modelo` se movió al archivo?"""
+    return bool(total_archivado(modelo)) and db.session.get(modelo_archivo(modelo), id) is not None
+
+
+def obtener_con_archivo(modelo, id):
+    """Fila por id, esté en la tabla o en el archivo (None si no existe)"""
+    fila = db.session.get(modelo, id)
+    if fila is None and necesita_archivo(modelo):
+        entidad = con_archivo(modelo)
+        fila = db.session.query(entidad).filter(entidad.id == id).first()
+    return fila
+
+
+def paginar_por_fecha(construir, modelo, por_pagina, despues=None, antes=None, desde=None):
+    """
+    paginar_keyset por (fecha, id) descendente sobre `construir(entidad)`,
+    sin tocar el archivo mientras la página se llena con filas más recientes
+    que la última archivada (lo normal en las primeras páginas). Si no, se
+    repite sobre la unión con el archivo.
+    """
+    limite = limite_archivo(modelo)
+    if limite is None or (desde is not None and desde > limite):
+        return paginar_keyset(construir(modelo), modelo, [modelo.fecha, modelo.id], por_pagina,
+                              despues=despues, antes=antes, descendente=True)
+
+    cursor_en_tabla = despues is None or db.session.scalar(db.select(modelo.id).where(modelo.id == despues))
+    if antes is None and cursor_en_tabla:
+        pagina = paginar_keyset(construir(modelo), modelo, [modelo.fecha, modelo.id], por_pagina,
+                                despues=despues, descendente=True)
+        # Todo lo archivado es anterior a `limite`: no puede entrar en esta página
+        if pagina.tiene_siguiente and pagina.items[-1].fecha is not None and pagina.items[-1].fecha > limite:
+            return pagina
+
+    entidad = con_archivo(modelo, desde)
+    return paginar_keyset(construir(entidad), entidad, [entidad.fecha, entidad.id], por_pagina,
+                          despues=despues, antes=antes, descendente=True)
+
+
+# ============================================
+# ARCHIVADO
+# ============================================
+def archivar(modelo, corte, *condiciones, lote=1000):
+    """
+    Mueve a la tabla de archivo, por lotes confirmados uno a uno, las filas
+    de `modelo` con fecha anterior a `corte` que cumplan `condiciones`.
+    Devuelve cuántas movió.
+    """
+    archivo = modelo_archivo(modelo)
+    tabla = modelo.__table__
+    nombres = [columna.name for columna in tabla.columns]
+
+    # Los ids no se repiten entre tabla y archivo: secuencias en PostgreSQL y
+    # AUTOINCREMENT en SQLite (migración 0008)
+    movidas = 0
+    while True:
+        ids = db.session.scalars(
+            db.select(modelo.id)
+            .where(modelo.fecha < corte, *condiciones)
+            .order_by(modelo.id)
+            .limit(lote)
+        ).all()
+        if not ids:
+            return movidas
+        db.session.execute(archivo.__table__.insert().from_select(
+            nombres, db.select(*[tabla.c[nombre] for nombre in nombres]).where(tabla.c.id.in_(ids))
+        ))
+        db.session.execute(tabla.delete().where(tabla.c.id.in_(ids)))
+        registrar_modificados(db.session, modelo.__name__, archivo.__name__)
+        db.session.commit()
+        movidas += len(ids)
+
+
+def archivar_citas(meses, lote=1000):
+    """Citas realizadas o canceladas de hace más de `meses` meses"""
+    from .models import Cita
+    corte = datetime.combine(restar_meses(date.today(), meses), datetime.min.time())
+    return archivar(Cita, corte, Cita.estado.in_(ESTADOS_CERRADOS), lote=lote)
+
+
+def archivar_entradas_historia(meses, lote=1000):
+    """Entradas de historia de hace más de `meses` meses (dejan de aparecer en la búsqueda de texto)"""
+    from .models import HistoriaEntrada
+    corte = datetime.combine(restar_meses(date.today(), meses), datetime.min.time())
+    return archivar(HistoriaEntrada, corte, lote=lote)
+
+
+# ============================================
+# PARTICIONES (POSTGRESQL)
+# ============================================
+def _inicio_periodo(fecha, intervalo):
+    return date(fecha.year, fecha.month if intervalo == 'mes' else 1, 1)
+
+
+def _siguiente_periodo(inicio, intervalo):
+    if intervalo == 'anio':
+        return date(inicio.year + 1, 1, 1)
+    return date(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+
+
+def _nombre_particion(tabla, inicio, intervalo):
+    return f'{tabla}_p{inicio:%Y_%m}' if intervalo == 'mes' else f'{tabla}_p{inicio:%Y}'
+
+
+def esta_particionada(conexion, tabla):
+    return conexion.execute(db.text(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:tabla)'
+    ), {'tabla': tabla}).first() is not None
+
+
+def intervalo_particiones(conexion, tabla):
+    """'mes' o 'anio' según el nombre de las particiones existentes (None si no hay)"""
+    nombres = conexion.scalars(db.text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid'
+        ' WHERE i.inhparent = to_regclass(:tabla)'
+    ), {'tabla': tabla}).all()
+    for nombre in nombres:
+        if re.fullmatch(rf'{tabla}_p\d{{4}}_\d{{2}}', nombre):
+            return 'mes'
+        if re.fullmatch(rf'{tabla}_p\d{{4}}', nombre):
+            return 'anio'
+    return None
+
+
+def _columnas_insertables(conexion, tabla):
+    # Las columnas generadas (contenido_tsv) se recalculan, no se copian
+    return conexion.scalars(db.text(
+        'SELECT column_name FROM information_schema.columns'
+        " WHERE table_schema = current_schema() AND table_name = :tabla AND is_generated = 'NEVER'"
+        ' ORDER BY ordinal_position'
+    ), {'tabla': tabla}).all()
+
+
+def _restringir_particion(conexion, tabla, particion):
+    """
+    PostgreSQL no admite la exclusión de citas cruzadas en la tabla padre (no
+    es una igualdad sobre la clave de partición): va en cada partición.
+    """
+    if tabla == 'cita':
+        from .agenda import EXCLUSION_CITA
+        conexion.exec_driver_sql(f'ALTER TABLE {particion} ADD CONSTRAINT {particion}_medico_horario {EXCLUSION_CITA}')
+
+
+def crear_particiones(conexion, tabla, intervalo, desde, hasta):
+    """
+    Crea las particiones de `tabla` que falten entre `desde` y `hasta`. Las
+    filas que ya estaban en la partición por defecto para ese periodo se
+    pasan a la nueva. Devuelve los nombres creados.
+    """
+    defecto = f'{tabla}_p_defecto'
+    columnas = ', '.join(_columnas_insertables(conexion, tabla))
+    existentes = set(conexion.scalars(db.text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid'
+        ' WHERE i.inhparent = to_regclass(:tabla)'
+    ), {'tabla': tabla}).all())
+
+    creadas = []
+    inicio = _inicio_periodo(desde, intervalo)
+    while inicio <= hasta:
+        fin = _siguiente_periodo(inicio, intervalo)
+        nombre = _nombre_particion(tabla, inicio, intervalo)
+        if nombre not in existentes:
+            rango = {'inicio': inicio, 'fin': fin}
+            sacadas = 0
+            if defecto in existentes:
+                conexion.exec_driver_sql(f'CREATE TEMP TABLE _sacadas (LIKE {tabla}) ON COMMIT DROP')
+                sacadas = conexion.execute(db.text(
+                    f'WITH m AS (DELETE FROM {defecto} WHERE fecha >= :inicio AND fecha < :fin RETURNING *)'
+                    f' INSERT INTO _sacadas SELECT * FROM m'
+                ), rango).rowcount
+            # Los límites van literales: PostgreSQL no acepta parámetros en DDL
+            conexion.exec_driver_sql(
+                f"CREATE TABLE {nombre} PARTITION OF {tabla} FOR VALUES FROM ('{inicio}') TO ('{fin}')"
+            )
+            _restringir_particion(conexion, tabla, nombre)
+            if defecto in existentes:
+                if sacadas:
+                    conexion.exec_driver_sql(f'INSERT INTO {tabla} ({columnas}) SELECT {columnas} FROM _sacadas')
+                conexion.exec_driver_sql('DROP TABLE _sacadas')
+            creadas.append(nombre)
+        inicio = fin
+
+    if defecto not in existentes:
+        # Recibe lo que cae fuera de las particiones (p. ej. citas muy adelantadas)
+        conexion.exec_driver_sql(f'CREATE TABLE {defecto} PARTITION OF {tabla} DEFAULT')
+        _restringir_particion(conexion, tabla, defecto)
+        creadas.append(defecto)
+    return creadas
+
+
+def particionar(conexion, tabla, intervalo, meses_adelante):
+    """
+    Convierte `tabla` (cita o historia_entrada) en una tabla particionada por
+    rango de `fecha` con particiones por mes o por año, en una transacción:
+    copia las filas, conserva la secuencia del id, los índices (creados en
+    la tabla padre y heredados por cada partición) y las claves foráneas.
+    La clave primaria pasa a ser (id, fecha), como exige PostgreSQL, y la
+    exclusión de citas cruzadas queda por partición (_restringir_particion).
+    Si ya está particionada solo crea las particiones que falten.
+    Devuelve los nombres de las particiones creadas.
+    """
+    hasta = restar_meses(date.today(), -meses_adelante)
+    if esta_particionada(conexion, tabla):
+        return crear_particiones(conexion, tabla, intervalo, date.today(), hasta)
+
+    if conexion.scalar(db.text(f'SELECT count(*) FROM {tabla} WHERE fecha IS NULL')):
+        raise ValueError(f'{tabla} tiene filas sin fecha; asígnales una antes de particionar')
+
+    anterior = f'{tabla}_sin_particionar'
+    indices = conexion.execute(db.text(
+        'SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :tabla'
+        ' AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:tabla))'
+    ), {'tabla': tabla}).all()
+    foraneas = conexion.execute(db.text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(:tabla) AND contype = 'f'"
+    ), {'tabla': tabla}).all()
+    secuencia = conexion.scalar(db.text("SELECT pg_get_serial_sequence(:tabla, 'id')"), {'tabla': tabla})
+    minimo = conexion.scalar(db.text(f'SELECT min(fecha) FROM {tabla}'))
+    columnas = ', '.join(_columnas_insertables(conexion, tabla))
+
+    conexion.exec_driver_sql(f'ALTER TABLE {tabla} RENAME TO {anterior}')
+    if secuencia:
+        conexion.exec_driver_sql(f'ALTER SEQUENCE {secuencia} OWNED BY NONE')
+    conexion.exec_driver_sql(
+        f'CREATE TABLE {tabla} (LIKE {anterior} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE)'
+        ' PARTITION BY RANGE (fecha)'
+    )
+    creadas = crear_particiones(conexion, tabla, intervalo, minimo or date.today(), max(hasta, date.today()))
+    conexion.exec_driver_sql(f'INSERT INTO {tabla} ({columnas}) SELECT {columnas} FROM {anterior}')
+    conexion.exec_driver_sql(f'DROP TABLE {anterior}')
+    if secuencia:
+        conexion.exec_driver_sql(f'ALTER SEQUENCE {secuencia} OWNED BY {tabla}.id')
+
+    conexion.exec_driver_sql(f'ALTER TABLE {tabla} ALTER COLUMN fecha SET NOT NULL')
+    conexion.exec_driver_sql(f'ALTER TABLE {tabla} ADD CONSTRAINT {tabla}_pkey PRIMARY KEY (id, fecha)')
+    for _, definicion in indices:
+        conexion.exec_driver_sql(definicion)
+    for nombre, definicion in foraneas:
+        conexion.exec_driver_sql(f'ALTER TABLE {tabla} ADD CONSTRAINT {nombre} {definicion}')
+    conexion.exec_driver_sql(f'ANALYZE {tabla}')
+    return creadas
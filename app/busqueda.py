@@ -0,0 +1,211 @@
+import unicodedata
+from flask import current_app
+from sqlalchemy import text
+from app import db
+
+
+def normalizar_texto(texto):
+    """Minúsculas y sin tildes: 'José Peña' -> 'jose pena'"""
+    if not texto:
+        return ''
+    descompuesto = unicodedata.normalize('NFKD', texto)
+    sin_tildes = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return ' '.join(sin_tildes.casefold().split())
+
+
+# ============================================
+# ÍNDICES DE BÚSQUEDA
+# ============================================
+SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS paciente_fts USING fts5(
+        nombre_normalizado,
+        content='paciente',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS paciente_fts_ai AFTER INSERT ON paciente BEGIN
+        INSERT INTO paciente_fts(rowid, nombre_normalizado) VALUES (new.id, new.nombre_normalizado);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS paciente_fts_ad AFTER DELETE ON paciente BEGIN
+        INSERT INTO paciente_fts(paciente_fts, rowid, nombre_normalizado) VALUES ('delete', old.id, old.nombre_normalizado);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS paciente_fts_au AFTER UPDATE OF nombre_normalizado ON paciente BEGIN
+        INSERT INTO paciente_fts(paciente_fts, rowid, nombre_normalizado) VALUES ('delete', old.id, old.nombre_normalizado);
+        INSERT INTO paciente_fts(rowid, nombre_normalizado) VALUES (new.id, new.nombre_normalizado);
+    END""",
+]
+
+POSTGRES_TRIGRAM = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_paciente_nombre_trgm ON paciente USING gin (nombre_normalizado gin_trgm_ops)",
+]
+
+
+def asegurar_indices_busqueda():
+    """
+    Prepara la búsqueda de pacientes sobre una base ya migrada:
+    rellena `nombre_normalizado` donde falte y crea el índice
+    de texto del motor (FTS5 en SQLite, trigramas en PostgreSQL).
+    Devuelve el backend disponible: 'fts5', 'trigram' o 'like'.
+    """
+    from .models import Paciente
+
+    engine = db.engine
+
+    # Rellenar filas antiguas por lotes (la columna la agrega la migración 0002)
+    while True:
+        pendientes = Paciente.query.filter(Paciente.nombre_normalizado.is_(None)).limit(1000).all()
+        if not pendientes:
+            break
+        for paciente in pendientes:
+            paciente.nombre_normalizado = normalizar_texto(paciente.nombre)
+        db.session.commit()
+
+    backend = 'like'
+    try:
+        if engine.dialect.name == 'sqlite':
+            with engine.begin() as conn:
+                existia = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'paciente_fts'"
+                )).first()
+                for sentencia in SQLITE_FTS:
+                    conn.execute(text(sentencia))
+                if not existia:
+                    conn.execute(text("INSERT INTO paciente_fts(paciente_fts) VALUES ('rebuild')"))
+            backend = 'fts5'
+        elif engine.dialect.name == 'postgresql':
+            with engine.begin() as conn:
+                for sentencia in POSTGRES_TRIGRAM:
+                    conn.execute(text(sentencia))
+            backend = 'trigram'
+    except Exception as e:
+        # Sin FTS5 compilado o sin permisos para pg_trgm: búsqueda por prefijo
+        print(f"⚠️  Índice de texto no disponible, usando búsqueda por prefijo: {e}")
+
+    current_app.config['BUSQUEDA_BACKEND'] = backend
+    return backend
+
+
+def detectar_backend_busqueda():
+    """
+    Averigua qué índice de texto creó `flask ips inicializar` con una consulta
+    al catálogo. Se llama en la primera búsqueda de cada proceso y el
+    resultado queda en la configuración.
+    """
+    engine = db.engine
+    backend = 'like'
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'paciente_fts'")).first():
+                backend = 'fts5'
+        elif engine.dialect.name == 'postgresql':
+            if conn.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = 'ix_paciente_nombre_trgm'")).first():
+                backend = 'trigram'
+
+    current_app.config['BUSQUEDA_BACKEND'] = backend
+    return backend
+
+
+# ============================================
+# FILTROS
+# ============================================
+def _filtro_prefijo(columna, prefijo):
+    """
+    Filtro por prefijo que use el índice B-tree de la columna.
+
+    En PostgreSQL es LIKE 'prefijo%' (con % y _ escapados), que los índices
+    varchar_pattern_ops atienden con cualquier collation. SQLite solo usa el
+    índice con LIKE sensible a mayúsculas, así que ahí va como rango, válido
+    con su collation binaria por defecto.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        patron = prefijo.replace('/', '//').replace('%', '/%').replace('_', '/_')
+        return columna.like(patron + '%', escape='/')
+    return db.and_(columna >= prefijo, columna < prefijo + '\U0010ffff')
+
+
+def filtrar_pacientes(query, termino):
+    """Aplica la búsqueda por nombre (normalizado) o prefijo de identificación"""
+    from .models import Paciente
+
+    termino = termino.strip()
+    normalizado = normalizar_texto(termino)
+    por_identificacion = _filtro_prefijo(Paciente.identificacion, termino)
+    backend = current_app.config.get('BUSQUEDA_BACKEND') or detectar_backend_busqueda()
+
+    if backend == 'fts5':
+        tokens = [t.replace('"', '') for t in normalizado.split()]
+        tokens = [t for t in tokens if t]
+        if not tokens:
+            return query.filter(por_identificacion)
+        expresion = ' '.join(f'"{t}"*' for t in tokens)
+        ids = text('SELECT rowid FROM paciente_fts WHERE paciente_fts MATCH :expresion').bindparams(
+            expresion=expresion
+        ).columns(rowid=db.Integer)
+        por_nombre = Paciente.id.in_(ids.subquery().select())
+    elif backend == 'trigram':
+        # El índice GIN de trigramas resuelve el LIKE '%...%'
+        patron = '%' + normalizado.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        por_nombre = Paciente.nombre_normalizado.like(patron, escape='\\')
+    else:
+        por_nombre = _filtro_prefijo(Paciente.nombre_normalizado, normalizado)
+
+    return query.filter(db.or_(por_nombre, por_identificacion))
+
+
+# ============================================
+# AUTOCOMPLETADO
+# ============================================
+def _escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def sugerir_pacientes(termino, limite=20):
+    """
+    Pacientes activos cuyo nombre o identificación empieza por `termino`,
+    como dicts {id, texto}. Usa el índice de texto o los índices de prefijo
+    y solo lee las columnas que se muestran.
+    """
+    from .models import Paciente
+
+    if len(termino.strip()) < 2:
+        return []
+    consulta = filtrar_pacientes(
+        db.select(Paciente.id, Paciente.nombre, Paciente.identificacion).where(Paciente.activo == True),
+        termino
+    ).order_by(Paciente.nombre, Paciente.id).limit(limite)
+    return [
+        {'id': id, 'texto': f'{nombre} ({identificacion})'}
+        for id, nombre, identificacion in db.session.execute(consulta)
+    ]
+
+
+def sugerir_medicos(termino, limite=20):
+    """Médicos activos con alguna palabra del nombre que empieza por `termino`"""
+    from .models import Usuario, Rol
+
+    consulta = db.select(Usuario.id, Usuario.nombre) \
+        .join(Rol, Usuario.rol_id == Rol.id) \
+        .where(Rol.nombre == 'medico', Usuario.activo == True)
+    termino = _escapar_like(termino.strip())
+    if termino:
+        consulta = consulta.where(db.or_(
+            Usuario.nombre.ilike(termino + '%', escape='\\'),
+            Usuario.nombre.ilike('% ' + termino + '%', escape='\\')
+        ))
+    consulta = consulta.order_by(Usuario.nombre).limit(limite)
+    return [{'id': id, 'texto': nombre} for id, nombre in db.session.execute(consulta)]
+
+
+def sugerir_especialidades(termino, limite=20):
+    """Especialidades cuyo nombre empieza por `termino`"""
+    from .models import Especialidad
+
+    consulta = db.select(Especialidad.id, Especialidad.nombre)
+    termino = _escapar_like(termino.strip())
+    if termino:
+        consulta = consulta.where(Especialidad.nombre.ilike(termino + '%', escape='\\'))
+    consulta = consulta.order_by(Especialidad.nombre).limit(limite)
+    return [{'id': id, 'texto': nombre} for id, nombre in db.session.execute(consulta)]
+
@@ -0,0 +1,239 @@
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import text
+from app import db
+from .busqueda import normalizar_texto
+
+
+# Marcadores de resaltado (caracteres de uso privado, no aparecen en el texto)
+INICIO_MARCA = '\ue000'
+FIN_MARCA = '\ue001'
+
+
+# ============================================
+# ÍNDICES DE TEXTO DE LAS ENTRADAS
+# ============================================
+# Tabla FTS5 de contenido externo: los triggers la mantienen al insertar,
+# editar o eliminar entradas, sin reindexar la tabla completa
+SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS historia_entrada_fts USING fts5(
+        contenido,
+        content='historia_entrada',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS historia_entrada_fts_ai AFTER INSERT ON historia_entrada BEGIN
+        INSERT INTO historia_entrada_fts(rowid, contenido) VALUES (new.id, new.contenido);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS historia_entrada_fts_ad AFTER DELETE ON historia_entrada BEGIN
+        INSERT INTO historia_entrada_fts(historia_entrada_fts, rowid, contenido) VALUES ('delete', old.id, old.contenido);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS historia_entrada_fts_au AFTER UPDATE OF contenido ON historia_entrada BEGIN
+        INSERT INTO historia_entrada_fts(historia_entrada_fts, rowid, contenido) VALUES ('delete', old.id, old.contenido);
+        INSERT INTO historia_entrada_fts(rowid, contenido) VALUES (new.id, new.contenido);
+    END""",
+]
+
+# Columna generada: PostgreSQL la recalcula en cada INSERT/UPDATE de la fila
+POSTGRES_TSVECTOR = [
+    """ALTER TABLE historia_entrada ADD COLUMN IF NOT EXISTS contenido_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('spanish', coalesce(contenido, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_historia_entrada_contenido_tsv ON historia_entrada USING gin (contenido_tsv)",
+]
+
+
+def asegurar_indice_historias():
+    """
+    Crea el índice de texto de las entradas de historia (FTS5 en SQLite,
+    tsvector + GIN con diccionario español en PostgreSQL).
+    Devuelve el backend disponible: 'fts5', 'tsvector' o 'like'.
+    """
+    engine = db.engine
+    backend = 'like'
+    try:
+        if engine.dialect.name == 'sqlite':
+            with engine.begin() as conn:
+                existia = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'historia_entrada_fts'"
+                )).first()
+                for sentencia in SQLITE_FTS:
+                    conn.execute(text(sentencia))
+                if not existia:
+                    conn.execute(text("INSERT INTO historia_entrada_fts(historia_entrada_fts) VALUES ('rebuild')"))
+            backend = 'fts5'
+        elif engine.dialect.name == 'postgresql':
+            with engine.begin() as conn:
+                for sentencia in POSTGRES_TSVECTOR:
+                    conn.execute(text(sentencia))
+            backend = 'tsvector'
+    except Exception as e:
+        print(f"⚠️  Índice de texto de historias no disponible, usando LIKE: {e}")
+
+    current_app.config['BUSQUEDA_HISTORIAS_BACKEND'] = backend
+    return backend
+
+
+def detectar_backend_historias():
+    """Consulta al catálogo qué índice existe; se llama en la primera búsqueda del proceso"""
+    engine = db.engine
+    backend = 'like'
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'historia_entrada_fts'")).first():
+                backend = 'fts5'
+        elif engine.dialect.name == 'postgresql':
+            if conn.execute(text(
+                "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_historia_entrada_contenido_tsv'"
+            )).first():
+                backend = 'tsvector'
+
+    current_app.config['BUSQUEDA_HISTORIAS_BACKEND'] = backend
+    return backend
+
+
+# ============================================
+# BÚSQUEDA
+# ============================================
+def resaltar(fragmento):
+    """Escapa el fragmento y convierte los marcadores en <mark>"""
+    seguro = str(escape(fragmento))
+    return Markup(seguro.replace(INICIO_MARCA, '<mark>').replace(FIN_MARCA, '</mark>'))
+
+
+def _expresion_fts(termino):
+    """'dolor cabeza' -> '"dolor"* "cabeza"*' (todas las palabras, por prefijo)"""
+    tokens = [t.replace('"', '') for t in normalizar_texto(termino).split()]
+    return ' '.join(f'"{t}"*' for t in tokens if t)
+
+
+def _fragmento_like(contenido, termino, ancho=80):
+    """Fragmento alrededor de la primera coincidencia (búsqueda sin índice de texto)"""
+    posicion = contenido.lower().find(termino.lower())
+    if posicion < 0:
+        return contenido[:ancho * 2]
+    inicio = max(0, posicion - ancho)
+    fin = posicion + len(termino)
+    return (
+        ('…' if inicio else '') + contenido[inicio:posicion] + INICIO_MARCA + contenido[posicion:fin]
+        + FIN_MARCA + contenido[fin:fin + ancho] + ('…' if fin + ancho < len(contenido) else '')
+    )
+
+
+def buscar_entradas(termino, paciente_id=None, limite=50):
+    """
+    Entradas cuyo contenido coincide con `termino`, de mayor a menor relevancia,
+    opcionalmente solo las de un paciente. Cada resultado es un dict con
+    entrada_id, fecha, paciente_id, paciente_nombre, autor_nombre y fragmento
+    (Markup con las coincidencias resaltadas).
+    """
+    from .models import HistoriaEntrada, HistoriaClinica, Paciente, Usuario
+
+    termino = termino.strip()
+    if not termino:
+        return []
+    backend = current_app.config.get('BUSQUEDA_HISTORIAS_BACKEND') or detectar_backend_historias()
+
+    columnas = [
+        HistoriaEntrada.id.label('entrada_id'),
+        HistoriaEntrada.fecha,
+        Paciente.id.label('paciente_id'),
+        Paciente.nombre.label('paciente_nombre'),
+        Usuario.nombre.label('autor_nombre'),
+    ]
+
+    def _con_paciente_y_autor(consulta):
+        consulta = consulta.join(HistoriaClinica, HistoriaEntrada.historia_id == HistoriaClinica.id) \
+            .join(Paciente, HistoriaClinica.paciente_id == Paciente.id) \
+            .join(Usuario, HistoriaEntrada.autor_id == Usuario.id)
+        if paciente_id is not None:
+            consulta = consulta.where(HistoriaClinica.paciente_id == paciente_id)
+        return consulta
+
+    # La relevancia se calcula sobre las `candidatos` coincidencias más recientes,
+    # así un término muy frecuente no obliga a puntuar millones de entradas
+    candidatos = current_app.config.get('HISTORIA_BUSQUEDA_CANDIDATOS', 5000)
+
+    if backend == 'fts5':
+        expresion = _expresion_fts(termino)
+        if not expresion:
+            return []
+        condiciones = 'historia_entrada_fts MATCH :expresion'
+        parametros = {'expresion': expresion}
+        if paciente_id is not None:
+            condiciones += (
+                ' AND rowid IN (SELECT historia_entrada.id FROM historia_entrada'
+                ' JOIN historia_clinica ON historia_clinica.id = historia_entrada.historia_id'
+                ' WHERE historia_clinica.paciente_id = :paciente_id)'
+            )
+            parametros['paciente_id'] = paciente_id
+
+        # rowid de la coincidencia número `candidatos` (recorrido del índice, sin puntuar)
+        corte = db.session.execute(text(
+            f'SELECT rowid FROM historia_entrada_fts WHERE {condiciones}'
+            ' ORDER BY rowid DESC LIMIT 1 OFFSET :desplazamiento'
+        ), dict(parametros, desplazamiento=candidatos - 1)).scalar()
+        if corte is not None:
+            condiciones += ' AND rowid >= :corte'
+            parametros['corte'] = corte
+
+        # Clasificación, LIMIT y fragmento dentro de FTS5
+        mejores = text(
+            'SELECT rowid AS id, rank AS rango,'
+            " snippet(historia_entrada_fts, 0, :inicio, :fin, '…', 24) AS fragmento"
+            f' FROM historia_entrada_fts WHERE {condiciones}'
+            ' ORDER BY rank LIMIT :limite'
+        ).bindparams(**parametros, limite=limite, inicio=INICIO_MARCA, fin=FIN_MARCA).columns(
+            id=db.Integer, rango=db.Float, fragmento=db.Text
+        ).subquery('mejores')
+        consulta = _con_paciente_y_autor(
+            db.select(*columnas, mejores.c.fragmento)
+            .select_from(mejores)
+            .join(HistoriaEntrada, HistoriaEntrada.id == mejores.c.id)
+        ).order_by(mejores.c.rango, HistoriaEntrada.fecha.desc())
+        filas = db.session.execute(consulta).all()
+
+    elif backend == 'tsvector':
+        consulta_ts = db.func.websearch_to_tsquery('spanish', termino)
+        tsv = db.literal_column('historia_entrada.contenido_tsv')
+
+        recientes = db.select(HistoriaEntrada.id).where(tsv.op('@@')(consulta_ts))
+        if paciente_id is not None:
+            recientes = recientes.where(HistoriaEntrada.historia_id.in_(
+                db.select(HistoriaClinica.id).where(HistoriaClinica.paciente_id == paciente_id)
+            ))
+        recientes = recientes.order_by(HistoriaEntrada.id.desc()).limit(candidatos).subquery()
+
+        # Mejores resultados entre los candidatos; ts_headline solo sobre ellos
+        rango = db.func.ts_rank_cd(tsv, consulta_ts)
+        mejores = _con_paciente_y_autor(
+            db.select(*columnas, HistoriaEntrada.contenido, rango.label('rango'))
+            .join(recientes, recientes.c.id == HistoriaEntrada.id)
+        ).order_by(db.desc('rango'), HistoriaEntrada.fecha.desc()).limit(limite).subquery()
+        fragmento = db.func.ts_headline(
+            'spanish', mejores.c.contenido, consulta_ts,
+            f'StartSel={INICIO_MARCA}, StopSel={FIN_MARCA}, MaxFragments=2, MaxWords=24, MinWords=8'
+        )
+        filas = db.session.execute(
+            db.select(mejores.c.entrada_id, mejores.c.fecha, mejores.c.paciente_id,
+                      mejores.c.paciente_nombre, mejores.c.autor_nombre, fragmento.label('fragmento'))
+            .order_by(mejores.c.rango.desc(), mejores.c.fecha.desc())
+        ).all()
+
+    else:
+        patron = '%' + termino.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        consulta = _con_paciente_y_autor(
+            db.select(*columnas, HistoriaEntrada.contenido)
+            .where(HistoriaEntrada.contenido.ilike(patron, escape='\\'))
+        ).order_by(HistoriaEntrada.fecha.desc()).limit(limite)
+        filas = [
+            dict(fila._mapping, fragmento=_fragmento_like(fila.contenido, termino))
+            for fila in db.session.execute(consulta)
+        ]
+
+    resultados = []
+    for fila in filas:
+        datos = dict(fila) if isinstance(fila, dict) else dict(fila._mapping)
+        datos.pop('contenido', None)
+        datos['fragmento'] = resaltar(datos['fragmento'] or '')
+        resultados.append(datos)
+    return resultados
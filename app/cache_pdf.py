@@ -0,0 +1,153 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+# Modelos con contador de versión: sus cambios invalidan los PDF que dependen
+# de ellos y los validadores de las respuestas condicionales (app/condicional.py)
+MODELOS_VIGILADOS = ('Paciente', 'Cita', 'HistoriaEntrada', 'HistoriaClinica', 'Especialidad', 'Usuario', 'Rol')
+
+
+class CachePDF:
+    """
+    Caché en disco de PDF generados, direccionada por contenido.
+
+    La clave combina la plantilla, una huella barata de los datos (conteos,
+    fechas máximas, parámetros) y la versión de cada modelo del que depende el
+    reporte. Las versiones se guardan como archivos en el directorio de la caché
+    para que todos los workers las compartan; al confirmar una escritura sobre
+    un modelo vigilado su versión cambia y las entradas viejas dejan de usarse
+    hasta que la expulsión LRU las borra.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PDF_CACHE', os.environ.get('PDF_CACHE', '1') == '1')
+        app.config.setdefault('PDF_CACHE_DIRECTORIO', os.path.join(app.instance_path, 'pdf_cache'))
+        app.config.setdefault('PDF_CACHE_MAX_MB', int(os.environ.get('PDF_CACHE_MAX_MB', 200)))
+        self.app = app
+        app.extensions['cache_pdf'] = self
+
+    @property
+    def activa(self):
+        return self.app is not None and self.app.config['PDF_CACHE']
+
+    @property
+    def directorio(self):
+        return self.app.config['PDF_CACHE_DIRECTORIO']
+
+    # --- Versiones por modelo ---
+    def _ruta_version(self, modelo):
+        return os.path.join(self.directorio, f'.version_{modelo}')
+
+    def version(self, *modelos):
+        versiones = []
+        for modelo in modelos:
+            try:
+                with open(self._ruta_version(modelo)) as f:
+                    versiones.append(f.read())
+            except FileNotFoundError:
+                versiones.append('0')
+        return tuple(versiones)
+
+    def invalidar(self, *modelos):
+        os.makedirs(self.directorio, exist_ok=True)
+        for modelo in modelos:
+            ruta = self._ruta_version(modelo)
+            temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}'
+            with open(temporal, 'w') as f:
+                f.write(str(time.time_ns()))
+            os.replace(temporal, ruta)
+
+    # --- Entradas ---
+    def clave(self, plantilla, huella, dependencias):
+        material = repr((plantilla, tuple(huella), self.version(*dependencias)))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f'{clave}.pdf')
+
+    def obtener(self, clave):
+        """Ruta del PDF en caché o None; marca la entrada como usada (LRU)"""
+        ruta = self._ruta(clave)
+        try:
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        return ruta
+
+    def guardar(self, clave, pdf):
+        """Guarda `pdf` (bytes o ruta de un archivo existente) bajo `clave`"""
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = self._ruta(clave)
+        temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        if isinstance(pdf, (bytes, bytearray)):
+            with open(temporal, 'wb') as f:
+                f.write(pdf)
+        else:
+            shutil.copyfile(pdf, temporal)
+        os.replace(temporal, ruta)
+        self._expulsar()
+
+    def _expulsar(self):
+        """Borra las entradas menos usadas recientemente hasta quedar bajo el límite"""
+        limite = self.app.config['PDF_CACHE_MAX_MB'] * 1024 * 1024
+        with self._lock:
+            entradas = []
+            total = 0
+            for entrada in os.scandir(self.directorio):
+                if entrada.name.endswith('.pdf'):
+                    info = entrada.stat()
+                    entradas.append((info.st_mtime, info.st_size, entrada.path))
+                    total += info.st_size
+            entradas.sort()
+            for _, tamano, ruta in entradas:
+                if total <= limite:
+                    break
+                try:
+                    os.remove(ruta)
+                    total -= tamano
+                except FileNotFoundError:
+                    pass
+
+
+cache_pdf = CachePDF()
+
+
+# ============================================
+# INVALIDACIÓN DESDE LA SESIÓN
+# ============================================
+def registrar_modificados(session, *modelos):
+    """Marca `modelos` como modificados en la transacción (para escrituras con Core, que no pasan por el flush)"""
+    session.info.setdefault('modelos_modificados', set()).update(modelos)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_modelos_modificados(session, flush_context):
+    registrar_modificados(session, *(
+        type(obj).__name__
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if type(obj).__name__ in MODELOS_VIGILADOS
+    ))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_modelos_modificados(session):
+    modificados = session.info.pop('modelos_modificados', None)
+    # Las versiones se actualizan aunque la caché esté desactivada: también son validadores HTTP
+    if modificados and cache_pdf.app is not None:
+        cache_pdf.invalidar(*modificados)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_modelos_modificados(session):
+    session.info.pop('modelos_modificados', None)
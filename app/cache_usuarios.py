@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+
+
+# La contraseña no se guarda en caché: se carga de la base solo si se necesita
+CAMPOS_USUARIO = ('id', 'nombre', 'email', 'rol_id', 'activo', 'password_cambiada')
+CAMPOS_ROL = ('id', 'nombre', 'descripcion')
+
+
+class BackendMemoria:
+    """Caché por proceso con expiración"""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            return valor
+
+    def guardar(self, clave, valor, ttl):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ttl, valor)
+
+    def eliminar(self, *claves):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+    def vaciar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class BackendRedis:
+    """Caché compartida entre workers (requiere el paquete `redis`)"""
+
+    PREFIJO = 'ips:usuario:'
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def obtener(self, clave):
+        valor = self._redis.get(self.PREFIJO + clave)
+        return json.loads(valor) if valor else None
+
+    def guardar(self, clave, valor, ttl):
+        self._redis.set(self.PREFIJO + clave, json.dumps(valor), ex=max(1, int(ttl)))
+
+    def eliminar(self, *claves):
+        if claves:
+            self._redis.delete(*[self.PREFIJO + c for c in claves])
+
+    def vaciar(self):
+        claves = list(self._redis.scan_iter(self.PREFIJO + '*'))
+        if claves:
+            self._redis.delete(*claves)
+
+
+class CacheUsuarios:
+    """
+    Caché del usuario autenticado y su rol para el user_loader de Flask-Login.
+
+    Guarda solo los valores de las columnas; en cada petición se reconstruye
+    el Usuario (con su Rol) y se adjunta a la sesión con merge(load=False),
+    sin consultar la base. Las escrituras sobre Usuario o Rol invalidan la
+    caché al confirmar la transacción.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USUARIOS_CACHE_TTL', int(os.environ.get('USUARIOS_CACHE_TTL', 30)))
+        app.config.setdefault('USUARIOS_CACHE_REDIS_URL', os.environ.get('USUARIOS_CACHE_REDIS_URL'))
+
+        self.ttl = app.config['USUARIOS_CACHE_TTL']
+        if app.config['USUARIOS_CACHE_REDIS_URL']:
+            self.backend = BackendRedis(app.config['USUARIOS_CACHE_REDIS_URL'])
+        else:
+            self.backend = BackendMemoria()
+        app.extensions['cache_usuarios'] = self
+
+    def cargar(self, usuario_id):
+        """Devuelve el Usuario adjunto a la sesión actual, o None si no existe"""
+        from .models import Usuario
+
+        datos = self.backend.obtener(str(usuario_id)) if self.ttl > 0 else None
+        if datos is None:
+            usuario = db.session.get(Usuario, usuario_id, options=[joinedload(Usuario.rol)])
+            if usuario is not None and self.ttl > 0:
+                self.backend.guardar(str(usuario_id), self._serializar(usuario), self.ttl)
+            return usuario
+        return self._reconstruir(datos)
+
+    def _serializar(self, usuario):
+        return {
+            'usuario': {campo: getattr(usuario, campo) for campo in CAMPOS_USUARIO},
+            'rol': {campo: getattr(usuario.rol, campo) for campo in CAMPOS_ROL} if usuario.rol else None
+        }
+
+    def _reconstruir(self, datos):
+        from .models import Usuario, Rol
+
+        usuario = Usuario()
+        for campo, valor in datos['usuario'].items():
+            set_committed_value(usuario, campo, valor)
+
+        rol = None
+        if datos['rol'] is not None:
+            rol = Rol()
+            for campo, valor in datos['rol'].items():
+                set_committed_value(rol, campo, valor)
+            make_transient_to_detached(rol)
+        set_committed_value(usuario, 'rol', rol)
+        make_transient_to_detached(usuario)
+
+        return db.session.merge(usuario, load=False)
+
+    def invalidar(self, *usuario_ids):
+        self.backend.eliminar(*[str(i) for i in usuario_ids])
+
+    def vaciar(self):
+        self.backend.vaciar()
+
+
+cache_usuarios = CacheUsuarios()
+
+
+# ============================================
+# INVALIDACIÓN DESDE LA SESIÓN
+# ============================================
+@event.listens_for(Session, 'after_flush')
+def _registrar_usuarios_modificados(session, flush_context):
+    from .models import Usuario, Rol
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Usuario) and obj.id is not None:
+            session.info.setdefault('usuarios_modificados', set()).add(obj.id)
+        elif isinstance(obj, Rol):
+            session.info['roles_modificados'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidar_usuarios_modificados(session):
+    usuarios = session.info.pop('usuarios_modificados', None)
+    roles = session.info.pop('roles_modificados', None)
+    if cache_usuarios.backend is None:
+        return
+    if roles:
+        cache_usuarios.vaciar()
+    elif usuarios:
+        cache_usuarios.invalidar(*usuarios)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_usuarios_modificados(session):
+    session.info.pop('usuarios_modificados', None)
+    session.info.pop('roles_modificados', None)
@@ -0,0 +1,322 @@
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from app import db
+from .cache_pdf import cache_pdf
+from .metricas import metricas
+from .pdf_lotes import TiempoAgotado, escribir_html, maquetar
+
+
+# 'spawn' evita heredar conexiones de base de datos e hilos del worker web
+_contexto_mp = multiprocessing.get_context('spawn')
+
+# Clave de pg_advisory_xact_lock que serializa las reservas de cupo entre workers
+_BLOQUEO_CUPOS = 0x504446
+
+# Margen sobre PDF_TIMEOUT antes de dar por muerto un trabajo en 'procesando'
+_MARGEN_HUERFANOS = 60
+
+
+class ColaLlena(Exception):
+    """Se alcanzó el máximo de trabajos PDF pendientes"""
+
+
+def _maquetar_pdf(archivos_html, ruta, progreso):
+    """Proceso hijo: solo maquetación con WeasyPrint, sin acceso a la base de datos"""
+    maquetar(archivos_html, ruta, progreso)
+
+
+# ============================================
+# ALMACENES DE ESTADO
+# ============================================
+class AlmacenMemoria:
+    """
+    Estado de los trabajos en memoria del proceso. Solo sirve con un único
+    proceso (servidor de desarrollo o gunicorn con un worker): otro worker no
+    ve el trabajo y su estado y descarga responden 404.
+    """
+
+    def __init__(self):
+        self._trabajos = {}
+        self._lock = threading.Lock()
+
+    def crear(self, datos):
+        with self._lock:
+            self._trabajos[datos['id']] = dict(datos)
+
+    def actualizar(self, trabajo_id, **campos):
+        with self._lock:
+            if trabajo_id in self._trabajos:
+                self._trabajos[trabajo_id].update(campos)
+
+    def obtener(self, trabajo_id):
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+            return dict(trabajo) if trabajo else None
+
+    def activos(self):
+        with self._lock:
+            return sum(1 for t in self._trabajos.values() if t['estado'] in ('pendiente', 'procesando'))
+
+    def reservar(self, trabajo_id, maximo, vencimiento):
+        with self._lock:
+            ocupados = sum(1 for t in self._trabajos.values()
+                           if t['estado'] == 'procesando' and t['iniciado'] >= vencimiento)
+            trabajo = self._trabajos.get(trabajo_id)
+            if trabajo is None or trabajo['estado'] != 'pendiente' or ocupados >= maximo:
+                return False
+            trabajo.update(estado='procesando', progreso=10, iniciado=datetime.utcnow())
+            return True
+
+    def huerfanos(self, vencimiento):
+        with self._lock:
+            return [t['id'] for t in self._trabajos.values()
+                    if t['estado'] == 'procesando' and t['iniciado'] < vencimiento]
+
+    def vencidos(self, limite):
+        with self._lock:
+            return [t['id'] for t in self._trabajos.values() if t['creado'] < limite]
+
+    def eliminar(self, trabajo_id):
+        with self._lock:
+            self._trabajos.pop(trabajo_id, None)
+
+
+class AlmacenDB:
+    """Estado de los trabajos en la tabla trabajo_pdf (compartido entre workers)"""
+
+    def _modelo(self):
+        from .models import TrabajoPDF
+        return TrabajoPDF
+
+    def crear(self, datos):
+        db.session.add(self._modelo()(**datos))
+        db.session.commit()
+
+    def actualizar(self, trabajo_id, **campos):
+        self._modelo().query.filter_by(id=trabajo_id).update(campos)
+        db.session.commit()
+
+    def obtener(self, trabajo_id):
+        trabajo = db.session.get(self._modelo(), trabajo_id)
+        if not trabajo:
+            return None
+        db.session.refresh(trabajo)
+        return {c.name: getattr(trabajo, c.name) for c in trabajo.__table__.columns}
+
+    def activos(self):
+        TrabajoPDF = self._modelo()
+        return TrabajoPDF.query.filter(TrabajoPDF.estado.in_(['pendiente', 'procesando'])).count()
+
+    def reservar(self, trabajo_id, maximo, vencimiento):
+        """Pasa el trabajo a 'procesando' si quedan cupos en toda la máquina (un solo UPDATE)"""
+        TrabajoPDF = self._modelo()
+        if db.engine.dialect.name == 'postgresql':
+            # En READ COMMITTED dos UPDATE simultáneos verían el mismo conteo;
+            # SQLite ya serializa las escrituras
+            db.session.execute(db.text('SELECT pg_advisory_xact_lock(:clave)'), {'clave': _BLOQUEO_CUPOS},
+                               bind_arguments={'bind': db.engine})
+        ocupados = (
+            db.select(db.func.count())
+            .select_from(TrabajoPDF)
+            .where(TrabajoPDF.estado == 'procesando', TrabajoPDF.iniciado >= vencimiento)
+            .scalar_subquery()
+        )
+        filas = TrabajoPDF.query.filter(
+            TrabajoPDF.id == trabajo_id, TrabajoPDF.estado == 'pendiente', ocupados < maximo
+        ).update({'estado': 'procesando', 'progreso': 10, 'iniciado': datetime.utcnow()},
+                 synchronize_session=False)
+        db.session.commit()
+        return filas == 1
+
+    def huerfanos(self, vencimiento):
+        TrabajoPDF = self._modelo()
+        consulta = TrabajoPDF.query.filter(TrabajoPDF.estado == 'procesando', TrabajoPDF.iniciado < vencimiento)
+        return [t.id for t in consulta.with_entities(TrabajoPDF.id)]
+
+    def vencidos(self, limite):
+        TrabajoPDF = self._modelo()
+        return [t.id for t in TrabajoPDF.query.filter(TrabajoPDF.creado < limite).with_entities(TrabajoPDF.id)]
+
+    def eliminar(self, trabajo_id):
+        self._modelo().query.filter_by(id=trabajo_id).delete()
+        db.session.commit()
+
+
+# ============================================
+# COLA
+# ============================================
+class ColaPDF:
+    """
+    Genera los PDF fuera del hilo de la petición.
+
+    La plantilla se renderiza en un hilo de fondo (con contexto de aplicación)
+    y la maquetación de WeasyPrint corre en un proceso hijo. PDF_TIMEOUT
+    cuenta desde que el trabajo toma un cupo y cubre las dos fases: el HTML
+    se revisa entre lotes (un lote en curso no se interrumpe) y el proceso de
+    maquetación se termina al vencer.
+
+    Con PDF_COLA_BACKEND=db (por defecto) el estado vive en la tabla
+    trabajo_pdf y los límites son de toda la máquina: PDF_MAX_PENDIENTES
+    cuenta los trabajos pendientes o en proceso de todos los workers y
+    PDF_MAX_CONCURRENTES los que están en 'procesando'; cada trabajo espera
+    su cupo antes de empezar. Con 'memoria' todo es del proceso y solo sirve
+    con un worker.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PDF_ASINCRONO', os.environ.get('PDF_ASINCRONO', '1') == '1')
+        app.config.setdefault('PDF_COLA_BACKEND', os.environ.get('PDF_COLA_BACKEND', 'db'))
+        app.config.setdefault('PDF_MAX_CONCURRENTES', int(os.environ.get('PDF_MAX_CONCURRENTES', 2)))
+        app.config.setdefault('PDF_MAX_PENDIENTES', int(os.environ.get('PDF_MAX_PENDIENTES', 20)))
+        app.config.setdefault('PDF_TIMEOUT', int(os.environ.get('PDF_TIMEOUT', 120)))
+        app.config.setdefault('PDF_RETENCION', int(os.environ.get('PDF_RETENCION', 3600)))
+        app.config.setdefault('PDF_DIRECTORIO', os.path.join(app.instance_path, 'pdf'))
+        app.config.setdefault('PDF_LOTE_FILAS', int(os.environ.get('PDF_LOTE_FILAS', 2000)))
+
+        self.app = app
+        self.almacen = AlmacenDB() if app.config['PDF_COLA_BACKEND'] == 'db' else AlmacenMemoria()
+        app.extensions['cola_pdf'] = self
+
+    @property
+    def executor(self):
+        # Se crea al primer uso para no iniciar hilos antes del fork de gunicorn
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.app.config['PDF_MAX_CONCURRENTES'],
+                    thread_name_prefix='pdf'
+                )
+            return self._executor
+
+    def ruta_archivo(self, trabajo_id):
+        return os.path.join(self.app.config['PDF_DIRECTORIO'], f'{trabajo_id}.pdf')
+
+    def encolar(self, plantilla, generador, nombre_archivo, descarga=False, usuario_id=None,
+                clave_cache=None, clave_lotes=None):
+        """
+        Registra un trabajo y devuelve su id de inmediato.
+        `generador()` debe devolver el contexto de la plantilla; se ejecuta en el hilo de fondo.
+        Si se indica `clave_cache`, el PDF terminado se guarda también en la caché.
+        `clave_lotes` nombra la variable del contexto que se maqueta por lotes.
+        """
+        self.limpiar()
+        if self.almacen.activos() >= self.app.config['PDF_MAX_PENDIENTES']:
+            raise ColaLlena()
+
+        trabajo_id = uuid.uuid4().hex
+        self.almacen.crear({
+            'id': trabajo_id,
+            'usuario_id': usuario_id,
+            'nombre_archivo': nombre_archivo,
+            'descarga': descarga,
+            'estado': 'pendiente',
+            'progreso': 0,
+            'error': None,
+            'creado': datetime.utcnow(),
+            'iniciado': None,
+            'terminado': None
+        })
+        self.executor.submit(self._ejecutar, trabajo_id, plantilla, generador, clave_cache, clave_lotes)
+        return trabajo_id
+
+    def estado(self, trabajo_id):
+        return self.almacen.obtener(trabajo_id)
+
+    def _ejecutar(self, trabajo_id, plantilla, generador, clave_cache, clave_lotes):
+        with self.app.app_context():
+            os.makedirs(self.app.config['PDF_DIRECTORIO'], exist_ok=True)
+            temporal = tempfile.mkdtemp(dir=self.app.config['PDF_DIRECTORIO'])
+            try:
+                if not self._esperar_cupo(trabajo_id):
+                    return
+                limite = time.monotonic() + self.app.config['PDF_TIMEOUT']
+                with metricas.medir_pdf(plantilla, 'html'):
+                    archivos_html = escribir_html(plantilla, generador(), temporal, clave_lotes, limite)
+                # Liberar la conexión antes de la maquetación, que puede tardar
+                db.session.remove()
+                self.almacen.actualizar(trabajo_id, progreso=40)
+
+                ruta = self.ruta_archivo(trabajo_id)
+                inicio_maquetacion = time.monotonic()
+                progreso = _contexto_mp.Value('i', 40)
+                proceso = _contexto_mp.Process(target=_maquetar_pdf, args=(archivos_html, ruta, progreso), daemon=True)
+                proceso.start()
+
+                ultimo = 40
+                while proceso.is_alive() and time.monotonic() < limite:
+                    proceso.join(timeout=0.5)
+                    if progreso.value != ultimo:
+                        ultimo = progreso.value
+                        self.almacen.actualizar(trabajo_id, progreso=ultimo)
+
+                if proceso.is_alive():
+                    proceso.terminate()
+                    proceso.join()
+                    raise TiempoAgotado()
+                if proceso.exitcode != 0:
+                    raise RuntimeError(f'La maquetación falló (código {proceso.exitcode})')
+                metricas.observar_pdf(plantilla, 'maquetacion', time.monotonic() - inicio_maquetacion)
+
+                if clave_cache and cache_pdf.activa:
+                    cache_pdf.guardar(clave_cache, ruta)
+
+                self.almacen.actualizar(
+                    trabajo_id, estado='terminado', progreso=100, terminado=datetime.utcnow()
+                )
+            except Exception as e:
+                db.session.rollback()
+                self.almacen.actualizar(
+                    trabajo_id, estado='error', error=str(e)[:300], terminado=datetime.utcnow()
+                )
+            finally:
+                shutil.rmtree(temporal, ignore_errors=True)
+                db.session.remove()
+
+    def _vencimiento_cupos(self):
+        """Un trabajo en 'procesando' desde antes de esto quedó de un worker que murió"""
+        return datetime.utcnow() - timedelta(seconds=self.app.config['PDF_TIMEOUT'] + _MARGEN_HUERFANOS)
+
+    def _esperar_cupo(self, trabajo_id):
+        """Espera a que haya cupo; False si el trabajo dejó de estar pendiente (p. ej. lo limpiaron)"""
+        maximo = self.app.config['PDF_MAX_CONCURRENTES']
+        while not self.almacen.reservar(trabajo_id, maximo, self._vencimiento_cupos()):
+            trabajo = self.almacen.obtener(trabajo_id)
+            # Sin transacción abierta mientras espera
+            db.session.remove()
+            if trabajo is None or trabajo['estado'] != 'pendiente':
+                return False
+            time.sleep(0.5)
+        return True
+
+    def limpiar(self):
+        """
+        Marca con error los trabajos de workers que murieron a mitad y elimina
+        los trabajos y archivos con más de PDF_RETENCION segundos
+        """
+        for trabajo_id in self.almacen.huerfanos(self._vencimiento_cupos()):
+            self.almacen.actualizar(trabajo_id, estado='error', error='El proceso que lo generaba se detuvo',
+                                    terminado=datetime.utcnow())
+        limite = datetime.utcnow() - timedelta(seconds=self.app.config['PDF_RETENCION'])
+        for trabajo_id in self.almacen.vencidos(limite):
+            try:
+                os.remove(self.ruta_archivo(trabajo_id))
+            except FileNotFoundError:
+                pass
+            self.almacen.eliminar(trabajo_id)
+
+
+cola_pdf = ColaPDF()
@@ -0,0 +1,259 @@
+import os
+import sys
+import subprocess
+import click
+from flask.cli import AppGroup
+from flask_migrate import stamp, upgrade
+from sqlalchemy import inspect
+from app import db
+
+
+# Revisión que corresponde al esquema que generaba db.create_all()
+REVISION_INICIAL = '0001'
+
+
+ips_cli = AppGroup('ips', help='Tareas de administración de IPS Fulano')
+
+
+def migrar_bd():
+    """
+    Lleva el esquema a la última revisión de migrations/. Una base creada
+    antes de las migraciones (con db.create_all()) se marca primero en la
+    revisión inicial, que describe ese esquema.
+    """
+    tablas = inspect(db.engine).get_table_names()
+    if 'alembic_version' not in tablas and 'usuario' in tablas:
+        stamp(revision=REVISION_INICIAL)
+        print(f"✅ Base existente marcada en la revisión {REVISION_INICIAL}")
+    upgrade()
+
+
+def inicializar_bd():
+    """
+    Migra el esquema y crea los índices de búsqueda y los datos iniciales
+    (roles y admin).
+    Es idempotente: se puede ejecutar en cada despliegue.
+    """
+    from .models import Usuario, Rol
+    from .busqueda import asegurar_indices_busqueda
+    from .busqueda_historia import asegurar_indice_historias
+
+    # Aplicar las migraciones pendientes (tablas e índices)
+    migrar_bd()
+
+    # Columna normalizada e índice de texto para la búsqueda de pacientes
+    backend = asegurar_indices_busqueda()
+    print(f"✅ Búsqueda de pacientes: {backend}")
+
+    # Índice de texto del contenido de las entradas de historia
+    backend = asegurar_indice_historias()
+    print(f"✅ Búsqueda en historias: {backend}")
+
+    # Crear roles por defecto si no existen
+    if not Rol.query.first():
+        roles_por_defecto = [
+            {'nombre': 'admin', 'descripcion': 'Administrador del sistema'},
+            {'nombre': 'medico', 'descripcion': 'Profesional médico'},
+            {'nombre': 'enfermeria', 'descripcion': 'Personal de enfermería'},
+            {'nombre': 'recepcionista', 'descripcion': 'Personal de recepción'}
+        ]
+        for rol_data in roles_por_defecto:
+            rol = Rol(nombre=rol_data['nombre'], descripcion=rol_data['descripcion'])
+            db.session.add(rol)
+        db.session.commit()
+        print("✅ Roles por defecto creados")
+
+    # Crear admin por defecto si no existe
+    from werkzeug.security import generate_password_hash
+    if not Usuario.query.filter_by(email='admin@ipsfulano.com').first():
+        rol_admin = Rol.query.filter_by(nombre='admin').first()
+        if rol_admin:
+            admin = Usuario(
+                nombre='Administrador',
+                email='admin@ipsfulano.com',
+                password=generate_password_hash('admin123'),
+                rol_id=rol_admin.id,
+                activo=True,
+                password_cambiada=False
+            )
+            db.session.add(admin)
+            db.session.commit()
+            print("✅ Usuario admin creado")
+            print("   Email: admin@ipsfulano.com")
+            print("   Contraseña: admin123")
+
+
+@ips_cli.command('inicializar')
+def inicializar_comando():
+    """Aplica migraciones, índices de búsqueda, roles y usuario admin (en cada despliegue)."""
+    inicializar_bd()
+    click.echo('✅ Base de datos inicializada')
+
+
+@ips_cli.command('restablecer-admin')
+def restablecer_admin_comando():
+    """Restablece la contraseña del admin por defecto a 'admin123'."""
+    from werkzeug.security import generate_password_hash
+    from .models import Usuario
+
+    admin = Usuario.query.filter_by(email='admin@ipsfulano.com').first()
+    if not admin:
+        raise click.ClickException('No se encontró el usuario admin. Ejecuta `flask ips inicializar` primero.')
+    admin.password = generate_password_hash('admin123')
+    admin.password_cambiada = False
+    db.session.commit()
+    click.echo("✅ Contraseña del admin restablecida a 'admin123'")
+
+
+@ips_cli.command('compactar-versiones')
+def compactar_versiones_comando():
+    """Convierte las copias completas de versiones de historia en deltas."""
+    from .models import HistoriaClinica
+    from .versiones import compactar_versiones
+
+    total_antes = total_despues = 0
+    for historia_id in db.session.scalars(db.select(HistoriaClinica.id).order_by(HistoriaClinica.id)).all():
+        antes, despues = compactar_versiones(historia_id)
+        db.session.commit()
+        total_antes += antes
+        total_despues += despues
+
+    click.echo(f'✅ Versiones compactadas: {total_antes / 1024:.1f} KB -> {total_despues / 1024:.1f} KB')
+
+
+@ips_cli.command('importar-pacientes')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--formato', type=click.Choice(['csv', 'json']), help='Por defecto, según la extensión')
+@click.option('--errores', 'ruta_errores', type=click.Path(dir_okay=False),
+              help='Reporte de filas rechazadas (por defecto ARCHIVO.errores.csv)')
+@click.option('--lote', type=int, help='Filas por lote (por defecto IMPORTACION_LOTE)')
+def importar_pacientes_comando(archivo, formato, ruta_errores, lote):
+    """Importa o actualiza pacientes desde un CSV o JSON (arreglo o JSON Lines)."""
+    import time
+    from .importacion import filas_csv, filas_json, importar_pacientes
+
+    formato = formato or ('json' if archivo.lower().endswith(('.json', '.jsonl')) else 'csv')
+    ruta_errores = ruta_errores or f'{archivo}.errores.csv'
+
+    inicio = time.perf_counter()
+    with open(archivo, encoding='utf-8-sig', newline='') as flujo, \
+            open(ruta_errores, 'w', encoding='utf-8', newline='') as reporte:
+        filas = filas_json(flujo) if formato == 'json' else filas_csv(flujo)
+        try:
+            totales = importar_pacientes(filas, reporte, lote, primera_fila=1 if formato == 'json' else 2)
+        except ValueError as e:
+            raise click.ClickException(f'Archivo inválido: {e}')
+    segundos = time.perf_counter() - inicio
+
+    click.echo(f"✅ {totales['leidas']} filas en {segundos:.1f} s "
+               f"({totales['leidas'] / max(segundos, 1e-9):.0f} filas/s): "
+               f"{totales['insertadas']} nuevas, {totales['actualizadas']} actualizadas, "
+               f"{totales['errores']} con errores")
+    if totales['errores']:
+        click.echo(f'⚠️  Filas rechazadas en {ruta_errores}')
+
+
+@ips_cli.command('tiempo-arranque')
+@click.option('--repeticiones', default=5, show_default=True, help='Arranques a medir')
+def tiempo_arranque_comando(repeticiones):
+    """Mide en procesos nuevos lo que tarda importar la app y ejecutar create_app()."""
+    codigo = (
+        'import sys, time; t = time.perf_counter(); '
+        'from app import create_app; create_app(); '
+        'print((time.perf_counter() - t) * 1000, "weasyprint" in sys.modules)'
+    )
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    tiempos = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, '-c', codigo], cwd=raiz, capture_output=True, text=True, check=True
+        )
+        milisegundos, weasyprint = salida.stdout.strip().splitlines()[-1].split()
+        tiempos.append(float(milisegundos))
+
+    tiempos.sort()
+    click.echo(f'Arranque en frío ({repeticiones} procesos): '
+               f'mínimo {tiempos[0]:.0f} ms, mediana {tiempos[len(tiempos) // 2]:.0f} ms, '
+               f'máximo {tiempos[-1]:.0f} ms')
+    if weasyprint == 'True':
+        click.echo('⚠️  create_app() importa WeasyPrint; debería cargarse solo al generar un PDF')
+
+
+@ips_cli.command('descargar-estaticos')
+@click.option('--forzar', is_flag=True, help='Vuelve a descargar aunque el archivo ya exista')
+def descargar_estaticos_comando(forzar):
+    """Descarga a static/vendor Bootstrap, Font Awesome y SweetAlert2 (versiones fijas)."""
+    from flask import current_app
+    from .estaticos import descargar
+
+    try:
+        descargados = descargar(current_app.static_folder, forzar)
+    except OSError as e:
+        raise click.ClickException(f'No se pudo descargar: {e}')
+    click.echo(f'✅ {len(descargados)} archivos descargados' if descargados else '✅ Archivos de vendor al día')
+
+
+@ips_cli.command('compilar-estaticos')
+def compilar_estaticos_comando():
+    """Genera static/dist: archivos con huella, precomprimidos (gzip y brotli) y manifest.json."""
+    from flask import current_app
+    from .estaticos import compilar
+
+    destino = current_app.config['ESTATICOS_DIRECTORIO']
+    manifiesto = compilar(current_app.static_folder, destino)
+    comprimidos = sum(1 for _, _, archivos in os.walk(destino) for archivo in archivos if archivo.endswith('.br'))
+    click.echo(f'✅ {len(manifiesto)} archivos en {destino} ({comprimidos} con versión brotli)')
+
+
+@ips_cli.command('archivar')
+@click.option('--meses', default=12, show_default=True,
+              help='Archiva las citas realizadas o canceladas de hace más de N meses')
+@click.option('--meses-historia', type=int,
+              help='Archiva también las entradas de historia de hace más de N meses')
+@click.option('--lote', default=1000, show_default=True, help='Filas por transacción')
+def archivar_comando(meses, meses_historia, lote):
+    """Mueve citas cerradas (y entradas de historia) antiguas a las tablas de archivo."""
+    from .archivo import archivar_citas, archivar_entradas_historia, esta_particionada
+
+    trabajos = [('cita', 'citas', lambda: archivar_citas(meses, lote))]
+    if meses_historia is not None:
+        trabajos.append(('historia_entrada', 'entradas de historia',
+                         lambda: archivar_entradas_historia(meses_historia, lote)))
+
+    for tabla, descripcion, archivar in trabajos:
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.connect() as conexion:
+                if esta_particionada(conexion, tabla):
+                    click.echo(f'➖ {tabla} está particionada por fecha: no hace falta archivar {descripcion}')
+                    continue
+        click.echo(f'✅ {archivar()} {descripcion} archivadas')
+
+
+@ips_cli.command('particionar')
+@click.option('--por', 'intervalo', type=click.Choice(['mes', 'anio']),
+              help='Tamaño de las particiones (por defecto el de las existentes, o mes)')
+@click.option('--meses-adelante', default=3, show_default=True, help='Particiones futuras que se dejan creadas')
+@click.option('--tabla', 'tablas', multiple=True, type=click.Choice(['cita', 'historia_entrada']),
+              help='Por defecto ambas')
+def particionar_comando(intervalo, meses_adelante, tablas):
+    """PostgreSQL: particiona cita e historia_entrada por rango de fecha y crea las particiones que falten.
+
+    La primera vez reescribe la tabla dentro de una transacción (bloquea sus
+    escrituras mientras copia); después solo agrega particiones futuras, así
+    que conviene ejecutarlo cada mes.
+    """
+    from .archivo import particionar, intervalo_particiones
+
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('Las particiones son de PostgreSQL; en SQLite usa `flask ips archivar`')
+
+    for tabla in tablas or ('cita', 'historia_entrada'):
+        with db.engine.begin() as conexion:
+            actual = intervalo_particiones(conexion, tabla)
+            if intervalo and actual and intervalo != actual:
+                raise click.ClickException(f'{tabla} ya está particionada por {actual}')
+            try:
+                creadas = particionar(conexion, tabla, intervalo or actual or 'mes', meses_adelante)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        click.echo(f'✅ {tabla}: {len(creadas)} particiones nuevas' + (f' ({", ".join(creadas)})' if creadas else ''))
@@ -0,0 +1,92 @@
+import os
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from flask import current_app, request, session, make_response, Response
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+from .cache_pdf import cache_pdf
+
+
+# Cualquier caché puede guardar la respuesta solo en el navegador del usuario
+# y debe revalidarla en cada uso (con If-None-Match / If-Modified-Since)
+CACHE_CONTROL = 'private, no-cache'
+
+
+# ============================================
+# VALIDADORES
+# ============================================
+def _version_aplicacion():
+    """
+    Marca (ns) del despliegue: la modificación más reciente de las plantillas
+    y del manifiesto de estáticos. Un cambio de plantilla invalida las páginas.
+    """
+    version = current_app.extensions.get('version_aplicacion')
+    if version is None:
+        rutas = [os.path.join(current_app.config['ESTATICOS_DIRECTORIO'], 'manifest.json')]
+        for carpeta, _, archivos in os.walk(os.path.join(current_app.root_path, current_app.template_folder)):
+            rutas.extend(os.path.join(carpeta, archivo) for archivo in archivos)
+        version = max((os.stat(ruta).st_mtime_ns for ruta in rutas if os.path.exists(ruta)), default=0)
+        current_app.extensions['version_aplicacion'] = version
+    return version
+
+
+def validadores(*partes, modelos=()):
+    """
+    (ETag, Last-Modified) de una respuesta que depende de `partes` (valores
+    cualesquiera, p. ej. la URL y el usuario) y de los datos de `modelos`.
+    No consulta la base: usa los contadores de versión por modelo de cache_pdf,
+    que cambian al confirmar cualquier escritura sobre ellos.
+    """
+    versiones = cache_pdf.version(*modelos)
+    aplicacion = _version_aplicacion()
+    etag = hashlib.sha256(repr((partes, versiones, aplicacion)).encode('utf-8')).hexdigest()[:32]
+    marca = max([int(version) for version in versiones] + [aplicacion])
+    return etag, datetime.fromtimestamp(marca / 1e9, tz=timezone.utc)
+
+
+def _aplica():
+    # Los mensajes flash pendientes se muestran una sola vez: esa página no se reutiliza
+    return current_app.config['RESPUESTAS_CONDICIONALES'] and request.method == 'GET' and '_flashes' not in session
+
+
+def no_modificado(etag, ultima_modificacion):
+    """Respuesta 304 si el cliente ya tiene esta versión, o None si hay que generarla"""
+    if not _aplica() or is_resource_modified(request.environ, etag=etag, last_modified=ultima_modificacion):
+        return None
+    return marcar(Response(status=304), etag, ultima_modificacion)
+
+
+def marcar(respuesta, etag, ultima_modificacion):
+    """Agrega ETag, Last-Modified y Cache-Control a una respuesta 200 (o 304)"""
+    if respuesta.status_code in (200, 304) and _aplica():
+        respuesta.set_etag(etag)
+        respuesta.last_modified = ultima_modificacion
+        respuesta.headers['Cache-Control'] = CACHE_CONTROL
+    return respuesta
+
+
+# ============================================
+# DECORADOR
+# ============================================
+def condicional(*modelos):
+    """
+    GET condicional para vistas cuyo contenido depende solo de la URL, del
+    usuario autenticado y de los datos de `modelos` (más Usuario y Rol, por
+    el menú y los permisos). Si el cliente envía el ETag vigente responde
+    304 sin ejecutar la vista. Va después de @login_required y @requiere_permiso.
+    """
+    dependencias = tuple(modelos) + ('Usuario', 'Rol')
+
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            if not _aplica():
+                return vista(*args, **kwargs)
+            etag, ultima = validadores(request.full_path, current_user.get_id(), modelos=dependencias)
+            respuesta = no_modificado(etag, ultima)
+            if respuesta is not None:
+                return respuesta
+            return marcar(make_response(vista(*args, **kwargs)), etag, ultima)
+        return envoltura
+    return decorador
@@ -0,0 +1,96 @@
+import os
+from sqlalchemy import event, select
+
+
+def _entero(nombre, defecto):
+    return int(os.environ.get(nombre, defecto))
+
+
+def _bandera(nombre, defecto):
+    return os.environ.get(nombre, defecto) == '1'
+
+
+def opciones_motor(uri):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS para `uri` a partir de variables de entorno.
+
+    PostgreSQL: pool de DB_POOL_SIZE conexiones + DB_MAX_OVERFLOW extra por
+    worker, reciclaje a los DB_POOL_RECYCLE segundos y pre-ping para descartar
+    conexiones cerradas por el servidor tras un periodo inactivo. Con
+    DB_PGBOUNCER=1 se asume un pooler externo en modo transacción: sin
+    parámetros de arranque ni sentencias preparadas en el servidor.
+    """
+    if uri.startswith('sqlite'):
+        # El timeout de sqlite3 se aplica también como busy_timeout
+        return {'connect_args': {'timeout': _entero('DB_SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}}
+
+    opciones = {
+        'pool_pre_ping': _bandera('DB_POOL_PRE_PING', '1'),
+        'pool_recycle': _entero('DB_POOL_RECYCLE', 280),
+        'pool_size': _entero('DB_POOL_SIZE', 5),
+        'max_overflow': _entero('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _entero('DB_POOL_TIMEOUT', 30),
+        'pool_use_lifo': True,
+    }
+    connect_args = {'connect_timeout': _entero('DB_CONNECT_TIMEOUT', 10)}
+
+    timeout_sentencia = _entero('DB_STATEMENT_TIMEOUT_MS', 30000)
+    if _bandera('DB_PGBOUNCER', '0'):
+        # PgBouncer en modo transacción no acepta `options` al conectar y
+        # reparte las transacciones entre conexiones del servidor
+        if uri.startswith('postgresql+psycopg:'):
+            connect_args['prepare_threshold'] = None
+    elif timeout_sentencia:
+        connect_args['options'] = f'-c statement_timeout={timeout_sentencia}'
+
+    opciones['connect_args'] = connect_args
+    return opciones
+
+
+def configurar_motor(engine):
+    """Ajustes por conexión que no se pueden pasar como opciones del motor"""
+    if engine.dialect.name == 'sqlite':
+        busy_timeout = _entero('DB_SQLITE_BUSY_TIMEOUT_MS', 5000)
+
+        @event.listens_for(engine, 'connect')
+        def _pragmas_sqlite(conexion_dbapi, registro):
+            cursor = conexion_dbapi.cursor()
+            # WAL: las lecturas no bloquean a la escritura (y viceversa)
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA busy_timeout={busy_timeout}')
+            cursor.close()
+
+    elif engine.dialect.name == 'postgresql' and _bandera('DB_PGBOUNCER', '0'):
+        timeout_sentencia = _entero('DB_STATEMENT_TIMEOUT_MS', 30000)
+        if timeout_sentencia:
+            # SET LOCAL dura solo la transacción, compatible con el modo transacción
+            @event.listens_for(engine, 'begin')
+            def _timeout_transaccion(conexion):
+                conexion.exec_driver_sql(f'SET LOCAL statement_timeout = {timeout_sentencia}')
+
+
+def bloquear_fila(session, modelo, id):
+    """
+    Serializa hasta el commit las transacciones que bloquean la misma fila,
+    para leer-validar-escribir sin carreras. PostgreSQL usa SELECT ... FOR
+    UPDATE; SQLite no tiene bloqueos de fila y BEGIN IMMEDIATE toma el de
+    escritura de toda la base. Debe llamarse antes de escribir en la transacción.
+    """
+    conexion = session.connection()
+    if conexion.dialect.name == 'sqlite':
+        if not conexion.connection.dbapi_connection.in_transaction:
+            conexion.exec_driver_sql('BEGIN IMMEDIATE')
+    else:
+        session.execute(select(modelo.id).where(modelo.id == id).with_for_update())
+
+
+def estado_pool(engine):
+    """Resumen del pool para el chequeo de salud"""
+    pool = engine.pool
+    estado = {'clase': type(pool).__name__}
+    for nombre in ('size', 'checkedin', 'checkedout', 'overflow'):
+        metodo = getattr(pool, nombre, None)
+        if metodo is not None:
+            estado[nombre] = metodo()
+    return estado
@@ -13,7 +13,7 @@ db.session.commit()
 # Obtener rol admin
 rol_admin = Rol.query.filter_by(nombre='admin').first()
 if not rol_admin:
-    print("Error: Rol 'admin' no encontrado. Ejecuta init_db.py primero.")
+    print("Error: Rol 'admin' no encontrado. Ejecuta `flask ips inicializar` primero.")
     exit(1)
 
 # Crear nuevo admin
@@ -0,0 +1,213 @@
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+import mimetypes
+import posixpath
+from urllib.request import urlopen
+from flask import request, send_file, url_for, abort
+from werkzeug.security import safe_join
+
+
+# Archivos de terceros servidos desde static/vendor, con versión fija.
+# La URL es el origen para `flask ips descargar-estaticos` y el respaldo
+# mientras el archivo no se haya descargado.
+FONT_AWESOME = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.0'
+VENDOR = {
+    'vendor/bootstrap/css/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/js/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+    'vendor/sweetalert2/sweetalert2.all.min.js':
+        'https://cdn.jsdelivr.net/npm/sweetalert2@11.10.5/dist/sweetalert2.all.min.js',
+    'vendor/fontawesome/css/all.min.css': f'{FONT_AWESOME}/css/all.min.css',
+    **{
+        f'vendor/fontawesome/webfonts/{fuente}': f'{FONT_AWESOME}/webfonts/{fuente}'
+        for nombre in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility')
+        for fuente in (f'{nombre}.woff2', f'{nombre}.ttf')
+    },
+}
+
+# Tipos que vale la pena precomprimir (woff2, png, etc. ya vienen comprimidos)
+COMPRIMIBLES = {'.css', '.js', '.svg', '.ttf', '.eot', '.json', '.txt', '.map', '.html'}
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+URL_CSS = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+# ============================================
+# COMPILACIÓN
+# ============================================
+def _con_huella(nombre, contenido):
+    """'css/app.css' -> 'css/app.3f2a9c1b7d0e.css' (12 hex del SHA-256 del contenido)"""
+    base, extension = posixpath.splitext(nombre)
+    return f'{base}.{hashlib.sha256(contenido).hexdigest()[:12]}{extension}'
+
+
+def _reescribir_css(nombre, texto, manifiesto):
+    """Apunta los url(...) relativos del CSS a los archivos con huella"""
+    carpeta = posixpath.dirname(nombre)
+
+    def reemplazar(coincidencia):
+        comilla, url = coincidencia.groups()
+        if re.match(r'^([a-z]+:|/|#)', url):
+            return coincidencia.group(0)
+        ruta, sufijo = re.match(r'([^?#]*)(.*)', url).groups()
+        destino = manifiesto.get(posixpath.normpath(posixpath.join(carpeta, ruta)))
+        if destino is None:
+            return coincidencia.group(0)
+        return f'url({comilla}{posixpath.relpath(destino, carpeta or ".")}{sufijo}{comilla})'
+
+    return URL_CSS.sub(reemplazar, texto)
+
+
+def _comprimir(ruta, contenido):
+    """Escribe ruta.gz y ruta.br junto al archivo si resultan más pequeños. Devuelve las extensiones escritas"""
+    escritas = []
+    comprimido = gzip.compress(contenido, compresslevel=9, mtime=0)
+    if len(comprimido) < len(contenido):
+        with open(ruta + '.gz', 'wb') as archivo:
+            archivo.write(comprimido)
+        escritas.append('.gz')
+    try:
+        import brotli
+    except ImportError:
+        return escritas
+    comprimido = brotli.compress(contenido, quality=11)
+    if len(comprimido) < len(contenido):
+        with open(ruta + '.br', 'wb') as archivo:
+            archivo.write(comprimido)
+        escritas.append('.br')
+    return escritas
+
+
+def compilar(origen, destino):
+    """
+    Copia los archivos de `origen` (static/, sin la carpeta de salida) a
+    `destino` con la huella del contenido en el nombre, los precomprime con
+    gzip y brotli y escribe manifest.json ({nombre lógico: nombre con huella}).
+    Los CSS se procesan al final para que sus url(...) apunten a las huellas.
+    Devuelve el manifiesto.
+    """
+    nombres = []
+    for carpeta, subcarpetas, archivos in os.walk(origen):
+        subcarpetas[:] = [s for s in subcarpetas if os.path.join(carpeta, s) != destino]
+        for archivo in archivos:
+            nombres.append(os.path.relpath(os.path.join(carpeta, archivo), origen).replace(os.sep, '/'))
+    nombres.sort(key=lambda nombre: (nombre.endswith('.css'), nombre))
+
+    if os.path.isdir(destino):
+        shutil.rmtree(destino)
+    manifiesto = {}
+    for nombre in nombres:
+        with open(os.path.join(origen, nombre), 'rb') as archivo:
+            contenido = archivo.read()
+        if nombre.endswith('.css'):
+            contenido = _reescribir_css(nombre, contenido.decode('utf-8'), manifiesto).encode('utf-8')
+
+        manifiesto[nombre] = _con_huella(nombre, contenido)
+        ruta = os.path.join(destino, manifiesto[nombre])
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'wb') as archivo:
+            archivo.write(contenido)
+        if posixpath.splitext(nombre)[1] in COMPRIMIBLES:
+            _comprimir(ruta, contenido)
+
+    with open(os.path.join(destino, 'manifest.json'), 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, indent=2, sort_keys=True)
+    return manifiesto
+
+
+def descargar(origen, forzar=False):
+    """Descarga a `origen` los archivos de VENDOR que falten. Devuelve los nombres descargados"""
+    descargados = []
+    for nombre, url in VENDOR.items():
+        ruta = os.path.join(origen, nombre)
+        if os.path.isfile(ruta) and not forzar:
+            continue
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with urlopen(url, timeout=30) as respuesta, open(ruta + '.tmp', 'wb') as archivo:
+            shutil.copyfileobj(respuesta, archivo)
+        os.replace(ruta + '.tmp', ruta)
+        descargados.append(nombre)
+    return descargados
+
+
+# ============================================
+# SERVIDOR
+# ============================================
+class Estaticos:
+    """
+    Archivos estáticos con huella de contenido.
+
+    Si existe static/dist/manifest.json (`flask ips compilar-estaticos`),
+    url_for('static', filename=...) devuelve la versión con huella bajo
+    /static/dist/, que se sirve precomprimida (brotli o gzip según
+    Accept-Encoding) y con caché inmutable de un año: un cambio en el archivo
+    cambia su URL. En las plantillas, url_estatico() hace lo mismo y, si un
+    archivo de VENDOR aún no se descargó, usa su URL de origen.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.manifiesto = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ESTATICOS_DIRECTORIO', os.path.join(app.static_folder, 'dist'))
+        # Sin los archivos de vendor descargados, usar el CDN de origen (desarrollo)
+        app.config.setdefault('ESTATICOS_RESPALDO_CDN', os.environ.get('ESTATICOS_RESPALDO_CDN', '1') == '1')
+        self.app = app
+        app.extensions['estaticos'] = self
+        self.cargar_manifiesto()
+
+        app.add_url_rule('/static/dist/<path:nombre>', 'estatico_con_huella', self.servir)
+        app.url_defaults(self._con_huella)
+        app.jinja_env.globals['url_estatico'] = self.url
+
+    def cargar_manifiesto(self):
+        ruta = os.path.join(self.app.config['ESTATICOS_DIRECTORIO'], 'manifest.json')
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                self.manifiesto = json.load(archivo)
+        except (OSError, ValueError):
+            self.manifiesto = {}
+
+    def _con_huella(self, endpoint, valores):
+        if endpoint == 'static' and self.manifiesto:
+            con_huella = self.manifiesto.get(valores.get('filename'))
+            if con_huella:
+                valores['filename'] = 'dist/' + con_huella
+
+    def url(self, filename):
+        """url_for('static', filename=...) con respaldo al CDN para los archivos de VENDOR no descargados"""
+        if (filename not in self.manifiesto and filename in VENDOR and self.app.config['ESTATICOS_RESPALDO_CDN']
+                and not os.path.isfile(os.path.join(self.app.static_folder, filename))):
+            return VENDOR[filename]
+        return url_for('static', filename=filename)
+
+    def servir(self, nombre):
+        ruta = safe_join(self.app.config['ESTATICOS_DIRECTORIO'], nombre)
+        if ruta is None or not os.path.isfile(ruta) or nombre == 'manifest.json':
+            abort(404)
+
+        codificacion = None
+        for formato, extension in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[formato] and os.path.isfile(ruta + extension):
+                codificacion = formato
+                ruta += extension
+                break
+
+        respuesta = send_file(
+            ruta, mimetype=mimetypes.guess_type(nombre)[0] or 'application/octet-stream', conditional=True
+        )
+        if codificacion:
+            respuesta.headers['Content-Encoding'] = codificacion
+        respuesta.headers['Vary'] = 'Accept-Encoding'
+        respuesta.headers['Cache-Control'] = CACHE_INMUTABLE
+        return respuesta
+
+
+estaticos = Estaticos()
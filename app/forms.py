@@ -1,6 +1,8 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, SelectField, DateField, DateTimeLocalField, TextAreaField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, Optional, ValidationError
+from wtforms import StringField, PasswordField, SubmitField, SelectField, DateField, DateTimeLocalField, TextAreaField, TimeField, IntegerField
+from wtforms.widgets import HiddenInput
+from wtforms.validators import DataRequired, Email, EqualTo, Length, Optional, ValidationError, NumberRange
+from app import db
 
 
 class LoginForm(FlaskForm):
@@ -54,12 +56,66 @@ class EspecialidadForm(FlaskForm):
 
 
 class CitaForm(FlaskForm):
-    paciente_id = SelectField('Paciente', coerce=int, validators=[DataRequired()])
-    medico_id = SelectField('Médico', coerce=int, validators=[DataRequired()])
-    especialidad_id = SelectField('Especialidad', coerce=int, validators=[DataRequired()])
+    # Ids elegidos con el autocompletado; se validan con una consulta por clave
+    # primaria en lugar de cargar todas las opciones
+    paciente_id = IntegerField('Paciente', widget=HiddenInput(), validators=[DataRequired('Selecciona un paciente')])
+    medico_id = IntegerField('Médico', widget=HiddenInput(), validators=[DataRequired('Selecciona un médico')])
+    especialidad_id = IntegerField('Especialidad', widget=HiddenInput(), validators=[DataRequired('Selecciona una especialidad')])
     fecha = DateTimeLocalField('Fecha y hora', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
     submit = SubmitField('Agendar Cita')
 
+    def validate_paciente_id(self, field):
+        from .models import Paciente
+        if not db.session.scalar(db.select(Paciente.id).where(Paciente.id == field.data, Paciente.activo == True)):
+            raise ValidationError('El paciente no existe o está inactivo')
+
+    def validate_medico_id(self, field):
+        from .models import Usuario, Rol
+        existe = db.session.scalar(
+            db.select(Usuario.id).join(Rol, Usuario.rol_id == Rol.id)
+            .where(Usuario.id == field.data, Rol.nombre == 'medico', Usuario.activo == True)
+        )
+        if not existe:
+            raise ValidationError('El médico no existe o está inactivo')
+
+    def validate_especialidad_id(self, field):
+        from .models import Especialidad
+        if not db.session.get(Especialidad, field.data):
+            raise ValidationError('La especialidad no existe')
+
+    def etiquetas(self):
+        """Texto a mostrar para los ids ya elegidos al volver a pintar el formulario"""
+        from .models import Paciente, Usuario, Especialidad
+        etiquetas = {}
+        if self.paciente_id.data:
+            paciente = db.session.get(Paciente, self.paciente_id.data)
+            if paciente:
+                etiquetas['paciente_id'] = f'{paciente.nombre} ({paciente.identificacion})'
+        if self.medico_id.data:
+            medico = db.session.get(Usuario, self.medico_id.data)
+            if medico:
+                etiquetas['medico_id'] = medico.nombre
+        if self.especialidad_id.data:
+            especialidad = db.session.get(Especialidad, self.especialidad_id.data)
+            if especialidad:
+                etiquetas['especialidad_id'] = especialidad.nombre
+        return etiquetas
+
+
+class HorarioMedicoForm(FlaskForm):
+    especialidad_id = SelectField('Especialidad', coerce=int, validators=[DataRequired()])
+    dia_semana = SelectField('Día', coerce=int, choices=[
+        (0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')
+    ])
+    hora_inicio = TimeField('Desde', validators=[DataRequired()])
+    hora_fin = TimeField('Hasta', validators=[DataRequired()])
+    duracion_minutos = IntegerField('Minutos por cita', default=20, validators=[DataRequired(), NumberRange(min=5, max=240)])
+    submit = SubmitField('Agregar horario')
+
+    def validate_hora_fin(self, field):
+        if self.hora_inicio.data and field.data and field.data <= self.hora_inicio.data:
+            raise ValidationError('La hora final debe ser posterior a la inicial')
+
 
 class HistoriaClinicaForm(FlaskForm):
     contenido = TextAreaField('Contenido de la historia clínica', validators=[DataRequired()])
@@ -0,0 +1,190 @@
+import csv
+import json
+from itertools import chain
+from datetime import date
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.datastructures import MultiDict
+from app import db
+from .busqueda import normalizar_texto
+from .cache_pdf import registrar_modificados
+
+
+# Columnas que se importan (las mismas de exportar_pacientes_csv, sin id)
+CAMPOS = ['nombre', 'identificacion', 'sexo', 'fecha_nacimiento', 'telefono', 'email', 'direccion']
+VALORES_VERDADEROS = {'1', 'true', 'si', 'sí', 's', 'x', 'activo'}
+
+# INSERT ... ON CONFLICT DO UPDATE de cada motor
+INSERTAR_POR_DIALECTO = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+# ============================================
+# LECTURA POR FLUJO
+# ============================================
+def filas_csv(flujo):
+    """Filas de un CSV con encabezados como dicts; el separador (',' o ';') se toma del encabezado"""
+    encabezado = flujo.readline()
+    separador = ';' if encabezado.count(';') > encabezado.count(',') else ','
+    for fila in csv.DictReader(chain([encabezado], flujo), delimiter=separador):
+        yield {(clave or '').strip().lower(): valor for clave, valor in fila.items()}
+
+
+def filas_json(flujo, tamano_bloque=65536):
+    """
+    Objetos de un arreglo JSON ([{...}, ...]) o de JSON Lines, leídos por
+    bloques: nunca se carga el archivo completo en memoria.
+    """
+    decodificador = json.JSONDecoder()
+    bufer = ''
+    fin = False
+    while True:
+        # Saltar separadores entre objetos
+        posicion = 0
+        while posicion < len(bufer) and bufer[posicion] in ' \t\r\n,[]':
+            posicion += 1
+        bufer = bufer[posicion:]
+
+        if not bufer:
+            if fin:
+                return
+            bloque = flujo.read(tamano_bloque)
+            fin = not bloque
+            bufer += bloque
+            continue
+        try:
+            objeto, posicion = decodificador.raw_decode(bufer)
+        except json.JSONDecodeError:
+            if fin:
+                raise
+            bloque = flujo.read(tamano_bloque)
+            fin = not bloque
+            bufer += bloque
+            continue
+        bufer = bufer[posicion:]
+        if not isinstance(objeto, dict):
+            raise ValueError('Cada elemento del JSON debe ser un objeto con los campos del paciente')
+        yield {str(clave).strip().lower(): valor for clave, valor in objeto.items()}
+
+
+# ============================================
+# VALIDACIÓN
+# ============================================
+def _longitudes():
+    """{campo: longitud máxima} de las columnas de texto de Paciente"""
+    from .models import Paciente
+    return {
+        campo: Paciente.__table__.c[campo].type.length
+        for campo in CAMPOS
+        if getattr(Paciente.__table__.c[campo].type, 'length', None)
+    }
+
+
+def validar_fila(fila, form, longitudes):
+    """
+    Valida una fila con las reglas de PacienteForm. `form` es un PacienteForm
+    sin CSRF que se reutiliza entre filas (construirlo es lo más costoso).
+    Devuelve (datos listos para insertar, None) o (None, mensaje de error).
+    """
+    valores = MultiDict()
+    for campo in CAMPOS:
+        valor = fila.get(campo)
+        if valor is not None and valor != '':
+            valores[campo] = valor.isoformat() if isinstance(valor, date) else str(valor).strip()
+
+    form.process(formdata=valores)
+    if not form.validate():
+        return None, '; '.join(
+            f'{campo}: {", ".join(errores)}' for campo, errores in form.errors.items()
+        )
+
+    # El formulario admite textos más largos que algunas columnas (p. ej. teléfono)
+    errores = [
+        f'{campo}: máximo {longitud} caracteres'
+        for campo, longitud in longitudes.items()
+        if form[campo].data and len(form[campo].data) > longitud
+    ]
+    if errores:
+        return None, '; '.join(errores)
+
+    datos = {campo: form[campo].data or None for campo in CAMPOS}
+    datos['nombre_normalizado'] = normalizar_texto(datos['nombre'])
+    if 'activo' in fila and fila['activo'] not in (None, ''):
+        datos['activo'] = str(fila['activo']).strip().lower() in VALORES_VERDADEROS
+    return datos, None
+
+
+# ============================================
+# ESCRITURA POR LOTES
+# ============================================
+def _guardar_lote(lote):
+    """
+    Inserta o actualiza (por identificación) un lote de filas válidas con un
+    solo executemany. Devuelve (insertadas, actualizadas).
+    """
+    from .models import Paciente
+
+    existentes = set(db.session.scalars(
+        db.select(Paciente.identificacion).where(Paciente.identificacion.in_(list(lote)))
+    ))
+    filas = list(lote.values())
+    for datos in filas:
+        if datos.get('activo') is None:
+            # Sin columna activo: los nuevos quedan activos y los existentes conservan su estado
+            datos['activo'] = None if datos['identificacion'] in existentes else True
+
+    # Sobre la tabla (Core) y no la entidad: el INSERT masivo del ORM omite
+    # las claves con None y aplicaría el valor por defecto de `activo`
+    tabla = Paciente.__table__
+    insertar = INSERTAR_POR_DIALECTO[db.engine.dialect.name](tabla)
+    columnas = {campo: insertar.excluded[campo] for campo in CAMPOS + ['nombre_normalizado']}
+    columnas['activo'] = db.func.coalesce(insertar.excluded.activo, tabla.c.activo)
+    db.session.execute(
+        insertar.on_conflict_do_update(index_elements=['identificacion'], set_=columnas),
+        filas
+    )
+    registrar_modificados(db.session, 'Paciente')
+    db.session.commit()
+    return len(filas) - len(existentes), len(existentes)
+
+
+def importar_pacientes(filas, reporte_errores, lote=None, primera_fila=2):
+    """
+    Importa pacientes desde un iterable de dicts (ver filas_csv y filas_json).
+
+    Las filas válidas se agrupan en lotes de IMPORTACION_LOTE y cada lote se
+    guarda con un upsert por identificación y su propio commit; si una
+    identificación se repite en el archivo gana la última fila. Las filas
+    inválidas se escriben en `reporte_errores` (un archivo de texto abierto)
+    como CSV con el número de fila, la identificación y el error; la
+    numeración empieza en `primera_fila` (2 en CSV, tras el encabezado).
+    Devuelve un dict con los totales.
+    """
+    from .forms import PacienteForm
+
+    lote = lote or current_app.config.get('IMPORTACION_LOTE', 1000)
+    form = PacienteForm(formdata=None, meta={'csrf': False})
+    longitudes = _longitudes()
+    escritor = csv.writer(reporte_errores)
+    escritor.writerow(['fila', 'identificacion', 'error'])
+    totales = {'leidas': 0, 'insertadas': 0, 'actualizadas': 0, 'errores': 0}
+
+    pendientes = {}
+    for numero, fila in enumerate(filas, start=primera_fila):
+        totales['leidas'] += 1
+        datos, error = validar_fila(fila, form, longitudes)
+        if error:
+            totales['errores'] += 1
+            escritor.writerow([numero, fila.get('identificacion', ''), error])
+            continue
+        pendientes[datos['identificacion']] = datos
+        if len(pendientes) >= lote:
+            insertadas, actualizadas = _guardar_lote(pendientes)
+            totales['insertadas'] += insertadas
+            totales['actualizadas'] += actualizadas
+            pendientes = {}
+
+    if pendientes:
+        insertadas, actualizadas = _guardar_lote(pendientes)
+        totales['insertadas'] += insertadas
+        totales['actualizadas'] += actualizadas
+    return totales
@@ -0,0 +1,239 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+
+
+# Límites superiores (segundos) de los histogramas, como los de prometheus_client
+LIMITES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Límites de los histogramas de número de consultas por petición
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histograma:
+    """Conteos acumulados por límite, suma y total de observaciones"""
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.conteos = [0] * (len(limites) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.conteos[i] += 1
+                break
+        else:
+            self.conteos[-1] += 1
+        self.suma += valor
+        self.total += 1
+
+    def lineas(self, nombre, etiquetas):
+        acumulado = 0
+        for limite, conteo in zip(self.limites + ('+Inf',), self.conteos):
+            acumulado += conteo
+            yield f'{nombre}_bucket{_etiquetas(etiquetas, le=limite)} {acumulado}'
+        yield f'{nombre}_sum{_etiquetas(etiquetas)} {self.suma:.6f}'
+        yield f'{nombre}_count{_etiquetas(etiquetas)} {self.total}'
+
+
+def _etiquetas(etiquetas, **extra):
+    pares = dict(etiquetas, **{k: str(v) for k, v in extra.items()})
+    if not pares:
+        return ''
+    texto = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pares.items()
+    )
+    return '{' + texto + '}'
+
+
+class Metricas:
+    """
+    Instrumentación por petición y registro de métricas del proceso.
+
+    En cada petición cuenta las consultas SQL y su tiempo (eventos del motor),
+    el tiempo de renderizado de plantillas (señales de Jinja) y lo publica en
+    la cabecera Server-Timing. Acumula histogramas por endpoint que /metrics
+    expone en formato Prometheus, y registra en el log las consultas y las
+    peticiones que superan los umbrales configurados.
+
+    Los valores son por proceso: con varios workers cada uno publica los
+    suyos (el scraper los suma al consultar cada instancia o se agregan por
+    la etiqueta de instancia).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._duracion = {}
+        self._consultas = {}
+        self._tiempo_bd = {}
+        self._plantillas = {}
+        self._pdf = {}
+        self._consultas_lentas = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, engine=None):
+        app.config.setdefault('METRICAS', os.environ.get('METRICAS', '1') == '1')
+        app.config.setdefault('METRICAS_SERVER_TIMING', os.environ.get('METRICAS_SERVER_TIMING', '1') == '1')
+        app.config.setdefault('METRICAS_TOKEN', os.environ.get('METRICAS_TOKEN'))
+        # Umbrales del log de lentitud (ms) y de consultas por petición (posible N+1)
+        app.config.setdefault('METRICAS_CONSULTA_LENTA_MS', int(os.environ.get('METRICAS_CONSULTA_LENTA_MS', 200)))
+        app.config.setdefault('METRICAS_PETICION_LENTA_MS', int(os.environ.get('METRICAS_PETICION_LENTA_MS', 1000)))
+        app.config.setdefault('METRICAS_CONSULTAS_ALERTA', int(os.environ.get('METRICAS_CONSULTAS_ALERTA', 50)))
+        self.app = app
+        app.extensions['metricas'] = self
+        if not app.config['METRICAS']:
+            return
+
+        app.before_request(self._iniciar_peticion)
+        app.after_request(self._terminar_peticion)
+        before_render_template.connect(self._antes_de_plantilla, app)
+        template_rendered.connect(self._despues_de_plantilla, app)
+        if engine is not None:
+            self.instrumentar(engine)
+
+    def instrumentar(self, engine):
+        """Cuenta y mide las consultas de `engine` (la principal o una réplica)"""
+        if not self.app.config['METRICAS']:
+            return
+        event.listen(engine, 'before_cursor_execute', self._antes_de_consulta)
+        event.listen(engine, 'after_cursor_execute', self._despues_de_consulta)
+
+    # --- Petición ---
+    def _iniciar_peticion(self):
+        g.metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'bd': 0.0, 'plantillas': 0.0, 'pdf': 0.0}
+
+    def _terminar_peticion(self, response):
+        datos = g.get('metricas')
+        if datos is None:
+            return response
+        peticion = (request.endpoint or 'sin_ruta', request.method, request.path, str(response.status_code))
+
+        # Las respuestas en streaming (exportaciones CSV) consultan mientras
+        # se envían: se registran al cerrarse, sin cabecera Server-Timing
+        if response.is_streamed:
+            response.call_on_close(lambda: self._registrar(datos, *peticion))
+            return response
+
+        g.pop('metricas')
+        total = self._registrar(datos, *peticion)
+        if self.app.config['METRICAS_SERVER_TIMING']:
+            partes = [
+                f'db;dur={datos["bd"] * 1000:.1f};desc="{datos["consultas"]} consultas"',
+                f'tpl;dur={datos["plantillas"] * 1000:.1f}',
+            ]
+            if datos['pdf']:
+                partes.append(f'pdf;dur={datos["pdf"] * 1000:.1f}')
+            partes.append(f'total;dur={total * 1000:.1f}')
+            response.headers['Server-Timing'] = ', '.join(partes)
+        return response
+
+    def _registrar(self, datos, endpoint, metodo, ruta, estado):
+        """Suma la petición a los histogramas y al log de lentitud; devuelve su duración"""
+        total = time.perf_counter() - datos['inicio']
+        with self._lock:
+            self._histograma(self._duracion, (endpoint, metodo, estado)).observar(total)
+            self._histograma(self._consultas, (endpoint,), LIMITES_CONSULTAS).observar(datos['consultas'])
+            self._histograma(self._tiempo_bd, (endpoint,)).observar(datos['bd'])
+            if datos['plantillas']:
+                self._histograma(self._plantillas, (endpoint,)).observar(datos['plantillas'])
+
+        config = self.app.config
+        if datos['consultas'] > config['METRICAS_CONSULTAS_ALERTA']:
+            self.app.logger.warning('%s %s ejecutó %d consultas (posible N+1)',
+                                    metodo, ruta, datos['consultas'])
+        if total * 1000 > config['METRICAS_PETICION_LENTA_MS']:
+            self.app.logger.warning('Petición lenta: %s %s %.0f ms (%d consultas, %.0f ms en BD)',
+                                    metodo, ruta, total * 1000, datos['consultas'], datos['bd'] * 1000)
+        return total
+
+    def _histograma(self, registro, clave, limites=LIMITES):
+        histograma = registro.get(clave)
+        if histograma is None:
+            histograma = registro[clave] = Histograma(limites)
+        return histograma
+
+    # --- Plantillas ---
+    def _antes_de_plantilla(self, app, template, context, **extra):
+        if has_request_context() and 'metricas' in g:
+            g.metricas.setdefault('pila_plantillas', []).append(time.perf_counter())
+
+    def _despues_de_plantilla(self, app, template, context, **extra):
+        if has_request_context() and 'metricas' in g and g.metricas.get('pila_plantillas'):
+            inicio = g.metricas['pila_plantillas'].pop()
+            # Solo la plantilla exterior suma (las anidadas ya están dentro de su tiempo)
+            if not g.metricas['pila_plantillas']:
+                g.metricas['plantillas'] += time.perf_counter() - inicio
+
+    # --- Consultas SQL ---
+    def _antes_de_consulta(self, conexion, cursor, sentencia, parametros, contexto, executemany):
+        conexion.info.setdefault('inicio_consulta', []).append(time.perf_counter())
+
+    def _despues_de_consulta(self, conexion, cursor, sentencia, parametros, contexto, executemany):
+        pila = conexion.info.get('inicio_consulta')
+        if not pila:
+            return
+        duracion = time.perf_counter() - pila.pop()
+
+        if has_request_context() and 'metricas' in g:
+            g.metricas['consultas'] += 1
+            g.metricas['bd'] += duracion
+
+        if duracion * 1000 > self.app.config['METRICAS_CONSULTA_LENTA_MS']:
+            with self._lock:
+                self._consultas_lentas += 1
+            donde = f'{request.method} {request.path}' if has_request_context() else 'fuera de petición'
+            self.app.logger.warning('Consulta lenta (%.0f ms, %s): %s',
+                                    duracion * 1000, donde, ' '.join(sentencia.split())[:500])
+
+    # --- PDF ---
+    def observar_pdf(self, plantilla, fase, duracion):
+        """Registra `duracion` segundos de una fase ('html' o 'maquetacion') de un PDF"""
+        with self._lock:
+            self._histograma(self._pdf, (plantilla, fase)).observar(duracion)
+        if has_request_context() and 'metricas' in g:
+            g.metricas['pdf'] += duracion
+
+    @contextmanager
+    def medir_pdf(self, plantilla, fase):
+        """Mide el bloque como una fase de la generación de un PDF"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar_pdf(plantilla, fase, time.perf_counter() - inicio)
+
+    # --- Exposición ---
+    def exportar(self):
+        """Todas las métricas en el formato de texto de Prometheus"""
+        series = [
+            ('ips_peticion_duracion_segundos', 'Duración de las peticiones por endpoint',
+             self._duracion, ('endpoint', 'metodo', 'estado')),
+            ('ips_peticion_consultas', 'Consultas SQL por petición', self._consultas, ('endpoint',)),
+            ('ips_peticion_bd_segundos', 'Tiempo en la base de datos por petición', self._tiempo_bd, ('endpoint',)),
+            ('ips_plantilla_segundos', 'Tiempo de renderizado de plantillas por petición',
+             self._plantillas, ('endpoint',)),
+            ('ips_pdf_segundos', 'Duración de la generación de PDF por plantilla y fase',
+             self._pdf, ('plantilla', 'fase')),
+        ]
+        lineas = []
+        with self._lock:
+            for nombre, ayuda, registro, claves in series:
+                lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} histogram']
+                for valores, histograma in sorted(registro.items()):
+                    lineas.extend(histograma.lineas(nombre, dict(zip(claves, valores))))
+            lineas += [
+                '# HELP ips_consultas_lentas_total Consultas que superaron METRICAS_CONSULTA_LENTA_MS',
+                '# TYPE ips_consultas_lentas_total counter',
+                f'ips_consultas_lentas_total {self._consultas_lentas}',
+            ]
+        return '\n'.join(lineas) + '\n'
+
+
+metricas = Metricas()
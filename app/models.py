@@ -1,6 +1,8 @@
 from app import db
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from datetime import datetime
+from .busqueda import normalizar_texto
 
 class Rol(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,6 +18,10 @@ class Usuario(db.Model, UserMixin):
     activo = db.Column(db.Boolean, default=True)
     password_cambiada = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_usuario_rol_id', 'rol_id'),
+    )
+
     rol = db.relationship('Rol', backref='usuarios')
 
 class Paciente(db.Model):
@@ -28,6 +34,23 @@ class Paciente(db.Model):
     fecha_nacimiento = db.Column(db.Date)
     sexo = db.Column(db.String(20))
     activo = db.Column(db.Boolean, default=True)
+    # Nombre en minúsculas y sin tildes, mantenido automáticamente para la búsqueda
+    nombre_normalizado = db.Column(db.String(100))
+
+    __table_args__ = (
+        # Orden del listado paginado (keyset por nombre, id)
+        db.Index('ix_paciente_activo_nombre_id', 'activo', 'nombre', 'id'),
+        # Búsqueda por prefijo (varchar_pattern_ops permite LIKE 'x%' en PostgreSQL)
+        db.Index('ix_paciente_nombre_normalizado', 'nombre_normalizado',
+                 postgresql_ops={'nombre_normalizado': 'varchar_pattern_ops'}),
+        db.Index('ix_paciente_identificacion_prefijo', 'identificacion',
+                 postgresql_ops={'identificacion': 'varchar_pattern_ops'}),
+    )
+
+    @validates('nombre')
+    def _actualizar_nombre_normalizado(self, key, nombre):
+        self.nombre_normalizado = normalizar_texto(nombre)
+        return nombre
 
 class Especialidad(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -40,6 +63,11 @@ class HistoriaClinica(db.Model):
     ultima_actualizacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     actualizado_por_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
 
+    __table_args__ = (
+        db.Index('ix_historia_clinica_paciente_id', 'paciente_id'),
+        db.Index('ix_historia_clinica_actualizado_por_id', 'actualizado_por_id'),
+    )
+
     paciente = db.relationship('Paciente', backref='historias')
     actualizado_por = db.relationship('Usuario', foreign_keys=[actualizado_por_id])
 
@@ -50,28 +78,152 @@ class HistoriaEntrada(db.Model):
     contenido = db.Column(db.Text, nullable=False)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_historia_entrada_autor_id', 'autor_id'),
+        # Exportación por rango de fechas
+        db.Index('ix_historia_entrada_fecha', 'fecha'),
+        # SQLite no reutiliza ids: los de las entradas archivadas siguen siendo únicos
+        {'sqlite_autoincrement': True},
+    )
+
     historia = db.relationship('HistoriaClinica', backref='entradas')
     autor = db.relationship('Usuario', foreign_keys=[autor_id])
 
+# Línea de tiempo de la historia: WHERE historia_id = ? ORDER BY fecha DESC
+db.Index('ix_historia_entrada_historia_fecha', HistoriaEntrada.historia_id, HistoriaEntrada.fecha.desc())
+
 
 class HistoriaVersion(db.Model):
+    """Versión de la historia: copia completa (punto de control) o delta sobre la anterior (ver app/versiones.py)"""
     id = db.Column(db.Integer, primary_key=True)
     historia_id = db.Column(db.Integer, db.ForeignKey('historia_clinica.id'), nullable=False)
-    contenido = db.Column(db.Text, nullable=False)
+    numero = db.Column(db.Integer, nullable=False)  # consecutivo dentro de la historia
+    # Entrada editada o eliminada cuyo texto versiona; NULL = contenido de la historia
+    entrada_id = db.Column(db.Integer)
+    es_completa = db.Column(db.Boolean, default=True, nullable=False)
+    contenido = db.Column(db.Text)  # solo en los puntos de control
+    delta = db.Column(db.Text)  # operaciones por líneas respecto a la versión anterior
     actualizado_por_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_historia_version_historia_numero', 'historia_id', 'numero', unique=True),
+        db.Index('ix_historia_version_historia_fecha', 'historia_id', 'fecha'),
+        # Cadena de versiones de una entrada
+        db.Index('ix_historia_version_historia_entrada', 'historia_id', 'entrada_id', 'numero'),
+        db.Index('ix_historia_version_actualizado_por_id', 'actualizado_por_id'),
+    )
+
     historia = db.relationship('HistoriaClinica', backref='versiones')
     autor = db.relationship('Usuario', foreign_keys=[actualizado_por_id])
 
+class TrabajoPDF(db.Model):
+    """Cola de PDF compartida entre workers (PDF_COLA_BACKEND=db, el valor por defecto)"""
+    id = db.Column(db.String(32), primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    nombre_archivo = db.Column(db.String(200), nullable=False)
+    descarga = db.Column(db.Boolean, default=False)
+    estado = db.Column(db.String(20), default='pendiente')  # pendiente, procesando, terminado, error
+    progreso = db.Column(db.Integer, default=0)
+    error = db.Column(db.String(300))
+    creado = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    iniciado = db.Column(db.DateTime)  # cuando tomó un cupo de PDF_MAX_CONCURRENTES
+    terminado = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_trabajo_pdf_usuario_id', 'usuario_id'),
+        # Cupos ocupados en toda la máquina: estado = 'procesando' AND iniciado >= ?
+        db.Index('ix_trabajo_pdf_estado_iniciado', 'estado', 'iniciado'),
+    )
+
 class Cita(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
     medico_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
     especialidad_id = db.Column(db.Integer, db.ForeignKey('especialidad.id'), nullable=False)
     fecha = db.Column(db.DateTime, nullable=False)
+    duracion_minutos = db.Column(db.Integer, nullable=False, default=20, server_default='20')
     estado = db.Column(db.String(20), default='Pendiente')  # Pendiente, Realizada, Cancelada
 
+    __table_args__ = (
+        # Filtros del listado de citas: rango de fechas, estado y médico
+        db.Index('ix_cita_fecha_estado_medico', 'fecha', 'estado', 'medico_id'),
+        # Agenda de un médico y citas de un paciente, ordenadas por fecha
+        db.Index('ix_cita_medico_fecha', 'medico_id', 'fecha'),
+        db.Index('ix_cita_paciente_fecha', 'paciente_id', 'fecha'),
+        db.Index('ix_cita_especialidad_id', 'especialidad_id'),
+        # Conteo de citas pendientes
+        db.Index('ix_cita_estado', 'estado'),
+        # Un médico no puede tener dos citas activas a la misma hora; la base
+        # de datos rechaza la segunda aunque lleguen a la vez. En PostgreSQL la
+        # migración 0007 agrega además la restricción de exclusión
+        # ex_cita_medico_horario para las que se cruzan (ver app/agenda.py)
+        db.Index('ix_cita_medico_fecha_activa', 'medico_id', 'fecha', unique=True,
+                 sqlite_where=db.text("estado != 'Cancelada'"),
+                 postgresql_where=db.text("estado != 'Cancelada'")),
+        # SQLite no reutiliza ids: los de las citas archivadas siguen siendo únicos
+        {'sqlite_autoincrement': True},
+    )
+
     paciente = db.relationship('Paciente', backref='citas')
     medico = db.relationship('Usuario', foreign_keys=[medico_id])
-    especialidad = db.relationship('Especialidad', backref='citas')
\ No newline at end of file
+    especialidad = db.relationship('Especialidad', backref='citas')
+
+
+# ============================================
+# ARCHIVO (ver app/archivo.py)
+# ============================================
+class CitaArchivo(db.Model):
+    """Citas realizadas o canceladas antiguas, movidas con `flask ips archivar` (conservan su id)"""
+    __tablename__ = 'cita_archivo'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
+    medico_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    especialidad_id = db.Column(db.Integer, db.ForeignKey('especialidad.id'), nullable=False)
+    fecha = db.Column(db.DateTime, nullable=False)
+    duracion_minutos = db.Column(db.Integer, nullable=False, default=20, server_default='20')
+    estado = db.Column(db.String(20))
+
+    __table_args__ = (
+        db.Index('ix_cita_archivo_fecha', 'fecha'),
+        db.Index('ix_cita_archivo_paciente_fecha', 'paciente_id', 'fecha'),
+        db.Index('ix_cita_archivo_medico_fecha', 'medico_id', 'fecha'),
+        db.Index('ix_cita_archivo_especialidad_id', 'especialidad_id'),
+    )
+
+
+class HistoriaEntradaArchivo(db.Model):
+    """Entradas de historia antiguas, movidas con `flask ips archivar --meses-historia` (conservan su id)"""
+    __tablename__ = 'historia_entrada_archivo'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    historia_id = db.Column(db.Integer, db.ForeignKey('historia_clinica.id'), nullable=False)
+    autor_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    contenido = db.Column(db.Text, nullable=False)
+    fecha = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_historia_entrada_archivo_historia_fecha', 'historia_id', 'fecha'),
+        db.Index('ix_historia_entrada_archivo_fecha', 'fecha'),
+        db.Index('ix_historia_entrada_archivo_autor_id', 'autor_id'),
+    )
+
+
+class HorarioMedico(db.Model):
+    """Franja semanal en la que un médico atiende una especialidad"""
+    id = db.Column(db.Integer, primary_key=True)
+    medico_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    especialidad_id = db.Column(db.Integer, db.ForeignKey('especialidad.id'), nullable=False)
+    dia_semana = db.Column(db.Integer, nullable=False)  # 0 = lunes ... 6 = domingo
+    hora_inicio = db.Column(db.Time, nullable=False)
+    hora_fin = db.Column(db.Time, nullable=False)
+    duracion_minutos = db.Column(db.Integer, nullable=False, default=20)
+
+    __table_args__ = (
+        db.Index('ix_horario_medico_medico_dia', 'medico_id', 'dia_semana'),
+        # Próximos cupos de una especialidad
+        db.Index('ix_horario_medico_especialidad_dia', 'especialidad_id', 'dia_semana'),
+    )
+
+    medico = db.relationship('Usuario', foreign_keys=[medico_id],
+                             backref=db.backref('horarios', cascade='all, delete-orphan'))
+    especialidad = db.relationship('Especialidad', backref=db.backref('horarios', cascade='all, delete-orphan'))
@@ -0,0 +1,78 @@
+from flask import current_app, request
+from app import db
+
+
+class PaginaKeyset:
+    """Resultado de una consulta paginada por cursor (keyset)"""
+
+    def __init__(self, items, por_pagina, siguiente=None, anterior=None):
+        self.items = items
+        self.por_pagina = por_pagina
+        self.siguiente = siguiente
+        self.anterior = anterior
+
+    @property
+    def tiene_siguiente(self):
+        return self.siguiente is not None
+
+    @property
+    def tiene_anterior(self):
+        return self.anterior is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def obtener_por_pagina(clave_config, maximo=200):
+    """Tamaño de página: parámetro ?por_pagina= o el valor configurado"""
+    por_defecto = current_app.config.get(clave_config, 50)
+    por_pagina = request.args.get('por_pagina', por_defecto, type=int)
+    return max(1, min(por_pagina, maximo))
+
+
+def paginar_keyset(query, modelo, columnas, por_pagina, despues=None, antes=None, descendente=False):
+    """
+    Pagina `query` por las `columnas` indicadas (la última debe ser única, p. ej. el id).
+
+    Los cursores `despues`/`antes` son el id de la última/primera fila de la
+    página vista; sus valores de orden se leen con una consulta por clave primaria,
+    así la página siguiente es un rango sobre el índice y no un OFFSET.
+    """
+    tupla = db.tuple_(*columnas)
+    hacia_atras = antes is not None and despues is None
+    cursor_id = antes if hacia_atras else despues
+
+    if cursor_id is not None:
+        valores = db.session.query(*columnas).filter(modelo.id == cursor_id).first()
+        if valores is not None:
+            # "Más adelante" en el orden de la lista
+            if descendente != hacia_atras:
+                query = query.filter(tupla < tuple(valores))
+            else:
+                query = query.filter(tupla > tuple(valores))
+        else:
+            hacia_atras = False
+            cursor_id = None
+
+    if descendente != hacia_atras:
+        query = query.order_by(*[c.desc() for c in columnas])
+    else:
+        query = query.order_by(*[c.asc() for c in columnas])
+
+    # Se pide una fila extra para saber si hay más páginas sin hacer COUNT(*)
+    filas = query.limit(por_pagina + 1).all()
+    hay_mas = len(filas) > por_pagina
+    filas = filas[:por_pagina]
+
+    if hacia_atras:
+        filas.reverse()
+        siguiente = filas[-1].id if filas else None
+        anterior = filas[0].id if (filas and hay_mas) else None
+    else:
+        siguiente = filas[-1].id if (filas and hay_mas) else None
+        anterior = filas[0].id if (filas and cursor_id is not None) else None
+
+    return PaginaKeyset(filas, por_pagina, siguiente=siguiente, anterior=anterior)
@@ -0,0 +1,106 @@
+import os
+import time
+from itertools import islice
+from flask import current_app, stream_template
+
+
+def lotes(filas, tamano):
+    """
+    Agrupa un iterable en listas de `tamano` elementos indicando si cada
+    lote es el último. Siempre produce al menos un lote (posiblemente vacío)
+    para que el documento tenga encabezado y pie aunque no haya filas.
+    """
+    iterador = iter(filas)
+    actual = list(islice(iterador, tamano))
+    while True:
+        siguiente = list(islice(iterador, tamano)) if len(actual) == tamano else []
+        yield actual, not siguiente
+        if not siguiente:
+            return
+        actual = siguiente
+
+
+class TiempoAgotado(RuntimeError):
+    """El trabajo superó PDF_TIMEOUT"""
+
+    def __init__(self):
+        super().__init__('Tiempo de generación agotado')
+
+
+def escribir_html(plantilla, contexto, directorio, clave_lotes=None, limite=None):
+    """
+    Renderiza la plantilla a uno o varios archivos HTML en `directorio`.
+
+    Con `clave_lotes`, `contexto[clave_lotes]` puede ser un iterador perezoso
+    (p. ej. una consulta con yield_per); se consume en lotes de PDF_LOTE_FILAS
+    filas y cada lote se escribe como un documento independiente, con el
+    encabezado solo en el primero y el pie solo en el último. La plantilla se
+    genera por partes (stream_template) directamente al archivo.
+
+    `limite` (time.monotonic()) se comprueba entre lotes: un lote en curso
+    termina, pero no se empieza otro pasado el límite.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    if clave_lotes is None:
+        grupos = [(None, True)]
+    else:
+        grupos = lotes(contexto[clave_lotes], current_app.config['PDF_LOTE_FILAS'])
+
+    archivos = []
+    desplazamiento = 0
+    for numero, (filas, ultimo) in enumerate(grupos):
+        if limite is not None and time.monotonic() > limite:
+            raise TiempoAgotado()
+        contexto_lote = dict(contexto, primer_lote=numero == 0, ultimo_lote=ultimo, desplazamiento=desplazamiento)
+        if clave_lotes is not None:
+            contexto_lote[clave_lotes] = filas
+            desplazamiento += len(filas)
+
+        ruta = os.path.join(directorio, f'lote_{numero:05d}.html')
+        with open(ruta, 'w', encoding='utf-8') as f:
+            for parte in stream_template(plantilla, **contexto_lote):
+                f.write(parte)
+        archivos.append(ruta)
+    return archivos
+
+
+def _solo_recursos_locales(url, *args, **kwargs):
+    """url_fetcher de WeasyPrint: archivos locales y data:, nunca la red (la maquetación no espera a terceros)"""
+    from weasyprint import default_url_fetcher
+
+    if not url.startswith(('file:', 'data:')):
+        raise ValueError(f'Recurso remoto omitido en el PDF: {url}')
+    return default_url_fetcher(url, *args, **kwargs)
+
+
+def maquetar(archivos_html, ruta_pdf, progreso=None):
+    """
+    Maqueta cada HTML con WeasyPrint por separado y concatena los PDF.
+    Solo un lote está maquetado en memoria a la vez.
+    """
+    from weasyprint import HTML
+
+    if len(archivos_html) == 1:
+        HTML(filename=archivos_html[0], url_fetcher=_solo_recursos_locales).write_pdf(ruta_pdf)
+        if progreso is not None:
+            progreso.value = 100
+        return
+
+    from pypdf import PdfWriter
+
+    partes = []
+    for i, archivo in enumerate(archivos_html):
+        parte = f'{archivo}.pdf'
+        HTML(filename=archivo, url_fetcher=_solo_recursos_locales).write_pdf(parte)
+        partes.append(parte)
+        if progreso is not None:
+            progreso.value = 40 + int(50 * (i + 1) / len(archivos_html))
+
+    escritor = PdfWriter()
+    for parte in partes:
+        escritor.append(parte)
+    with open(ruta_pdf, 'wb') as f:
+        escritor.write(f)
+    escritor.close()
+    if progreso is not None:
+        progreso.value = 100
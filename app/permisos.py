@@ -0,0 +1,175 @@
+import time
+import threading
+from functools import wraps
+from flask import request, flash, redirect, url_for
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+
+
+# ============================================
+# DEFINICIÓN DE PERMISOS
+# ============================================
+# Grupos de endpoints protegidos con @requiere_permiso
+GRUPOS = {
+    'usuarios': {
+        'main.lista_usuarios',
+        'main.editar_usuario',
+        'main.toggle_usuario_activo',
+        'main.eliminar_usuario',
+        'main.resetear_password_usuario',
+    },
+    'horarios': {
+        'main.horarios_medico',
+        'main.eliminar_horario',
+    },
+    'especialidades': {
+        'main.lista_especialidades',
+        'main.editar_especialidad',
+        'main.eliminar_especialidad',
+        'main.reporte_especialidades_pdf',
+    },
+    'roles': {
+        'main.lista_roles',
+        'main.editar_rol',
+        'main.eliminar_rol',
+    },
+    'exportaciones': {
+        'main.exportar_pacientes_csv',
+        'main.exportar_citas_csv',
+        'main.exportar_historias_csv',
+    },
+    'importaciones': {
+        'main.importar_pacientes',
+        'main.reporte_importacion',
+    },
+    # /metrics cuando no hay METRICAS_TOKEN
+    'metricas': {
+        'main.metricas_prometheus',
+    },
+    'historia_lectura': {
+        'main.historia_clinica',
+        'main.entradas_historia',
+        'main.imprimir_historia',
+        'main.descargar_historia',
+        'main.ver_version_historia',
+        'main.buscar_historia_paciente',
+    },
+    'historia_edicion': {
+        'main.editar_entrada_historia',
+        'main.eliminar_entrada_historia',
+    },
+    # Búsqueda en las historias de todos los pacientes
+    'historia_busqueda': {
+        'main.buscar_historias',
+    },
+}
+
+# Grupos concedidos a cada rol por nombre; '*' concede todos los endpoints.
+# La consulta de historias, agregar entradas y editar o eliminar las propias
+# (la ruta comprueba el autor) estaban abiertas a todos los usuarios antes de
+# este mapa y se conservan para recepción y los roles creados desde la
+# pantalla de roles; la búsqueda global queda para el personal clínico.
+PERMISOS_POR_ROL = {
+    'admin': {'*'},
+    'medico': {'historia_lectura', 'historia_edicion', 'historia_busqueda'},
+    'enfermeria': {'historia_lectura', 'historia_edicion'},
+    'recepcionista': {'historia_lectura', 'historia_edicion'},
+}
+
+# Roles que no están arriba
+PERMISOS_OTROS_ROLES = {'historia_lectura', 'historia_edicion'}
+
+
+class MapaPermisos:
+    """
+    Mapa rol_id -> endpoints permitidos, construido desde la tabla Rol.
+
+    Se calcula una vez y se reconstruye cuando cambia un Rol (o cuando
+    aparece un rol_id desconocido, p. ej. creado por otro worker), de modo
+    que la verificación en cada petición es una búsqueda en un set sin
+    consultar la base de datos. Un rol_id que sigue sin existir tras
+    reconstruir se recuerda hasta la próxima recarga, para no consultar en
+    cada petición.
+    """
+
+    RECARGA_SEGUNDOS = 300
+
+    def __init__(self):
+        self._mapa = None
+        self._cargado = 0
+        self._desconocidos = frozenset()
+        self._lock = threading.Lock()
+
+    def _construir(self):
+        from .models import Rol
+
+        todos = set().union(*GRUPOS.values())
+        mapa = {}
+        for rol_id, nombre in db.session.execute(db.select(Rol.id, Rol.nombre)):
+            grupos = PERMISOS_POR_ROL.get(nombre, PERMISOS_OTROS_ROLES)
+            if '*' in grupos:
+                mapa[rol_id] = todos
+            else:
+                mapa[rol_id] = set().union(*(GRUPOS[g] for g in grupos))
+        return mapa
+
+    def permitidos(self, rol_id):
+        mapa = self._mapa
+        vencido = time.monotonic() - self._cargado > self.RECARGA_SEGUNDOS
+        if mapa is None or vencido or (rol_id not in mapa and rol_id not in self._desconocidos):
+            with self._lock:
+                self._mapa = mapa = self._construir()
+                self._cargado = time.monotonic()
+                # Los que la base acaba de confirmar que no existen
+                self._desconocidos = frozenset(r for r in self._desconocidos | {rol_id} if r not in mapa)
+        return mapa.get(rol_id, frozenset())
+
+    def invalidar(self):
+        self._mapa = None
+        self._desconocidos = frozenset()
+
+
+mapa_permisos = MapaPermisos()
+
+
+def tiene_permiso(endpoint, usuario=None):
+    """Indica si el usuario (por defecto el actual) puede acceder a `endpoint`"""
+    usuario = usuario or current_user
+    if not usuario.is_authenticated or usuario.rol_id is None:
+        return False
+    return endpoint in mapa_permisos.permitidos(usuario.rol_id)
+
+
+def requiere_permiso(vista):
+    """Restringe la vista a los roles que tienen su endpoint en el mapa de permisos"""
+    @wraps(vista)
+    def decorada(*args, **kwargs):
+        if not tiene_permiso(request.endpoint):
+            flash('Acceso denegado', 'danger')
+            return redirect(url_for('main.dashboard'))
+        return vista(*args, **kwargs)
+    return decorada
+
+
+# ============================================
+# RECARGA AL CAMBIAR ROLES
+# ============================================
+@event.listens_for(Session, 'after_flush')
+def _registrar_roles_modificados(session, flush_context):
+    from .models import Rol
+
+    if any(isinstance(obj, Rol) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info['permisos_modificados'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _recargar_permisos(session):
+    if session.info.pop('permisos_modificados', None):
+        mapa_permisos.invalidar()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_roles_modificados(session):
+    session.info.pop('permisos_modificados', None)
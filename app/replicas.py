@@ -0,0 +1,198 @@
+import os
+import time
+import random
+import logging
+import threading
+from functools import wraps
+from flask import current_app, g, has_app_context, has_request_context, session as sesion_http
+from flask_sqlalchemy.session import Session as SesionFlask
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.elements import TextClause
+
+
+logger = logging.getLogger(__name__)
+
+# Clave en la cookie de sesión con la hora de la última escritura del usuario
+CLAVE_ESCRITURA = '_bd_escritura'
+
+
+def _normalizar_url(url):
+    # Render usa postgres://
+    if url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql+psycopg2://', 1)
+    return url
+
+
+def _es_lectura(clause):
+    """Solo los SELECT sin FOR UPDATE pueden ir a una réplica"""
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].lower() == 'select'
+    return clause is not None and clause.is_select and getattr(clause, '_for_update_arg', None) is None
+
+
+# ============================================
+# SESIÓN
+# ============================================
+class SesionEnrutada(SesionFlask):
+    """
+    Sesión de Flask-SQLAlchemy que manda los SELECT a una réplica cuando la
+    vista está marcada con @solo_lectura. Los flush, las escrituras con Core y
+    todo lo demás van a la principal.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            if clause is not None and clause.is_dml:
+                self.info['escritura'] = True
+            elif _es_lectura(clause):
+                motor = replicas.motor_lectura()
+                if motor is not None:
+                    return motor
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(SesionEnrutada, 'after_flush')
+def _registrar_escritura(session, flush_context):
+    session.info['escritura'] = True
+
+
+@event.listens_for(SesionEnrutada, 'after_commit')
+def _recordar_escritura(session):
+    # La marca va en la cookie para que la vean todos los workers
+    if session.info.pop('escritura', False) and replicas.claves and has_request_context():
+        sesion_http[CLAVE_ESCRITURA] = time.time()
+
+
+@event.listens_for(SesionEnrutada, 'after_rollback')
+def _descartar_escritura(session):
+    session.info.pop('escritura', None)
+
+
+# ============================================
+# RÉPLICAS
+# ============================================
+class Replicas:
+    """
+    Réplicas de lectura como binds adicionales de Flask-SQLAlchemy.
+
+    DATABASE_REPLICA_URLS (separadas por comas) se registran como binds
+    'replica_1', 'replica_2', ... Las vistas marcadas con @solo_lectura leen
+    de una réplica elegida al azar por petición, salvo que el usuario haya
+    escrito hace menos de REPLICAS_VENTANA_S segundos (lee su propia
+    escritura en la principal). Una réplica que no responde queda fuera
+    REPLICAS_REINTENTO_S segundos y se lee de otra o de la principal.
+
+    Para probarlo en local con SQLite basta una copia del archivo abierta en
+    solo lectura: DATABASE_REPLICA_URLS=sqlite:///file:/ruta/copia.db?mode=ro&uri=true
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.claves = ()
+        self._caidas = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Debe llamarse antes de db.init_app: agrega las réplicas a SQLALCHEMY_BINDS"""
+        from .conexiones import opciones_motor
+        app.config.setdefault('REPLICAS_VENTANA_S', float(os.environ.get('REPLICAS_VENTANA_S', 10)))
+        app.config.setdefault('REPLICAS_REINTENTO_S', float(os.environ.get('REPLICAS_REINTENTO_S', 30)))
+        urls = [_normalizar_url(url.strip()) for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                if url.strip()]
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        for numero, url in enumerate(urls, start=1):
+            binds[f'replica_{numero}'] = {'url': url, **opciones_motor(url)}
+        self.claves = tuple(f'replica_{numero}' for numero in range(1, len(urls) + 1))
+        self.app = app
+        app.extensions['replicas'] = self
+
+    def motores(self):
+        engines = current_app.extensions['sqlalchemy'].engines
+        return [engines[clave] for clave in self.claves]
+
+    def configurar_motores(self, configurar_motor, metricas):
+        """Mismos ajustes por conexión y métricas que la principal; una desconexión saca la réplica"""
+        for clave, engine in zip(self.claves, self.motores()):
+            configurar_motor(engine)
+            metricas.instrumentar(engine)
+
+            @event.listens_for(engine, 'handle_error')
+            def _desconexion(contexto, clave=clave):
+                if contexto.is_disconnect:
+                    self.marcar_caida(clave, contexto.original_exception)
+
+    # --- Enrutamiento ---
+    def _escritura_reciente(self):
+        if not has_request_context():
+            return False
+        return time.time() - sesion_http.get(CLAVE_ESCRITURA, 0) < current_app.config['REPLICAS_VENTANA_S']
+
+    def usar(self):
+        """¿Las lecturas de esta vista pueden ir a una réplica?"""
+        return bool(self.claves) and g.get('bd_solo_lectura', False) and not self._escritura_reciente()
+
+    def motor_lectura(self):
+        """Motor de la réplica de esta petición, o None para usar la principal"""
+        if not self.usar():
+            return None
+        if 'bd_replica' not in g:
+            g.bd_replica = self._elegir()
+        return g.bd_replica
+
+    def _elegir(self):
+        ahora = time.monotonic()
+        engines = current_app.extensions['sqlalchemy'].engines
+        claves = [clave for clave in self.claves if self._caidas.get(clave, 0) <= ahora]
+        random.shuffle(claves)
+        for clave in claves:
+            try:
+                # Con el pool es solo tomar una conexión (y el pre-ping en PostgreSQL)
+                with engines[clave].connect():
+                    return engines[clave]
+            except DBAPIError as e:
+                self.marcar_caida(clave, e)
+        return None
+
+    def marcar_caida(self, clave, error):
+        with self._lock:
+            self._caidas[clave] = time.monotonic() + self.app.config['REPLICAS_REINTENTO_S']
+        logger.warning('Réplica %s no disponible, se lee de la principal: %s', clave, str(error)[:200])
+
+    def estado(self):
+        """Réplicas configuradas y si están fuera por un fallo reciente (para /salud)"""
+        ahora = time.monotonic()
+        return {clave: 'caida' if self._caidas.get(clave, 0) > ahora else 'ok' for clave in self.claves}
+
+    # --- Vistas y trabajos de fondo ---
+    def envolver(self, funcion):
+        """
+        Lleva la decisión de esta petición a `funcion` cuando corre en otro
+        contexto de aplicación (la cola de PDF): si aquí se lee de réplica, allá también.
+        """
+        if not self.usar():
+            return funcion
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            g.bd_solo_lectura = True
+            return funcion(*args, **kwargs)
+        return envoltura
+
+
+replicas = Replicas()
+
+
+def solo_lectura(vista):
+    """
+    Marca una vista cuyas lecturas pueden ir a una réplica. Va después de
+    @login_required y @requiere_permiso. Si la vista escribe, esa escritura
+    va igual a la principal.
+    """
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        g.bd_solo_lectura = True
+        return vista(*args, **kwargs)
+    return envoltura
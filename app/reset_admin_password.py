@@ -13,4 +13,4 @@ if admin:
     db.session.commit()
     print("✅ Contraseña del admin restablecida a 'admin123'")
 else:
-    print("❌ No se encontró el usuario admin. Ejecuta init_db.py primero.")
+    print("❌ No se encontró el usuario admin. Ejecuta `flask ips inicializar` primero.")
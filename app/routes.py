@@ -1,7 +1,7 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, make_response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, current_app, jsonify, send_file, abort, stream_with_context
 from flask_login import login_required, current_user, logout_user, login_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from .models import db, Usuario, Paciente, Cita, Especialidad, HistoriaClinica, HistoriaVersion, HistoriaEntrada, Rol
+from .models import db, Usuario, Paciente, Cita, Especialidad, HistoriaClinica, HistoriaVersion, HistoriaEntrada, Rol, HorarioMedico
 from .forms import (
     LoginForm,
     CambiarPasswordForm,
@@ -9,10 +9,34 @@ from .forms import (
     EspecialidadForm,
     CitaForm,
     PacienteForm,
-    RolForm
+    RolForm,
+    HorarioMedicoForm
 )
-from weasyprint import HTML
+from .busqueda import filtrar_pacientes, sugerir_pacientes, sugerir_medicos, sugerir_especialidades
+from .paginacion import paginar_keyset, obtener_por_pagina
+from .cola_pdf import cola_pdf, ColaLlena
+from .cache_pdf import cache_pdf
+from .pdf_lotes import escribir_html, maquetar
+from .permisos import requiere_permiso, tiene_permiso
+from .condicional import condicional, validadores, no_modificado, marcar
+from .replicas import replicas, solo_lectura
+from .archivo import con_archivo, obtener_con_archivo, paginar_por_fecha, esta_archivada, limite_archivo
+from .conexiones import estado_pool
+from .metricas import metricas
+from .versiones import contenido_version, diferencias, bloquear_historia, registrar_cambio_entrada
+from .busqueda_historia import buscar_entradas
+from .agenda import proximos_cupos, cupos_medico, bloquear_agenda, validar_cupo, parsear_dia, DIAS_SEMANA
+from .importacion import filas_csv, filas_json, importar_pacientes as importar_pacientes_desde
+from .agregados import estadisticas_generales, citas_por_especialidad, medicos_por_especialidad, usuarios_por_rol
 from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+import os
+import io
+import csv
+import hmac
+import shutil
+import tempfile
+import uuid
 
 main = Blueprint('main', __name__)
 
@@ -48,6 +72,33 @@ def index():
     return render_template('login.html', form=form)
 
 
+@main.route('/salud')
+def salud():
+    """Chequeo de salud para el balanceador: verifica una conexión del pool"""
+    try:
+        db.session.execute(db.text('SELECT 1'))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'estado': 'error', 'detalle': str(e)[:200]}), 503
+    return jsonify({'estado': 'ok', 'pool': estado_pool(db.engine), 'replicas': replicas.estado()})
+
+
+@main.route('/metrics')
+def metricas_prometheus():
+    """
+    Métricas del proceso en formato Prometheus. Con METRICAS_TOKEN exige
+    Authorization: Bearer; sin él solo las ve un administrador con sesión
+    iniciada y para los demás la ruta no existe (404).
+    """
+    token = current_app.config.get('METRICAS_TOKEN')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+    elif not tiene_permiso('main.metricas_prometheus'):
+        abort(404)
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+
 @main.route('/dashboard')
 @login_required
 def dashboard():
@@ -100,18 +151,22 @@ def logout():
 # ============================================
 @main.route('/pacientes')
 @login_required
+@condicional('Paciente')
 def lista_pacientes():
     query = request.args.get('q', '').strip()
+    consulta = Paciente.query.filter_by(activo=True)
     if query:
-        pacientes = Paciente.query.filter(
-            db.or_(
-                Paciente.nombre.contains(query),
-                Paciente.identificacion.contains(query)
-            )
-        ).filter_by(activo=True).all()
-    else:
-        pacientes = Paciente.query.filter_by(activo=True).all()
-    return render_template('paciente/pacientes.html', pacientes=pacientes, query=query)
+        consulta = filtrar_pacientes(consulta, query)
+
+    pagina = paginar_keyset(
+        consulta,
+        Paciente,
+        [Paciente.nombre, Paciente.id],
+        obtener_por_pagina('PACIENTES_POR_PAGINA'),
+        despues=request.args.get('despues', type=int),
+        antes=request.args.get('antes', type=int)
+    )
+    return render_template('paciente/pacientes.html', pacientes=pagina.items, pagina=pagina, query=query)
 
 
 @main.route('/paciente/nuevo', methods=['GET', 'POST'])
@@ -164,16 +219,61 @@ def eliminar_paciente(id):
     flash('Paciente eliminado', 'info')
     return redirect(url_for('main.lista_pacientes'))
 
+
+@main.route('/pacientes/importar', methods=['GET', 'POST'])
+@login_required
+@requiere_permiso
+def importar_pacientes():
+    """Carga masiva de pacientes desde CSV o JSON con reporte de filas rechazadas"""
+    if request.method == 'GET':
+        return render_template('paciente/importar.html')
+
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        flash('Selecciona un archivo CSV o JSON', 'warning')
+        return redirect(url_for('main.importar_pacientes'))
+
+    es_json = archivo.filename.lower().endswith(('.json', '.jsonl'))
+    directorio = current_app.config['IMPORTACION_DIRECTORIO']
+    os.makedirs(directorio, exist_ok=True)
+    reporte_id = uuid.uuid4().hex
+    ruta_reporte = os.path.join(directorio, f'{reporte_id}.csv')
+
+    flujo = io.TextIOWrapper(archivo.stream, encoding='utf-8-sig', newline='')
+    with open(ruta_reporte, 'w', encoding='utf-8', newline='') as reporte:
+        try:
+            totales = importar_pacientes_desde(
+                filas_json(flujo) if es_json else filas_csv(flujo), reporte,
+                primera_fila=1 if es_json else 2
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            totales = None
+            flash(f'No se pudo leer el archivo: {e}', 'danger')
+
+    if not totales or not totales['errores']:
+        os.remove(ruta_reporte)
+        reporte_id = None
+    return render_template('paciente/importar.html', totales=totales, reporte_id=reporte_id)
+
+
+@main.route('/pacientes/importar/errores/<reporte_id>.csv')
+@login_required
+@requiere_permiso
+def reporte_importacion(reporte_id):
+    if not reporte_id.isalnum():
+        abort(404)
+    ruta = os.path.join(current_app.config['IMPORTACION_DIRECTORIO'], f'{reporte_id}.csv')
+    if not os.path.exists(ruta):
+        abort(404)
+    return send_file(ruta, mimetype='text/csv', as_attachment=True, download_name='errores_importacion.csv')
+
 # ============================================
 # USUARIOS (ADMIN)
 # ============================================
 @main.route('/usuarios', methods=['GET', 'POST'])
 @login_required
+@requiere_permiso
 def lista_usuarios():
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     form = UsuarioForm()
     form.rol_id.choices = [(r.id, r.nombre) for r in Rol.query.all()]
 
@@ -201,11 +301,8 @@ def lista_usuarios():
 
 @main.route('/usuario/<int:id>/editar', methods=['GET', 'POST'])
 @login_required
+@requiere_permiso
 def editar_usuario(id):
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     usuario = Usuario.query.get_or_404(id)
     form = UsuarioForm(obj=usuario)
     form.rol_id.choices = [(r.id, r.nombre) for r in Rol.query.all()]
@@ -228,10 +325,8 @@ def editar_usuario(id):
 
 @main.route('/usuario/<int:id>/toggle-activo', methods=['POST'])
 @login_required
+@requiere_permiso
 def toggle_usuario_activo(id):
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
     usuario = Usuario.query.get_or_404(id)
     usuario.activo = not usuario.activo
     db.session.commit()
@@ -241,10 +336,8 @@ def toggle_usuario_activo(id):
 
 @main.route('/usuario/<int:id>/eliminar', methods=['POST'])
 @login_required
+@requiere_permiso
 def eliminar_usuario(id):
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
     usuario = Usuario.query.get_or_404(id)
     db.session.delete(usuario)
     db.session.commit()
@@ -254,11 +347,8 @@ def eliminar_usuario(id):
 
 @main.route('/usuario/<int:id>/resetear-password', methods=['POST'])
 @login_required
+@requiere_permiso
 def resetear_password_usuario(id):
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     usuario = Usuario.query.get_or_404(id)
     usuario.password = generate_password_hash('123456')
     usuario.password_cambiada = False
@@ -267,16 +357,60 @@ def resetear_password_usuario(id):
     return redirect(url_for('main.lista_usuarios'))
 
 
+# ============================================
+# HORARIOS DE LOS MÉDICOS (ADMIN)
+# ============================================
+@main.route('/usuario/<int:id>/horarios', methods=['GET', 'POST'])
+@login_required
+@requiere_permiso
+def horarios_medico(id):
+    medico = Usuario.query.get_or_404(id)
+    form = HorarioMedicoForm()
+    form.especialidad_id.choices = [(e.id, e.nombre) for e in Especialidad.query.order_by(Especialidad.nombre).all()]
+
+    if form.validate_on_submit():
+        # Las franjas de un mismo día no se pueden cruzar
+        cruce = HorarioMedico.query.filter(
+            HorarioMedico.medico_id == medico.id,
+            HorarioMedico.dia_semana == form.dia_semana.data,
+            HorarioMedico.hora_inicio < form.hora_fin.data,
+            HorarioMedico.hora_fin > form.hora_inicio.data
+        ).first()
+        if cruce:
+            flash('El horario se cruza con otra franja del médico ese día', 'warning')
+        else:
+            horario = HorarioMedico(medico_id=medico.id)
+            form.populate_obj(horario)
+            db.session.add(horario)
+            db.session.commit()
+            flash('Horario agregado', 'success')
+            return redirect(url_for('main.horarios_medico', id=medico.id))
+
+    horarios = HorarioMedico.query.options(db.joinedload(HorarioMedico.especialidad)) \
+        .filter_by(medico_id=medico.id) \
+        .order_by(HorarioMedico.dia_semana, HorarioMedico.hora_inicio).all()
+    return render_template('admin/horarios.html', medico=medico, horarios=horarios, form=form, dias=DIAS_SEMANA)
+
+
+@main.route('/horario/<int:id>/eliminar', methods=['POST'])
+@login_required
+@requiere_permiso
+def eliminar_horario(id):
+    horario = HorarioMedico.query.get_or_404(id)
+    medico_id = horario.medico_id
+    db.session.delete(horario)
+    db.session.commit()
+    flash('Horario eliminado', 'info')
+    return redirect(url_for('main.horarios_medico', id=medico_id))
+
+
 # ============================================
 # ESPECIALIDADES (ADMIN)
 # ============================================
 @main.route('/especialidades', methods=['GET', 'POST'])
 @login_required
+@requiere_permiso
 def lista_especialidades():
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     form = EspecialidadForm()
     if form.validate_on_submit():
         if Especialidad.query.filter_by(nombre=form.nombre.data).first():
@@ -289,16 +423,18 @@ def lista_especialidades():
             return redirect(url_for('main.lista_especialidades'))
 
     especialidades = Especialidad.query.all()
-    return render_template('admin/especialidades.html', especialidades=especialidades, form=form)
+    return render_template(
+        'admin/especialidades.html',
+        especialidades=especialidades,
+        citas_por_especialidad=citas_por_especialidad(),
+        form=form
+    )
 
 
 @main.route('/especialidad/<int:id>/editar', methods=['POST'])
 @login_required
+@requiere_permiso
 def editar_especialidad(id):
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     especialidad = Especialidad.query.get_or_404(id)
     nombre_nuevo = request.form.get('nombre', '').strip()
 
@@ -324,16 +460,15 @@ def editar_especialidad(id):
 
 @main.route('/especialidad/<int:id>/eliminar', methods=['POST'])
 @login_required
+@requiere_permiso
 def eliminar_especialidad(id):
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     especialidad = Especialidad.query.get_or_404(id)
 
     # Verificar si tiene citas asociadas
-    if especialidad.citas:
-        flash(f'No se puede eliminar: La especialidad "{especialidad.nombre}" tiene {len(especialidad.citas)} cita(s) asociada(s)', 'danger')
+    C = con_archivo(Cita)
+    total_citas = db.session.query(C).filter(C.especialidad_id == especialidad.id).count()
+    if total_citas:
+        flash(f'No se puede eliminar: La especialidad "{especialidad.nombre}" tiene {total_citas} cita(s) asociada(s)', 'danger')
         return redirect(url_for('main.lista_especialidades'))
 
     nombre = especialidad.nombre
@@ -348,11 +483,8 @@ def eliminar_especialidad(id):
 # ============================================
 @main.route('/roles', methods=['GET', 'POST'])
 @login_required
+@requiere_permiso
 def lista_roles():
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     form = RolForm()
     if form.validate_on_submit():
         if Rol.query.filter_by(nombre=form.nombre.data).first():
@@ -365,16 +497,13 @@ def lista_roles():
             return redirect(url_for('main.lista_roles'))
 
     roles = Rol.query.all()
-    return render_template('admin/roles.html', roles=roles, form=form)
+    return render_template('admin/roles.html', roles=roles, usuarios_por_rol=usuarios_por_rol(), form=form)
 
 
 @main.route('/rol/<int:id>/editar', methods=['POST'])
 @login_required
+@requiere_permiso
 def editar_rol(id):
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     rol = Rol.query.get_or_404(id)
     nombre_nuevo = request.form.get('nombre', '').strip()
     descripcion_nueva = request.form.get('descripcion', '').strip()
@@ -402,16 +531,14 @@ def editar_rol(id):
 
 @main.route('/rol/<int:id>/eliminar', methods=['POST'])
 @login_required
+@requiere_permiso
 def eliminar_rol(id):
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
-
     rol = Rol.query.get_or_404(id)
 
     # Verificar si tiene usuarios asociados
-    if rol.usuarios:
-        flash(f'No se puede eliminar: El rol "{rol.nombre}" tiene {len(rol.usuarios)} usuario(s) asociado(s)', 'danger')
+    total_usuarios = Usuario.query.filter_by(rol_id=rol.id).count()
+    if total_usuarios:
+        flash(f'No se puede eliminar: El rol "{rol.nombre}" tiene {total_usuarios} usuario(s) asociado(s)', 'danger')
         return redirect(url_for('main.lista_roles'))
 
     nombre = rol.nombre
@@ -424,51 +551,185 @@ def eliminar_rol(id):
 # ============================================
 # CITAS
 # ============================================
+ESTADOS_CITA = ['Pendiente', 'Realizada', 'Cancelada']
+
+
+def _parsear_fecha(valor):
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d') if valor else None
+    except ValueError:
+        return None
+
+
+def _obtener_modificable(modelo, id, destino):
+    """Fila de la tabla para modificarla; si ya se archivó, avisa y vuelve a `destino` en lugar de un 404"""
+    fila = db.session.get(modelo, id)
+    if fila is None:
+        if esta_archivada(modelo, id):
+            flash('El registro está archivado y ya no se puede modificar', 'warning')
+            abort(redirect(destino))
+        abort(404)
+    return fila
+
+
 @main.route('/citas')
 @login_required
+@condicional('Cita', 'Paciente', 'Especialidad')
+@solo_lectura
 def lista_citas():
     query = request.args.get('q', '').strip()
-    if query:
-        citas = Cita.query.join(Paciente).join(Usuario, Cita.medico_id == Usuario.id).join(Especialidad).filter(
-            db.or_(
-                Paciente.nombre.contains(query),
-                Paciente.identificacion.contains(query),
-                Usuario.nombre.contains(query),
-                Especialidad.nombre.contains(query)
+    desde = _parsear_fecha(request.args.get('desde'))
+    hasta = _parsear_fecha(request.args.get('hasta'))
+    estado = request.args.get('estado', '')
+    medico_id = request.args.get('medico_id', type=int)
+
+    def construir(C):
+        # Paciente, médico y especialidad en la misma consulta (sin N+1 en la plantilla)
+        consulta = db.session.query(C).outerjoin(C.paciente).outerjoin(C.medico).outerjoin(C.especialidad).options(
+            db.contains_eager(C.paciente),
+            db.contains_eager(C.medico),
+            db.contains_eager(C.especialidad)
+        )
+        if query:
+            consulta = consulta.filter(
+                db.or_(
+                    Paciente.nombre.contains(query),
+                    Paciente.identificacion.contains(query),
+                    Usuario.nombre.contains(query),
+                    Especialidad.nombre.contains(query)
+                )
             )
-        ).order_by(Cita.fecha.desc()).all()
-    else:
-        citas = Cita.query.order_by(Cita.fecha.desc()).all()
-    return render_template('cita/citas.html', citas=citas)
+        if desde:
+            consulta = consulta.filter(C.fecha >= desde)
+        if hasta:
+            consulta = consulta.filter(C.fecha < hasta + timedelta(days=1))
+        if estado in ESTADOS_CITA:
+            consulta = consulta.filter(C.estado == estado)
+        if medico_id:
+            consulta = consulta.filter(C.medico_id == medico_id)
+        return consulta
+
+    # Las citas archivadas se unen solo si la página llega a sus fechas
+    pagina = paginar_por_fecha(
+        construir,
+        Cita,
+        obtener_por_pagina('CITAS_POR_PAGINA'),
+        despues=request.args.get('despues', type=int),
+        antes=request.args.get('antes', type=int),
+        desde=desde
+    )
+
+    medicos = Usuario.query.join(Rol).filter(Rol.nombre == 'medico').order_by(Usuario.nombre).all()
+    filtros = {
+        'q': query or None,
+        'desde': request.args.get('desde') or None,
+        'hasta': request.args.get('hasta') or None,
+        'estado': estado or None,
+        'medico_id': medico_id,
+        'por_pagina': request.args.get('por_pagina')
+    }
+    return render_template(
+        'cita/citas.html',
+        citas=pagina.items,
+        pagina=pagina,
+        medicos=medicos,
+        estados=ESTADOS_CITA,
+        filtros=filtros
+    )
 
 
 @main.route('/cita/nueva', methods=['GET', 'POST'])
 @login_required
 def crear_cita():
     form = CitaForm()
-    form.paciente_id.choices = [(p.id, f"{p.nombre} ({p.identificacion})") for p in Paciente.query.filter_by(activo=True).all()]
-    form.medico_id.choices = [(u.id, u.nombre) for u in Usuario.query.join(Rol).filter(Rol.nombre == 'medico', Usuario.activo == True).all()]
-    form.especialidad_id.choices = [(e.id, e.nombre) for e in Especialidad.query.all()]
 
     if form.validate_on_submit():
+        bloquear_agenda(form.medico_id.data)
+        error, duracion = validar_cupo(form.medico_id.data, form.especialidad_id.data, form.fecha.data)
+        if error:
+            db.session.rollback()
+            flash(error, 'warning')
+            return render_template('cita/crear.html', form=form, etiquetas=form.etiquetas())
+
         cita = Cita(
             paciente_id=form.paciente_id.data,
             medico_id=form.medico_id.data,
             especialidad_id=form.especialidad_id.data,
             fecha=form.fecha.data,
+            duracion_minutos=duracion,
             estado='Pendiente'
         )
         db.session.add(cita)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otra escritura tomó el cupo sin pasar por bloquear_agenda (la base la rechaza)
+            db.session.rollback()
+            flash('Ese cupo acaba de ser asignado a otro paciente, elige otro', 'warning')
+            return render_template('cita/crear.html', form=form, etiquetas=form.etiquetas())
         flash('Cita agendada exitosamente', 'success')
         return redirect(url_for('main.lista_citas'))
-    return render_template('cita/crear.html', form=form)
+    return render_template('cita/crear.html', form=form, etiquetas=form.etiquetas())
+
+
+# --- Autocompletado del formulario de citas ---
+def _sugerencias(funcion):
+    termino = request.args.get('q', '')
+    return jsonify({'resultados': funcion(termino, current_app.config['AUTOCOMPLETAR_LIMITE'])})
+
+
+@main.route('/autocompletar/pacientes')
+@login_required
+def autocompletar_pacientes():
+    return _sugerencias(sugerir_pacientes)
+
+
+@main.route('/autocompletar/medicos')
+@login_required
+def autocompletar_medicos():
+    return _sugerencias(sugerir_medicos)
+
+
+@main.route('/autocompletar/especialidades')
+@login_required
+def autocompletar_especialidades():
+    return _sugerencias(sugerir_especialidades)
+
+
+@main.route('/agenda/cupos')
+@login_required
+def proximos_cupos_especialidad():
+    """Próximos cupos libres de una especialidad (JSON) para agendar desde recepción"""
+    especialidad_id = request.args.get('especialidad_id', type=int)
+    if especialidad_id is None:
+        return jsonify({'error': 'especialidad_id es requerido'}), 400
+    maximo = current_app.config['AGENDA_CUPOS_MAXIMO']
+    cantidad = min(max(request.args.get('cantidad', 5, type=int), 1), maximo)
+
+    cupos = proximos_cupos(especialidad_id, cantidad)
+    return jsonify({'cupos': [
+        {'medico_id': c['medico_id'], 'medico': c['medico'], 'fecha': c['fecha'].strftime('%Y-%m-%dT%H:%M')}
+        for c in cupos
+    ]})
+
+
+@main.route('/agenda/medico/<int:id>/cupos')
+@login_required
+def cupos_libres_medico(id):
+    """Cupos libres de un médico en un día (JSON)"""
+    dia = parsear_dia(request.args.get('fecha')) or datetime.now().date()
+    especialidad_id = request.args.get('especialidad_id', type=int)
+    cupos = cupos_medico(id, dia, especialidad_id)
+    return jsonify({
+        'fecha': dia.isoformat(),
+        'cupos': [inicio.strftime('%Y-%m-%dT%H:%M') for inicio in cupos]
+    })
 
 
 @main.route('/cita/<int:id>/realizada')
 @login_required
 def marcar_cita_realizada(id):
-    cita = Cita.query.get_or_404(id)
+    cita = _obtener_modificable(Cita, id, url_for('main.lista_citas'))
     cita.estado = 'Realizada'
     db.session.commit()
     flash('Cita marcada como realizada', 'success')
@@ -478,7 +739,7 @@ def marcar_cita_realizada(id):
 @main.route('/cita/<int:id>/eliminar')
 @login_required
 def eliminar_cita(id):
-    cita = Cita.query.get_or_404(id)
+    cita = _obtener_modificable(Cita, id, url_for('main.lista_citas'))
     db.session.delete(cita)
     db.session.commit()
     flash('Cita eliminada', 'info')
@@ -487,86 +748,321 @@ def eliminar_cita(id):
 
 @main.route('/cita/<int:id>/tiquete')
 @login_required
+@condicional('Cita', 'Paciente', 'Especialidad')
 def tiquete_cita(id):
-    cita = Cita.query.get_or_404(id)
+    cita = obtener_con_archivo(Cita, id) or abort(404)
     return render_template('cita/tiquete.html', cita=cita)
 
 
 # ============================================
 # REPORTES
 # ============================================
+def _respuesta_pdf_archivo(ruta, nombre_archivo, descarga, temporal):
+    """Envía el PDF por partes y borra el directorio temporal al terminar"""
+    def partes():
+        try:
+            with open(ruta, 'rb') as f:
+                while True:
+                    bloque = f.read(64 * 1024)
+                    if not bloque:
+                        break
+                    yield bloque
+        finally:
+            shutil.rmtree(temporal, ignore_errors=True)
+
+    response = Response(partes(), mimetype='application/pdf')
+    response.headers['Content-Length'] = str(os.path.getsize(ruta))
+    disposicion = 'attachment' if descarga else 'inline'
+    response.headers['Content-Disposition'] = f'{disposicion}; filename={nombre_archivo}'
+    return response
+
+
+def _generar_pdf(plantilla, generador, nombre_archivo, descarga=False, huella=None, dependencias=(), clave_lotes=None):
+    """
+    Sirve el PDF desde la caché o encola su generación y redirige a la página de progreso.
+    `generador()` devuelve el contexto de la plantilla y corre fuera de la petición.
+    `huella` y `dependencias` (nombres de modelos) forman la clave de caché,
+    que es también el ETag: si el cliente ya tiene esa versión se responde 304
+    sin generar nada.
+    `clave_lotes` nombra la variable del contexto que se recorre y maqueta por lotes.
+    """
+    clave = None
+    etag = ultima_modificacion = None
+    if huella is not None:
+        clave = cache_pdf.clave(plantilla, huella, dependencias)
+        etag, ultima_modificacion = validadores(clave, nombre_archivo, descarga, modelos=dependencias)
+        respuesta = no_modificado(etag, ultima_modificacion)
+        if respuesta is not None:
+            return respuesta
+        if not cache_pdf.activa:
+            clave = None
+
+    if clave:
+        ruta = cache_pdf.obtener(clave)
+        if ruta:
+            return marcar(
+                send_file(ruta, mimetype='application/pdf', as_attachment=descarga, download_name=nombre_archivo),
+                etag, ultima_modificacion
+            )
+
+    if not current_app.config['PDF_ASINCRONO']:
+        temporal = tempfile.mkdtemp()
+        ruta = os.path.join(temporal, 'reporte.pdf')
+        try:
+            with metricas.medir_pdf(plantilla, 'html'):
+                archivos_html = escribir_html(plantilla, generador(), temporal, clave_lotes)
+            with metricas.medir_pdf(plantilla, 'maquetacion'):
+                maquetar(archivos_html, ruta)
+            if clave:
+                cache_pdf.guardar(clave, ruta)
+        except Exception:
+            shutil.rmtree(temporal, ignore_errors=True)
+            raise
+        respuesta = _respuesta_pdf_archivo(ruta, nombre_archivo, descarga, temporal)
+        return marcar(respuesta, etag, ultima_modificacion) if etag else respuesta
+
+    try:
+        trabajo_id = cola_pdf.encolar(
+            plantilla, replicas.envolver(generador), nombre_archivo, descarga,
+            usuario_id=current_user.id, clave_cache=clave, clave_lotes=clave_lotes
+        )
+    except ColaLlena:
+        flash('Hay demasiados reportes en proceso. Intente de nuevo en unos minutos.', 'warning')
+        return redirect(url_for('main.menu_reportes'))
+    return redirect(url_for('main.trabajo_pdf', trabajo_id=trabajo_id))
+
+
+def _fecha_generacion():
+    return datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+
+
 @main.route('/reporte/pacientes.pdf')
 @login_required
+@solo_lectura
 def reporte_pacientes_pdf():
-    pacientes = Paciente.query.all()
-    fecha_generacion = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-    
-    html = render_template(
-        'reporte/pacientes_pdf.html',
-        pacientes=pacientes,
-        fecha_generacion=fecha_generacion
+    def generador():
+        total, activos = db.session.query(
+            db.func.count(Paciente.id),
+            db.func.count(Paciente.id).filter(Paciente.activo == True)
+        ).one()
+        return {
+            # Iterador perezoso: las filas se leen y maquetan por lotes
+            'pacientes': db.session.scalars(
+                db.select(Paciente).order_by(Paciente.id).execution_options(yield_per=500)
+            ),
+            'stats': {'total': total, 'activos': activos},
+            'fecha_generacion': _fecha_generacion()
+        }
+
+    huella = db.session.query(db.func.count(Paciente.id), db.func.max(Paciente.id)).one()
+    return _generar_pdf(
+        'reporte/pacientes_pdf.html', generador, 'reporte_pacientes.pdf',
+        huella=tuple(huella), dependencias=('Paciente',), clave_lotes='pacientes'
     )
-    
-    pdf = HTML(string=html).write_pdf()
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'inline; filename=reporte_pacientes.pdf'
-    return response
 
 
 @main.route('/reporte/citas.pdf')
 @login_required
+@solo_lectura
 def reporte_citas_pdf():
-    citas = Cita.query.order_by(Cita.fecha.desc()).all()
-    fecha_generacion = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-    
-    html = render_template(
-        'reporte/citas_pdf.html',
-        citas=citas,
-        fecha_generacion=fecha_generacion
+    def generador():
+        # El reporte abarca todas las fechas: incluye las citas archivadas
+        C = con_archivo(Cita)
+        conteos = dict(db.session.query(C.estado, db.func.count(C.id)).group_by(C.estado).all())
+        citas = db.session.scalars(
+            db.select(C).options(
+                db.joinedload(C.paciente),
+                db.joinedload(C.medico),
+                db.joinedload(C.especialidad)
+            ).order_by(C.fecha.desc(), C.id.desc()).execution_options(yield_per=500)
+        )
+        return {
+            'citas': citas,
+            'stats': {
+                'total': sum(conteos.values()),
+                'pendientes': conteos.get('Pendiente', 0),
+                'realizadas': conteos.get('Realizada', 0),
+                'canceladas': conteos.get('Cancelada', 0)
+            },
+            'fecha_generacion': _fecha_generacion()
+        }
+
+    huella = db.session.query(db.func.count(Cita.id), db.func.max(Cita.fecha), db.func.max(Cita.id)).one()
+    return _generar_pdf(
+        'reporte/citas_pdf.html', generador, 'reporte_citas.pdf',
+        huella=tuple(huella), dependencias=('Cita', 'CitaArchivo', 'Paciente', 'Usuario', 'Especialidad'),
+        clave_lotes='citas'
     )
-    
-    pdf = HTML(string=html).write_pdf()
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'inline; filename=reporte_citas.pdf'
-    return response
 
 
 @main.route('/reporte/especialidades.pdf')
 @login_required
+@requiere_permiso
+@solo_lectura
 def reporte_especialidades_pdf():
-    if current_user.rol is None or current_user.rol.nombre != 'admin':
-        flash('Acceso denegado', 'danger')
-        return redirect(url_for('main.dashboard'))
+    def generador():
+        return {
+            'especialidades': Especialidad.query.all(),
+            'citas_por_especialidad': citas_por_especialidad(),
+            'medicos_por_especialidad': medicos_por_especialidad(),
+            'fecha_generacion': _fecha_generacion()
+        }
+
+    huella = (Especialidad.query.count(), Cita.query.count())
+    return _generar_pdf(
+        'reporte/especialidades_pdf.html', generador, 'reporte_especialidades.pdf',
+        huella=huella, dependencias=('Especialidad', 'Cita', 'CitaArchivo', 'Usuario')
+    )
 
-    especialidades = Especialidad.query.all()
-    fecha_generacion = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
 
-    html = render_template(
-        'reporte/especialidades_pdf.html',
-        especialidades=especialidades,
-        fecha_generacion=fecha_generacion
+@main.route('/pdf/trabajo/<trabajo_id>')
+@login_required
+def trabajo_pdf(trabajo_id):
+    """Página de espera mientras se genera el PDF"""
+    trabajo = _obtener_trabajo_pdf(trabajo_id)
+    return render_template('pdf/trabajo.html', trabajo=trabajo)
+
+
+@main.route('/pdf/trabajo/<trabajo_id>/estado')
+@login_required
+def estado_trabajo_pdf(trabajo_id):
+    trabajo = _obtener_trabajo_pdf(trabajo_id)
+    return jsonify({
+        'id': trabajo['id'],
+        'estado': trabajo['estado'],
+        'progreso': trabajo['progreso'],
+        'error': trabajo['error'],
+        'url': url_for('main.archivo_trabajo_pdf', trabajo_id=trabajo_id) if trabajo['estado'] == 'terminado' else None
+    })
+
+
+@main.route('/pdf/trabajo/<trabajo_id>/archivo')
+@login_required
+def archivo_trabajo_pdf(trabajo_id):
+    trabajo = _obtener_trabajo_pdf(trabajo_id)
+    if trabajo['estado'] != 'terminado':
+        return redirect(url_for('main.trabajo_pdf', trabajo_id=trabajo_id))
+    return send_file(
+        cola_pdf.ruta_archivo(trabajo_id),
+        mimetype='application/pdf',
+        as_attachment=trabajo['descarga'],
+        download_name=trabajo['nombre_archivo']
     )
 
-    pdf = HTML(string=html).write_pdf()
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'inline; filename=reporte_especialidades.pdf'
+
+def _obtener_trabajo_pdf(trabajo_id):
+    trabajo = cola_pdf.estado(trabajo_id)
+    if not trabajo or trabajo['usuario_id'] != current_user.id:
+        abort(404)
+    return trabajo
+
+
+# ============================================
+# EXPORTACIONES (CSV)
+# ============================================
+def _respuesta_csv(nombre_archivo, encabezados, consulta):
+    """
+    Envía el resultado de `consulta` (un select de columnas) como CSV por partes.
+    Las filas se leen del cursor en bloques (yield_per) sin construir objetos ORM.
+    """
+    def filas():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM para que Excel respete las tildes
+        escritor.writerow(encabezados)
+        resultado = db.session.execute(consulta.execution_options(yield_per=1000))
+        for lote in resultado.partitions():
+            escritor.writerows(lote)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        yield buffer.getvalue()
+
+    response = Response(stream_with_context(filas()), mimetype='text/csv; charset=utf-8')
+    response.headers['Content-Disposition'] = f'attachment; filename={nombre_archivo}'
     return response
 
 
+def _filtro_fechas(columna, consulta):
+    desde = _parsear_fecha(request.args.get('desde'))
+    hasta = _parsear_fecha(request.args.get('hasta'))
+    if desde:
+        consulta = consulta.where(columna >= desde)
+    if hasta:
+        consulta = consulta.where(columna < hasta + timedelta(days=1))
+    return consulta
+
+
+@main.route('/exportar/pacientes.csv')
+@login_required
+@requiere_permiso
+def exportar_pacientes_csv():
+    consulta = db.select(
+        Paciente.id, Paciente.nombre, Paciente.identificacion, Paciente.sexo,
+        Paciente.fecha_nacimiento, Paciente.telefono, Paciente.email,
+        Paciente.direccion, Paciente.activo
+    ).order_by(Paciente.id)
+    return _respuesta_csv(
+        'pacientes.csv',
+        ['id', 'nombre', 'identificacion', 'sexo', 'fecha_nacimiento', 'telefono', 'email', 'direccion', 'activo'],
+        consulta
+    )
+
+
+@main.route('/exportar/citas.csv')
+@login_required
+@requiere_permiso
+def exportar_citas_csv():
+    C = con_archivo(Cita, _parsear_fecha(request.args.get('desde')))
+    consulta = db.select(
+        C.id, C.fecha, C.estado,
+        Paciente.id, Paciente.identificacion, Paciente.nombre,
+        Usuario.id, Usuario.nombre,
+        Especialidad.id, Especialidad.nombre
+    ).select_from(C).outerjoin(C.paciente).outerjoin(C.medico).outerjoin(C.especialidad)
+    consulta = _filtro_fechas(C.fecha, consulta).order_by(C.fecha, C.id)
+    return _respuesta_csv(
+        'citas.csv',
+        ['id', 'fecha', 'estado', 'paciente_id', 'paciente_identificacion', 'paciente_nombre',
+         'medico_id', 'medico_nombre', 'especialidad_id', 'especialidad_nombre'],
+        consulta
+    )
+
+
+@main.route('/exportar/historias.csv')
+@login_required
+@requiere_permiso
+def exportar_historias_csv():
+    """Metadatos de las entradas de historia clínica (sin el contenido clínico)"""
+    E = con_archivo(HistoriaEntrada, _parsear_fecha(request.args.get('desde')))
+    consulta = db.select(
+        E.id, E.fecha, E.historia_id,
+        Paciente.id, Paciente.identificacion,
+        E.autor_id, Usuario.nombre,
+        db.func.length(E.contenido)
+    ).select_from(E).join(
+        HistoriaClinica, E.historia_id == HistoriaClinica.id
+    ).outerjoin(
+        Paciente, HistoriaClinica.paciente_id == Paciente.id
+    ).outerjoin(
+        Usuario, E.autor_id == Usuario.id
+    )
+    consulta = _filtro_fechas(E.fecha, consulta).order_by(E.fecha, E.id)
+    return _respuesta_csv(
+        'historias.csv',
+        ['id', 'fecha', 'historia_id', 'paciente_id', 'paciente_identificacion',
+         'autor_id', 'autor_nombre', 'longitud_contenido'],
+        consulta
+    )
+
+
 @main.route('/reportes')
 @login_required
+@solo_lectura
 def menu_reportes():
     """Vista principal del menú de reportes"""
-    # Obtener estadísticas para mostrar en el dashboard
-    stats = {
-        'total_pacientes': Paciente.query.filter_by(activo=True).count(),
-        'total_citas': Cita.query.count(),
-        'total_especialidades': Especialidad.query.count(),
-        'citas_pendientes': Cita.query.filter_by(estado='Pendiente').count()
-    }
+    # Obtener estadísticas para mostrar en el dashboard (una sola consulta)
+    stats = estadisticas_generales()
     return render_template('reporte/menu_reportes.html', stats=stats)
 
 
@@ -576,6 +1072,7 @@ def menu_reportes():
 
 @main.route('/paciente/<int:id>/historia', methods=['GET', 'POST'])
 @login_required
+@requiere_permiso
 def historia_clinica(id):
     paciente = Paciente.query.get_or_404(id)
 
@@ -593,7 +1090,7 @@ def historia_clinica(id):
             flash('El contenido no puede estar vacío', 'danger')
             return redirect(url_for('main.historia_clinica', id=id))
 
-        # Crear nueva entrada
+        # Crear nueva entrada (agregar no crea versiones)
         entrada = HistoriaEntrada(
             historia_id=historia.id,
             autor_id=current_user.id,
@@ -605,22 +1102,73 @@ def historia_clinica(id):
         flash('Entrada agregada a la historia clínica exitosamente', 'success')
         return redirect(url_for('main.historia_clinica', id=id))
 
-    # Obtener entradas ordenadas por fecha descendente
-    entradas = HistoriaEntrada.query.filter_by(historia_id=historia.id).order_by(HistoriaEntrada.fecha.desc()).all()
+    # Primera página de la línea de tiempo; el resto se carga con entradas_historia
+    pagina = _pagina_entradas_historia(historia.id)
+
+    # Totales de la historia en una sola consulta (con las entradas archivadas)
+    E = con_archivo(HistoriaEntrada)
+    total, propias, ultima = db.session.execute(
+        db.select(
+            db.func.count(E.id),
+            db.func.count(E.id).filter(E.autor_id == current_user.id),
+            db.func.max(E.fecha)
+        ).where(E.historia_id == historia.id)
+    ).one()
+
+    # Últimas 5 citas del paciente y el total, sin cargar todas
+    citas_recientes = paginar_por_fecha(
+        lambda C: db.session.query(C).filter(C.paciente_id == id).options(
+            db.joinedload(C.medico),
+            db.joinedload(C.especialidad)
+        ),
+        Cita,
+        5
+    ).items
+    C = con_archivo(Cita)
+    total_citas = db.session.scalar(db.select(db.func.count(C.id)).where(C.paciente_id == id))
 
     return render_template(
         'historia/historia_clinica.html',
         paciente=paciente,
         historia=historia,
-        entradas=entradas
+        pagina=pagina,
+        estadisticas={'total': total, 'propias': propias, 'ultima': ultima},
+        citas_recientes=citas_recientes,
+        total_citas=total_citas
+    )
+
+
+@main.route('/paciente/<int:id>/historia/entradas')
+@login_required
+@requiere_permiso
+def entradas_historia(id):
+    """Fragmento HTML con la siguiente página de entradas (scroll de la línea de tiempo)"""
+    historia = HistoriaClinica.query.filter_by(paciente_id=id).first_or_404()
+    pagina = _pagina_entradas_historia(historia.id)
+    return jsonify({
+        'html': render_template('historia/_entradas.html', paciente_id=id, entradas=pagina.items),
+        'siguiente': pagina.siguiente
+    })
+
+
+def _pagina_entradas_historia(historia_id):
+    """Entradas más recientes primero, con autor y rol cargados en la misma consulta"""
+    return paginar_por_fecha(
+        lambda E: db.session.query(E).filter(E.historia_id == historia_id).options(
+            db.joinedload(E.autor).joinedload(Usuario.rol)
+        ),
+        HistoriaEntrada,
+        obtener_por_pagina('HISTORIA_ENTRADAS_POR_PAGINA'),
+        despues=request.args.get('despues', type=int)
     )
 
 
 @main.route('/paciente/<int:id>/historia/entrada/<int:entrada_id>/editar', methods=['GET', 'POST'])
 @login_required
+@requiere_permiso
 def editar_entrada_historia(id, entrada_id):
     paciente = Paciente.query.get_or_404(id)
-    entrada = HistoriaEntrada.query.get_or_404(entrada_id)
+    entrada = _obtener_modificable(HistoriaEntrada, entrada_id, url_for('main.historia_clinica', id=id))
 
     # Verificar que la entrada pertenece a este paciente
     if entrada.historia.paciente_id != id:
@@ -639,6 +1187,8 @@ def editar_entrada_historia(id, entrada_id):
             flash('El contenido no puede estar vacío', 'danger')
             return render_template('historia/editar_entrada.html', paciente=paciente, entrada=entrada)
 
+        bloquear_historia(entrada.historia_id)
+        registrar_cambio_entrada(entrada, entrada.contenido, contenido_nuevo, current_user.id)
         entrada.contenido = contenido_nuevo
         db.session.commit()
 
@@ -650,9 +1200,10 @@ def editar_entrada_historia(id, entrada_id):
 
 @main.route('/paciente/<int:id>/historia/entrada/<int:entrada_id>/eliminar', methods=['POST'])
 @login_required
+@requiere_permiso
 def eliminar_entrada_historia(id, entrada_id):
     paciente = Paciente.query.get_or_404(id)
-    entrada = HistoriaEntrada.query.get_or_404(entrada_id)
+    entrada = _obtener_modificable(HistoriaEntrada, entrada_id, url_for('main.historia_clinica', id=id))
 
     # Verificar que la entrada pertenece a este paciente
     if entrada.historia.paciente_id != id:
@@ -665,6 +1216,8 @@ def eliminar_entrada_historia(id, entrada_id):
         return redirect(url_for('main.historia_clinica', id=id))
 
     # Eliminar la entrada
+    bloquear_historia(entrada.historia_id)
+    registrar_cambio_entrada(entrada, entrada.contenido, '', current_user.id)
     db.session.delete(entrada)
     db.session.commit()
 
@@ -672,122 +1225,172 @@ def eliminar_entrada_historia(id, entrada_id):
     return redirect(url_for('main.historia_clinica', id=id))
 
 
-@main.route('/paciente/<int:id>/historia/imprimir')
-@login_required
-def imprimir_historia(id):
-    """Genera PDF para ver en el navegador"""
-    paciente = Paciente.query.get_or_404(id)
-    historia = HistoriaClinica.query.filter_by(paciente_id=id).first()
+def _calcular_edad(fecha_nacimiento):
+    if not fecha_nacimiento:
+        return None
+    today = datetime.now().date()
+    edad = today.year - fecha_nacimiento.year
+    if today.month < fecha_nacimiento.month or \
+       (today.month == fecha_nacimiento.month and today.day < fecha_nacimiento.day):
+        edad -= 1
+    return edad
 
-    if not historia:
-        historia = HistoriaClinica(paciente_id=id)
-        entradas = []
-    else:
-        # Verificar si solo recientes
-        solo_recientes = request.args.get('solo_recientes', '0') == '1'
-        if solo_recientes:
+
+def _generador_historia_pdf(id, solo_recientes):
+    """Datos del PDF de la historia clínica (todas las entradas o las de los últimos 30 días)"""
+    def generador():
+        paciente = db.session.get(Paciente, id)
+        historia = HistoriaClinica.query.filter_by(paciente_id=id).first()
+
+        if not historia:
+            historia = HistoriaClinica(paciente_id=id)
+            entradas = []
+        elif solo_recientes:
             # Entradas de los últimos 30 días
             fecha_limite = datetime.now() - timedelta(days=30)
-            entradas = HistoriaEntrada.query.filter(
-                HistoriaEntrada.historia_id == historia.id,
-                HistoriaEntrada.fecha >= fecha_limite
-            ).order_by(HistoriaEntrada.fecha.desc()).all()
+            E = con_archivo(HistoriaEntrada, fecha_limite)
+            entradas = db.session.query(E).filter(
+                E.historia_id == historia.id,
+                E.fecha >= fecha_limite
+            ).order_by(E.fecha.desc()).all()
         else:
-            entradas = HistoriaEntrada.query.filter_by(historia_id=historia.id).order_by(HistoriaEntrada.fecha.desc()).all()
+            E = con_archivo(HistoriaEntrada)
+            entradas = db.session.query(E).filter(E.historia_id == historia.id).order_by(E.fecha.desc()).all()
+
+        return {
+            'paciente': paciente,
+            'historia': historia,
+            'entradas': entradas,
+            'fecha_generacion': _fecha_generacion(),
+            'edad': _calcular_edad(paciente.fecha_nacimiento),
+            'solo_recientes': solo_recientes
+        }
+
+    return generador
+
+
+def _huella_historia_pdf(id, solo_recientes):
+    """Conteo y fecha máxima de las entradas; las recientes dependen además del día"""
+    historia = HistoriaClinica.query.filter_by(paciente_id=id).first()
+    if not historia:
+        return (id, None, solo_recientes)
+    conteo, ultima = db.session.query(
+        db.func.count(HistoriaEntrada.id), db.func.max(HistoriaEntrada.fecha)
+    ).filter(HistoriaEntrada.historia_id == historia.id).one()
+    dia = datetime.now().date() if solo_recientes else None
+    return (id, historia.id, historia.ultima_actualizacion, conteo, ultima, solo_recientes, dia)
 
-    # Calcular edad si existe fecha de nacimiento
-    edad = None
-    if paciente.fecha_nacimiento:
-        today = datetime.now().date()
-        edad = today.year - paciente.fecha_nacimiento.year
-        if today.month < paciente.fecha_nacimiento.month or \
-           (today.month == paciente.fecha_nacimiento.month and today.day < paciente.fecha_nacimiento.day):
-            edad -= 1
 
-    fecha_generacion = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+DEPENDENCIAS_HISTORIA_PDF = ('Paciente', 'HistoriaClinica', 'HistoriaEntrada', 'HistoriaEntradaArchivo', 'Usuario')
 
-    html = render_template(
+
+@main.route('/paciente/<int:id>/historia/imprimir')
+@login_required
+@requiere_permiso
+@solo_lectura
+def imprimir_historia(id):
+    """Genera PDF para ver en el navegador"""
+    paciente = Paciente.query.get_or_404(id)
+    solo_recientes = request.args.get('solo_recientes', '0') == '1'
+    return _generar_pdf(
         'historia/historia_clinica_pdf.html',
-        paciente=paciente,
-        historia=historia,
-        entradas=entradas,
-        fecha_generacion=fecha_generacion,
-        edad=edad,
-        solo_recientes=solo_recientes
+        _generador_historia_pdf(id, solo_recientes),
+        f'historia_clinica_{paciente.identificacion}.pdf',
+        huella=_huella_historia_pdf(id, solo_recientes),
+        dependencias=DEPENDENCIAS_HISTORIA_PDF
     )
 
-    pdf = HTML(string=html).write_pdf()
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'inline; filename=historia_clinica_{paciente.identificacion}.pdf'
-    return response
-
 
 @main.route('/paciente/<int:id>/historia/descargar')
 @login_required
+@requiere_permiso
+@solo_lectura
 def descargar_historia(id):
     """Genera PDF para descargar"""
     paciente = Paciente.query.get_or_404(id)
-    historia = HistoriaClinica.query.filter_by(paciente_id=id).first()
-
-    if not historia:
-        historia = HistoriaClinica(paciente_id=id)
-        entradas = []
-    else:
-        # Verificar si solo recientes
-        solo_recientes = request.args.get('solo_recientes', '0') == '1'
-        if solo_recientes:
-            # Entradas de los últimos 30 días
-            fecha_limite = datetime.now() - timedelta(days=30)
-            entradas = HistoriaEntrada.query.filter(
-                HistoriaEntrada.historia_id == historia.id,
-                HistoriaEntrada.fecha >= fecha_limite
-            ).order_by(HistoriaEntrada.fecha.desc()).all()
-        else:
-            entradas = HistoriaEntrada.query.filter_by(historia_id=historia.id).order_by(HistoriaEntrada.fecha.desc()).all()
-
-    # Calcular edad
-    edad = None
-    if paciente.fecha_nacimiento:
-        today = datetime.now().date()
-        edad = today.year - paciente.fecha_nacimiento.year
-        if today.month < paciente.fecha_nacimiento.month or \
-           (today.month == paciente.fecha_nacimiento.month and today.day < paciente.fecha_nacimiento.day):
-            edad -= 1
-
-    fecha_generacion = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-
-    html = render_template(
+    solo_recientes = request.args.get('solo_recientes', '0') == '1'
+    return _generar_pdf(
         'historia/historia_clinica_pdf.html',
-        paciente=paciente,
-        historia=historia,
-        entradas=entradas,
-        fecha_generacion=fecha_generacion,
-        edad=edad,
-        solo_recientes=solo_recientes
+        _generador_historia_pdf(id, solo_recientes),
+        f'historia_clinica_{paciente.nombre.replace(" ", "_")}_{paciente.identificacion}.pdf',
+        descarga=True,
+        huella=_huella_historia_pdf(id, solo_recientes),
+        dependencias=DEPENDENCIAS_HISTORIA_PDF
     )
 
-    pdf = HTML(string=html).write_pdf()
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=historia_clinica_{paciente.nombre.replace(" ", "_")}_{paciente.identificacion}.pdf'
-    return response
-
 
 @main.route('/paciente/<int:id>/historia/version/<int:version_id>')
 @login_required
+@requiere_permiso
 def ver_version_historia(id, version_id):
-    """Ver una versión específica de la historia"""
+    """Ver una versión específica de la historia, opcionalmente comparada con otra"""
     paciente = Paciente.query.get_or_404(id)
-    version = HistoriaVersion.query.get_or_404(version_id)
-    
+    version = HistoriaVersion.query.options(
+        db.joinedload(HistoriaVersion.autor).joinedload(Usuario.rol),
+        db.joinedload(HistoriaVersion.historia)
+    ).filter_by(id=version_id).first_or_404()
+
     # Verificar que la versión pertenece a este paciente
     if version.historia.paciente_id != id:
         flash('Versión no encontrada', 'danger')
         return redirect(url_for('main.historia_clinica', id=id))
-    
+
+    contenido = contenido_version(version.historia_id, version.numero)
+
+    # Versiones de la misma cadena (historia o entrada) para comparar, sin cargar su contenido
+    misma_cadena = (HistoriaVersion.entrada_id.is_(None) if version.entrada_id is None
+                    else HistoriaVersion.entrada_id == version.entrada_id)
+    otras = db.session.execute(
+        db.select(HistoriaVersion.id, HistoriaVersion.numero, HistoriaVersion.fecha)
+        .where(HistoriaVersion.historia_id == version.historia_id, misma_cadena,
+               HistoriaVersion.id != version.id)
+        .order_by(HistoriaVersion.numero.desc())
+    ).all()
+
+    comparada = None
+    bloques = None
+    comparar_id = request.args.get('comparar', type=int)
+    if comparar_id:
+        comparada = next((v for v in otras if v.id == comparar_id), None)
+        if comparada is not None:
+            contenido_comparada = contenido_version(version.historia_id, comparada.numero)
+            # Siempre de la versión más antigua a la más reciente
+            if comparada.numero < version.numero:
+                bloques = diferencias(contenido_comparada, contenido)
+            else:
+                bloques = diferencias(contenido, contenido_comparada)
+
     return render_template(
         'historia/ver_version.html',
         paciente=paciente,
-        version=version
-    )
\ No newline at end of file
+        version=version,
+        contenido=contenido,
+        otras=otras,
+        comparada=comparada,
+        bloques=bloques
+    )
+
+
+@main.route('/historias/buscar')
+@login_required
+@requiere_permiso
+def buscar_historias():
+    """Búsqueda de texto en las entradas de historia de todos los pacientes"""
+    termino = request.args.get('q', '').strip()
+    resultados = buscar_entradas(termino, limite=current_app.config['HISTORIA_BUSQUEDA_RESULTADOS']) if termino else []
+    return render_template('historia/buscar.html', paciente=None, termino=termino, resultados=resultados,
+                           archivadas_hasta=limite_archivo(HistoriaEntrada))
+
+
+@main.route('/paciente/<int:id>/historia/buscar')
+@login_required
+@requiere_permiso
+def buscar_historia_paciente(id):
+    """Búsqueda de texto en las entradas de la historia de un paciente"""
+    paciente = Paciente.query.get_or_404(id)
+    termino = request.args.get('q', '').strip()
+    resultados = buscar_entradas(
+        termino, paciente_id=id, limite=current_app.config['HISTORIA_BUSQUEDA_RESULTADOS']
+    ) if termino else []
+    return render_template('historia/buscar.html', paciente=paciente, termino=termino, resultados=resultados,
+                           archivadas_hasta=limite_archivo(HistoriaEntrada))
@@ -0,0 +1,293 @@
+import json
+import threading
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+
+
+# ============================================
+# DELTAS ENTRE VERSIONES
+# ============================================
+def calcular_delta(anterior, nuevo):
+    """
+    Operaciones por líneas para pasar de `anterior` a `nuevo`, en JSON compacto:
+    [[desde, hasta, [líneas nuevas]], ...] con índices sobre las líneas de `anterior`.
+    """
+    lineas_a = anterior.splitlines(keepends=True)
+    lineas_b = nuevo.splitlines(keepends=True)
+    operaciones = [
+        [i1, i2, lineas_b[j1:j2]]
+        for etiqueta, i1, i2, j1, j2 in SequenceMatcher(None, lineas_a, lineas_b, autojunk=False).get_opcodes()
+        if etiqueta != 'equal'
+    ]
+    return json.dumps(operaciones, ensure_ascii=False, separators=(',', ':'))
+
+
+def aplicar_delta(texto, delta):
+    """Aplica a `texto` un delta generado por calcular_delta"""
+    lineas = texto.splitlines(keepends=True)
+    resultado = []
+    posicion = 0
+    for desde, hasta, nuevas in json.loads(delta):
+        resultado.extend(lineas[posicion:desde])
+        resultado.extend(nuevas)
+        posicion = hasta
+    resultado.extend(lineas[posicion:])
+    return ''.join(resultado)
+
+
+def diferencias(texto_a, texto_b, contexto=3):
+    """
+    Bloques de diferencias por líneas entre dos textos, con `contexto` líneas
+    iguales alrededor de cada cambio. Cada línea es (tipo, número_a, número_b, texto)
+    con tipo 'igual', 'eliminada' o 'agregada'.
+    """
+    lineas_a = texto_a.splitlines()
+    lineas_b = texto_b.splitlines()
+    comparador = SequenceMatcher(None, lineas_a, lineas_b, autojunk=False)
+
+    bloques = []
+    for grupo in comparador.get_grouped_opcodes(contexto):
+        bloque = []
+        for etiqueta, i1, i2, j1, j2 in grupo:
+            if etiqueta == 'equal':
+                for k in range(i2 - i1):
+                    bloque.append(('igual', i1 + k + 1, j1 + k + 1, lineas_a[i1 + k]))
+                continue
+            for k in range(i1, i2):
+                bloque.append(('eliminada', k + 1, None, lineas_a[k]))
+            for k in range(j1, j2):
+                bloque.append(('agregada', None, k + 1, lineas_b[k]))
+        bloques.append(bloque)
+    return bloques
+
+
+# ============================================
+# CACHÉ DE VERSIONES RECONSTRUIDAS
+# ============================================
+class CacheVersiones:
+    """LRU por proceso de (historia_id, numero) -> contenido; las versiones no cambian"""
+
+    def __init__(self):
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            contenido = self._datos.get(clave)
+            if contenido is not None:
+                self._datos.move_to_end(clave)
+            return contenido
+
+    def guardar(self, clave, contenido, maximo):
+        with self._lock:
+            self._datos[clave] = contenido
+            self._datos.move_to_end(clave)
+            while len(self._datos) > maximo:
+                self._datos.popitem(last=False)
+
+    def vaciar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+cache_versiones = CacheVersiones()
+
+
+def _guardar_en_cache(historia_id, numero, contenido):
+    maximo = current_app.config.get('HISTORIA_VERSIONES_CACHE', 128)
+    if maximo > 0:
+        cache_versiones.guardar((historia_id, numero), contenido, maximo)
+
+
+def _guardar_al_confirmar(session, historia_id, numero, contenido):
+    """Una versión nueva entra a la caché solo si su transacción se confirma"""
+    session.info.setdefault('versiones_nuevas', []).append((historia_id, numero, contenido))
+
+
+@event.listens_for(Session, 'after_commit')
+def _cachear_versiones_nuevas(session):
+    for historia_id, numero, contenido in session.info.pop('versiones_nuevas', ()):
+        _guardar_en_cache(historia_id, numero, contenido)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_versiones_nuevas(session):
+    # Tras un rollback el mismo número puede reutilizarse con otro contenido
+    session.info.pop('versiones_nuevas', None)
+
+
+# ============================================
+# MOTOR DE VERSIONES
+# ============================================
+# Cada historia tiene varias cadenas de versiones con la numeración de la
+# historia: la del contenido de la historia (entrada_id NULL) y una por cada
+# entrada editada o eliminada. Los deltas y puntos de control son de la cadena.
+def _de_cadena(modelo, entrada_id):
+    """Condición SQL: misma cadena que `entrada_id` (None = contenido de la historia)"""
+    return modelo.entrada_id.is_(None) if entrada_id is None else modelo.entrada_id == entrada_id
+
+
+def contenido_version(historia_id, numero):
+    """
+    Reconstruye el contenido de la versión `numero` de la historia.
+
+    Lee en una consulta el último punto de control anterior de su cadena y
+    los deltas hasta `numero`; si alguna versión intermedia está en caché
+    se parte de ella en lugar del punto de control.
+    """
+    from .models import HistoriaVersion
+
+    clave = (historia_id, numero)
+    contenido = cache_versiones.obtener(clave)
+    if contenido is not None:
+        return contenido
+
+    entrada_id = db.session.scalar(
+        db.select(HistoriaVersion.entrada_id)
+        .where(HistoriaVersion.historia_id == historia_id, HistoriaVersion.numero == numero)
+    )
+    cadena = (HistoriaVersion.historia_id == historia_id, _de_cadena(HistoriaVersion, entrada_id))
+    punto_control = db.select(db.func.max(HistoriaVersion.numero)).where(
+        *cadena,
+        HistoriaVersion.es_completa == True,
+        HistoriaVersion.numero <= numero
+    ).scalar_subquery()
+    filas = db.session.execute(
+        db.select(HistoriaVersion.numero, HistoriaVersion.es_completa,
+                  HistoriaVersion.contenido, HistoriaVersion.delta)
+        .where(*cadena,
+               HistoriaVersion.numero >= punto_control,
+               HistoriaVersion.numero <= numero)
+        .order_by(HistoriaVersion.numero)
+    ).all()
+    if not filas or filas[-1].numero != numero:
+        raise LookupError(f'La historia {historia_id} no tiene la versión {numero}')
+
+    # Versión en caché más cercana a la pedida
+    inicio = 0
+    contenido = filas[0].contenido
+    for i in range(len(filas) - 1, 0, -1):
+        en_cache = cache_versiones.obtener((historia_id, filas[i].numero))
+        if en_cache is not None:
+            inicio, contenido = i, en_cache
+            break
+
+    for fila in filas[inicio + 1:]:
+        contenido = fila.contenido if fila.es_completa else aplicar_delta(contenido, fila.delta)
+
+    _guardar_en_cache(historia_id, numero, contenido)
+    return contenido
+
+
+def ultima_version(historia_id, entrada_id=None):
+    """
+    (numero, versiones en la cadena, contenido) de la última versión de la
+    cadena de `entrada_id` (None = contenido de la historia), o (0, 0, '')
+    """
+    from .models import HistoriaVersion
+
+    numero, total = db.session.execute(
+        db.select(db.func.max(HistoriaVersion.numero), db.func.count(HistoriaVersion.id))
+        .where(HistoriaVersion.historia_id == historia_id, _de_cadena(HistoriaVersion, entrada_id))
+    ).one()
+    if numero is None:
+        return 0, 0, ''
+    return numero, total, contenido_version(historia_id, numero)
+
+
+def registrar_version(historia, contenido, usuario_id, entrada_id=None, fecha=None):
+    """
+    Agrega una versión con `contenido` a la cadena de `entrada_id` (None =
+    contenido de la historia, que también se actualiza).
+
+    Se guarda como delta respecto a la versión anterior de la cadena, salvo
+    cada HISTORIA_VERSIONES_CHECKPOINT versiones o cuando el delta no ahorra
+    al menos la mitad del texto, que se guarda la copia completa.
+    Va después de bloquear_historia (el número es de toda la historia).
+    No hace commit.
+    """
+    from .models import HistoriaVersion
+
+    _, total, anterior = ultima_version(historia.id, entrada_id)
+    numero = (db.session.scalar(
+        db.select(db.func.max(HistoriaVersion.numero)).where(HistoriaVersion.historia_id == historia.id)
+    ) or 0) + 1
+    intervalo = current_app.config.get('HISTORIA_VERSIONES_CHECKPOINT', 20)
+
+    version = HistoriaVersion(historia_id=historia.id, numero=numero, entrada_id=entrada_id,
+                              actualizado_por_id=usuario_id)
+    if fecha is not None:
+        version.fecha = fecha
+    delta = calcular_delta(anterior, contenido) if total else None
+    if delta is None or total % intervalo == 0 or len(delta) * 2 > len(contenido):
+        version.es_completa = True
+        version.contenido = contenido
+    else:
+        version.es_completa = False
+        version.delta = delta
+    db.session.add(version)
+    # El número siguiente sale de la base: la versión debe estar escrita
+    db.session.flush()
+
+    if entrada_id is None:
+        historia.contenido = contenido
+        historia.actualizado_por_id = usuario_id
+    _guardar_al_confirmar(db.session, historia.id, numero, contenido)
+    return version
+
+
+def bloquear_historia(historia_id):
+    """
+    Serializa las escrituras en una historia hasta el commit, para que dos
+    cambios simultáneos no tomen el mismo número de versión. Va antes de
+    modificar las entradas.
+    """
+    from .conexiones import bloquear_fila
+    from .models import HistoriaClinica
+    bloquear_fila(db.session, HistoriaClinica, historia_id)
+
+
+def registrar_cambio_entrada(entrada, anterior, nuevo, usuario_id):
+    """
+    Versiona una entrada que se edita (`nuevo` es su texto) o se elimina
+    (`nuevo` = ''): solo el texto de esa entrada, sin tocar el resto de la
+    historia. La primera vez guarda antes el texto original con su autor y
+    fecha. Agregar entradas no crea versiones. No hace commit.
+    """
+    if not ultima_version(entrada.historia_id, entrada.id)[1]:
+        registrar_version(entrada.historia, anterior, entrada.autor_id, entrada.id, fecha=entrada.fecha)
+    return registrar_version(entrada.historia, nuevo, usuario_id, entrada.id)
+
+
+def compactar_versiones(historia_id):
+    """
+    Reescribe como deltas las copias completas antiguas de una historia,
+    conservando los puntos de control de cada cadena. Devuelve (bytes
+    antes, bytes después). No hace commit.
+    """
+    from .models import HistoriaVersion
+
+    intervalo = current_app.config.get('HISTORIA_VERSIONES_CHECKPOINT', 20)
+    versiones = HistoriaVersion.query.filter_by(historia_id=historia_id).order_by(HistoriaVersion.numero).all()
+
+    antes = despues = 0
+    posiciones = {}
+    anteriores = {}
+    for version in versiones:
+        posicion = posiciones[version.entrada_id] = posiciones.get(version.entrada_id, -1) + 1
+        anterior = anteriores.get(version.entrada_id)
+        actual = contenido_version(historia_id, version.numero)
+        antes += len(version.contenido or version.delta or '')
+        if anterior is not None and posicion % intervalo != 0:
+            delta = calcular_delta(anterior, actual)
+            if len(delta) * 2 <= len(actual):
+                version.es_completa = False
+                version.contenido = None
+                version.delta = delta
+        despues += len(version.contenido or version.delta or '')
+        anteriores[version.entrada_id] = actual
+    return antes, despues
@@ -0,0 +1,201 @@
+"""
+Generador de datos sintéticos de la clínica para los benchmarks.
+
+Uso:
+    python bench/datos_sinteticos.py --database-url sqlite:////tmp/clinica.db [--pacientes 10000]
+
+Aplica las migraciones (`inicializar_bd`) y carga médicos, especialidades,
+horarios, pacientes, citas e historias clínicas con sus entradas, con una
+semilla fija para que el resultado sea el mismo en cada ejecución. Las filas
+se insertan por lotes con executemany. La base debe estar vacía; la escala
+usada queda en la tabla bench_meta para reutilizar el archivo entre commits.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, date, time as hora, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+NOMBRES = ['José', 'María', 'Luis', 'Ana', 'Carlos', 'Lucía', 'Andrés', 'Sofía', 'Jorge', 'Valentina',
+           'Pedro', 'Camila', 'Juan', 'Daniela', 'Miguel', 'Paula', 'Sebastián', 'Laura', 'Diego', 'Mariana']
+APELLIDOS = ['García', 'Rodríguez', 'Martínez', 'López', 'González', 'Pérez', 'Sánchez', 'Ramírez', 'Torres',
+             'Flórez', 'Gómez', 'Díaz', 'Vargas', 'Castro', 'Ortiz', 'Rojas', 'Muñoz', 'Peña', 'Ríos', 'Mejía']
+ESPECIALIDADES = ['Medicina General', 'Pediatría', 'Cardiología', 'Dermatología', 'Ginecología',
+                  'Ortopedia', 'Neurología', 'Psiquiatría', 'Oftalmología', 'Nutrición']
+FRASES = ['Paciente refiere dolor abdominal de tres días de evolución.',
+          'Presión arterial 120/80, frecuencia cardiaca 72.',
+          'Se indica control en un mes y exámenes de laboratorio.',
+          'Evolución favorable, continúa tratamiento.',
+          'Cefalea intermitente sin signos de alarma.',
+          'Diagnóstico: hipertensión arterial controlada.',
+          'Se formula acetaminofén 500 mg cada 8 horas.',
+          'Niega alergias medicamentosas conocidas.']
+
+LOTE = 10000
+MEDICOS = 40
+
+
+def _lotes(filas, tamano=LOTE):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _insertar(tabla, filas):
+    from app import db
+    total = 0
+    for lote in _lotes(filas):
+        db.session.execute(tabla.insert(), lote)
+        db.session.commit()
+        total += len(lote)
+    return total
+
+
+def escala_existente():
+    """Escala con la que se generó la base actual, o None si no tiene datos del benchmark"""
+    from app import db
+    from sqlalchemy import inspect
+    if 'bench_meta' not in inspect(db.engine).get_table_names():
+        return None
+    filas = db.session.execute(db.text('SELECT clave, valor FROM bench_meta')).all()
+    return {clave: int(valor) for clave, valor in filas}
+
+
+def generar(pacientes=10000, citas=None, entradas=None, semilla=1):
+    """
+    Carga el conjunto de datos en la base de la app actual (dentro de un
+    app_context). `citas` y `entradas` valen `pacientes` si no se indican.
+    Devuelve un dict con los conteos y el tiempo de generación.
+    """
+    from app import db
+    from app.comandos import inicializar_bd
+    from app.busqueda import normalizar_texto
+    from app.models import Rol, Usuario, Paciente, Especialidad, HorarioMedico, Cita, HistoriaClinica, HistoriaEntrada
+
+    citas = pacientes if citas is None else citas
+    entradas = pacientes if entradas is None else entradas
+    rnd = random.Random(semilla)
+    inicio = time.perf_counter()
+
+    inicializar_bd()
+    if db.session.scalar(db.select(db.func.count(Paciente.id))):
+        raise RuntimeError('La base ya tiene pacientes; el generador necesita una base vacía')
+
+    rol_medico = db.session.scalar(db.select(Rol.id).where(Rol.nombre == 'medico'))
+    _insertar(Especialidad.__table__, ({'nombre': nombre} for nombre in ESPECIALIDADES))
+    especialidad_ids = list(db.session.scalars(db.select(Especialidad.id).order_by(Especialidad.id)))
+
+    _insertar(Usuario.__table__, (
+        {'nombre': f'Dr. {rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {i}', 'email': f'medico{i}@bench.ipsfulano.com',
+         'password': 'x', 'rol_id': rol_medico, 'activo': True, 'password_cambiada': True}
+        for i in range(MEDICOS)
+    ))
+    medico_ids = list(db.session.scalars(db.select(Usuario.id).where(Usuario.rol_id == rol_medico).order_by(Usuario.id)))
+    especialidad_de = {medico_id: especialidad_ids[i % len(especialidad_ids)] for i, medico_id in enumerate(medico_ids)}
+
+    # Horario de lunes a viernes, 8:00-12:00 y 14:00-18:00, cupos de 20 minutos
+    _insertar(HorarioMedico.__table__, (
+        {'medico_id': medico_id, 'especialidad_id': especialidad_de[medico_id], 'dia_semana': dia,
+         'hora_inicio': inicio_franja, 'hora_fin': fin_franja, 'duracion_minutos': 20}
+        for medico_id in medico_ids
+        for dia in range(5)
+        for inicio_franja, fin_franja in ((hora(8), hora(12)), (hora(14), hora(18)))
+    ))
+
+    def _pacientes():
+        for i in range(pacientes):
+            nombre = f'{rnd.choice(NOMBRES)} {rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}'
+            yield {
+                'nombre': nombre, 'nombre_normalizado': normalizar_texto(nombre),
+                'identificacion': f'{10000000 + i}', 'sexo': rnd.choice(['Femenino', 'Masculino']),
+                'fecha_nacimiento': date(1940, 1, 1) + timedelta(days=rnd.randrange(30000)),
+                'telefono': f'300{rnd.randrange(10 ** 7):07d}', 'email': f'paciente{i}@bench.ipsfulano.com',
+                'direccion': f'Calle {rnd.randrange(1, 200)} # {rnd.randrange(1, 100)}-{rnd.randrange(1, 100)}',
+                'activo': rnd.random() > 0.05,
+            }
+    _insertar(Paciente.__table__, _pacientes())
+    primer_paciente = db.session.scalar(db.select(db.func.min(Paciente.id)))
+
+    # Citas repartidas entre los últimos 12 meses y los próximos 2, en los cupos
+    # de 20 minutos de los horarios; (médico, fecha) no se repite, como exige el
+    # índice único de citas activas (si no caben, se sigue hacia años anteriores)
+    hoy = datetime.combine(date.today(), hora(8))
+    dias_agenda = 425
+    cupos_por_dia = 24
+    def _citas():
+        for i in range(citas):
+            medico_id = medico_ids[i % len(medico_ids)]
+            ranura = i // len(medico_ids)
+            vuelta, ranura = divmod(ranura, dias_agenda * cupos_por_dia)
+            # 211 es primo con 425: recorre todos los días antes de repetir cupo
+            dia = hoy + timedelta(days=60 - dias_agenda * (vuelta + 1) + ranura * 211 % dias_agenda)
+            minutos = (ranura // dias_agenda) * 20
+            fecha = dia + timedelta(minutes=minutos + (120 if minutos >= 240 else 0))
+            yield {
+                'paciente_id': primer_paciente + rnd.randrange(pacientes), 'medico_id': medico_id,
+                'especialidad_id': especialidad_de[medico_id], 'fecha': fecha,
+                'estado': 'Pendiente' if fecha > hoy else rnd.choice(['Realizada', 'Realizada', 'Cancelada']),
+            }
+    _insertar(Cita.__table__, _citas())
+
+    # Historias: la mitad de los pacientes; las entradas se concentran en pocos
+    # pacientes (como los crónicos) y el primero recibe muchas para medir su historia
+    con_historia = max(1, pacientes // 2)
+    _insertar(HistoriaClinica.__table__, (
+        {'paciente_id': primer_paciente + i, 'contenido': '', 'ultima_actualizacion': hoy}
+        for i in range(con_historia)
+    ))
+    primera_historia = db.session.scalar(db.select(db.func.min(HistoriaClinica.id)))
+
+    def _entradas():
+        for i in range(entradas):
+            if i % 10 == 0:
+                historia_id = primera_historia
+            else:
+                historia_id = primera_historia + min(int(rnd.paretovariate(1.2)) - 1, con_historia - 1)
+            yield {
+                'historia_id': historia_id, 'autor_id': rnd.choice(medico_ids),
+                'contenido': ' '.join(rnd.sample(FRASES, 3)),
+                'fecha': hoy - timedelta(minutes=rnd.randrange(365 * 24 * 60)),
+            }
+    _insertar(HistoriaEntrada.__table__, _entradas())
+
+    db.session.execute(db.text('CREATE TABLE bench_meta (clave VARCHAR(40) PRIMARY KEY, valor VARCHAR(40))'))
+    db.session.execute(db.text('INSERT INTO bench_meta (clave, valor) VALUES (:clave, :valor)'), [
+        {'clave': 'pacientes', 'valor': str(pacientes)}, {'clave': 'citas', 'valor': str(citas)},
+        {'clave': 'entradas', 'valor': str(entradas)}, {'clave': 'semilla', 'valor': str(semilla)},
+    ])
+    db.session.commit()
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text('ANALYZE'))
+    elif db.engine.dialect.name == 'postgresql':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+            conexion.execute(db.text('ANALYZE'))
+
+    return {'pacientes': pacientes, 'citas': citas, 'entradas': entradas, 'semilla': semilla,
+            'segundos': round(time.perf_counter() - inicio, 1)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True, help='Base vacía donde cargar los datos')
+    parser.add_argument('--pacientes', type=int, default=10000)
+    parser.add_argument('--citas', type=int, help='Por defecto, igual a --pacientes')
+    parser.add_argument('--entradas', type=int, help='Entradas de historia; por defecto, igual a --pacientes')
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    from app import create_app
+    import json
+    with create_app().app_context():
+        print(json.dumps(generar(args.pacientes, args.citas, args.entradas, args.semilla), indent=2))
@@ -0,0 +1,286 @@
+"""
+Benchmark de los endpoints principales sobre un conjunto de datos sintético
+(bench/datos_sinteticos.py) a la escala indicada.
+
+Uso:
+    python bench/endpoints.py [--pacientes 10000] [--repeticiones 20] [--salida resultado.json]
+    python bench/endpoints.py --datos /tmp/clinica_100k.db --pacientes 100000
+    python bench/endpoints.py --database-url postgresql://localhost/ips_bench --pacientes 100000
+    python bench/endpoints.py --comparar anterior.json
+
+Recorre cada endpoint con el cliente de pruebas de Flask (sin red ni
+servidor) e informa por endpoint la mediana y el p95 de la latencia, las
+consultas SQL por petición, el pico de memoria asignada (tracemalloc, en una
+petición aparte para no alterar los tiempos) y, en los reportes PDF, el
+tiempo de generación del HTML y de la maquetación. Los PDF se generan en la
+petición y sin caché para medir el trabajo completo.
+
+Sin --datos ni --database-url usa una base SQLite temporal. Con --datos el
+archivo se genera la primera vez y se reutiliza en las siguientes
+ejecuciones (p. ej. para comparar commits con los mismos datos). El
+resultado es JSON; --comparar imprime la razón contra un resultado anterior.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def _percentiles(tiempos):
+    tiempos = sorted(tiempos)
+    return {
+        'mediana_ms': round(statistics.median(tiempos) * 1000, 3),
+        'p95_ms': round(tiempos[max(int(len(tiempos) * 0.95) - 1, 0)] * 1000, 3),
+    }
+
+
+def _server_timing(cabecera):
+    """{'db': ms, 'tpl': ms, 'pdf': ms, 'total': ms, 'consultas': n} de la cabecera Server-Timing"""
+    datos = {}
+    for parte in (cabecera or '').split(','):
+        nombre, _, resto = parte.strip().partition(';')
+        duracion = re.search(r'dur=([\d.]+)', resto)
+        if duracion:
+            datos[nombre] = float(duracion.group(1))
+        consultas = re.search(r'desc="(\d+) consultas"', resto)
+        if consultas:
+            datos['consultas'] = int(consultas.group(1))
+    return datos
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _endpoints(ids):
+    """(nombre, url) de cada endpoint medido, con ids tomados de los datos generados"""
+    hoy = date.today()
+    proximo_lunes = hoy + timedelta(days=7 - hoy.weekday())
+    hace_un_mes = (hoy - timedelta(days=30)).isoformat()
+    return [
+        ('dashboard', '/dashboard'),
+        ('pacientes', '/pacientes'),
+        ('pacientes_busqueda', '/pacientes?q=maria garcia'),
+        ('citas', '/citas'),
+        ('citas_filtradas', f'/citas?desde={hace_un_mes}&hasta={hoy.isoformat()}&estado=Realizada'),
+        ('citas_medico', f'/citas?medico_id={ids["medico"]}'),
+        ('historia', f'/paciente/{ids["paciente"]}/historia'),
+        ('historia_entradas', f'/paciente/{ids["paciente"]}/historia/entradas'),
+        ('historias_buscar', '/historias/buscar?q=dolor abdominal'),
+        ('reportes', '/reportes'),
+        ('autocompletar_pacientes', '/autocompletar/pacientes?q=lucia'),
+        ('agenda_cupos', f'/agenda/cupos?especialidad_id={ids["especialidad"]}&cantidad=10'),
+        ('agenda_medico', f'/agenda/medico/{ids["medico"]}/cupos?fecha={proximo_lunes.isoformat()}'),
+    ]
+
+
+PDFS = [
+    ('pdf_pacientes', '/reporte/pacientes.pdf', 'reporte/pacientes_pdf.html'),
+    ('pdf_citas', '/reporte/citas.pdf', 'reporte/citas_pdf.html'),
+    ('pdf_especialidades', '/reporte/especialidades.pdf', 'reporte/especialidades_pdf.html'),
+    ('pdf_historia', '/paciente/{paciente}/historia/imprimir', 'historia/historia_clinica_pdf.html'),
+]
+
+
+def _medir(cliente, url, repeticiones, calentamiento=2):
+    """Tiempos y consultas de `repeticiones` peticiones GET, más el pico de memoria de una adicional"""
+    for _ in range(calentamiento):
+        respuesta = cliente.get(url)
+        if respuesta.status_code != 200:
+            raise RuntimeError(f'{url} respondió {respuesta.status_code}')
+
+    tiempos = []
+    consultas = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = cliente.get(url)
+        respuesta.get_data()
+        tiempos.append(time.perf_counter() - inicio)
+        consultas.append(_server_timing(respuesta.headers.get('Server-Timing')).get('consultas', 0))
+
+    tracemalloc.start()
+    cliente.get(url).get_data()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(
+        _percentiles(tiempos),
+        consultas=max(consultas),
+        memoria_pico_kb=round(pico / 1024, 1),
+    )
+
+
+def _medir_pdf(cliente, url, plantilla, repeticiones, metricas):
+    """Como _medir, separando el tiempo del HTML y de la maquetación (registro de metricas)"""
+    def _suma(fase):
+        histograma = metricas._pdf.get((plantilla, fase))
+        return histograma.suma if histograma else 0.0
+
+    cliente.get(url).get_data()
+    html = _suma('html')
+    maquetacion = _suma('maquetacion')
+    tiempos = []
+    consultas = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = cliente.get(url)
+        respuesta.get_data()
+        tiempos.append(time.perf_counter() - inicio)
+        if respuesta.status_code != 200 or respuesta.mimetype != 'application/pdf':
+            raise RuntimeError(f'{url} respondió {respuesta.status_code} {respuesta.mimetype}')
+        consultas.append(_server_timing(respuesta.headers.get('Server-Timing')).get('consultas', 0))
+
+    tracemalloc.start()
+    cliente.get(url).get_data()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(
+        _percentiles(tiempos),
+        html_ms=round((_suma('html') - html) / repeticiones * 1000, 3),
+        maquetacion_ms=round((_suma('maquetacion') - maquetacion) / repeticiones * 1000, 3),
+        consultas=max(consultas),
+        memoria_pico_kb=round(pico / 1024, 1),
+    )
+
+
+def ejecutar(pacientes=10000, citas=None, entradas=None, repeticiones=20, repeticiones_pdf=3,
+             database_url=None, datos=None, con_pdf=True, semilla=1):
+    if database_url:
+        os.environ['DATABASE_URL'] = database_url
+    else:
+        datos = datos or os.path.join(tempfile.mkdtemp(), 'bench.db')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(datos)
+    # PDF dentro de la petición y sin caché; Server-Timing trae las consultas por petición
+    os.environ['PDF_ASINCRONO'] = '0'
+    os.environ['PDF_CACHE'] = '0'
+    os.environ['METRICAS'] = '1'
+    os.environ['METRICAS_SERVER_TIMING'] = '1'
+
+    from app import create_app, db
+    from app.models import Usuario, Rol, Paciente, Especialidad
+    from datos_sinteticos import generar, escala_existente
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.logger.setLevel('ERROR')
+    esperada = {
+        'pacientes': pacientes,
+        'citas': pacientes if citas is None else citas,
+        'entradas': pacientes if entradas is None else entradas,
+        'semilla': semilla,
+    }
+    with app.app_context():
+        escala = escala_existente()
+        if escala is None:
+            # Los mensajes de inicializar_bd no deben mezclarse con el JSON de la salida estándar
+            with redirect_stdout(sys.stderr):
+                generacion = generar(pacientes, citas, entradas, semilla)
+        elif escala != esperada:
+            raise RuntimeError(f'La base ya tiene datos de otra escala: {escala}')
+        else:
+            generacion = None
+
+        ids = {
+            'paciente': db.session.scalar(db.select(db.func.min(Paciente.id))),
+            'medico': db.session.scalar(
+                db.select(db.func.min(Usuario.id)).join(Rol).where(Rol.nombre == 'medico')
+            ),
+            'especialidad': db.session.scalar(db.select(db.func.min(Especialidad.id))),
+        }
+        motor = {'dialecto': db.engine.dialect.name, 'version': '.'.join(map(str, db.engine.dialect.server_version_info or ()))}
+
+    cliente = app.test_client()
+    respuesta = cliente.post('/', data={'email': 'admin@ipsfulano.com', 'password': 'admin123'})
+    if respuesta.status_code != 302:
+        raise RuntimeError('No se pudo iniciar sesión como administrador')
+
+    resultados = {}
+    for nombre, url in _endpoints(ids):
+        resultados[nombre] = dict(url=url, **_medir(cliente, url, repeticiones))
+        print(f'  {nombre}: {resultados[nombre]["mediana_ms"]} ms', file=sys.stderr)
+
+    if con_pdf:
+        metricas = app.extensions['metricas']
+        for nombre, url, plantilla in PDFS:
+            url = url.format(**ids)
+            resultados[nombre] = dict(url=url, **_medir_pdf(cliente, url, plantilla, repeticiones_pdf, metricas))
+            print(f'  {nombre}: {resultados[nombre]["mediana_ms"]} ms', file=sys.stderr)
+
+    from importlib.metadata import version
+    return {
+        'commit': _commit_actual(),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'flask': version('flask'),
+        'sqlalchemy': version('sqlalchemy'),
+        'motor': motor,
+        'escala': esperada,
+        'generacion': generacion,
+        'repeticiones': {'endpoints': repeticiones, 'pdf': repeticiones_pdf},
+        'endpoints': resultados,
+    }
+
+
+def comparar(actual, anterior):
+    """Líneas con la razón actual/anterior de mediana, p95 y consultas por endpoint"""
+    lineas = [f'{"endpoint":<26}{"mediana":>10}{"p95":>10}{"consultas":>12}']
+    for nombre, datos in actual['endpoints'].items():
+        previo = anterior.get('endpoints', {}).get(nombre)
+        if not previo:
+            lineas.append(f'{nombre:<26}{"(nuevo)":>10}')
+            continue
+        razon = lambda clave: f'{datos[clave] / previo[clave]:.2f}x' if previo[clave] else '-'
+        lineas.append(
+            f'{nombre:<26}{razon("mediana_ms"):>10}{razon("p95_ms"):>10}'
+            f'{previo["consultas"]:>6} → {datos["consultas"]:<4}'
+        )
+    return lineas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=10000, help='Escala: 10000, 100000, 1000000...')
+    parser.add_argument('--citas', type=int, help='Por defecto, igual a --pacientes')
+    parser.add_argument('--entradas', type=int, help='Entradas de historia; por defecto, igual a --pacientes')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--repeticiones-pdf', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--datos', help='Archivo SQLite con los datos generados (se crea si no existe)')
+    parser.add_argument('--database-url', help='Base PostgreSQL local en lugar de SQLite')
+    parser.add_argument('--sin-pdf', action='store_true', help='No medir los reportes PDF')
+    parser.add_argument('--salida', help='Archivo JSON del resultado (por defecto, salida estándar)')
+    parser.add_argument('--comparar', help='Resultado JSON anterior contra el cual comparar')
+    args = parser.parse_args()
+
+    resultado = ejecutar(
+        pacientes=args.pacientes, citas=args.citas, entradas=args.entradas,
+        repeticiones=args.repeticiones, repeticiones_pdf=args.repeticiones_pdf,
+        database_url=args.database_url, datos=args.datos, con_pdf=not args.sin_pdf, semilla=args.semilla,
+    )
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto + '\n')
+    else:
+        print(texto)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            print('\n'.join(comparar(resultado, json.load(archivo))), file=sys.stderr)
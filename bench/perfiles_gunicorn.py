@@ -0,0 +1,231 @@
+"""
+Verificación y carga de los perfiles de gunicorn.conf.py (gthread, gevent, preload).
+
+Uso:
+    python bench/perfiles_gunicorn.py [--perfiles gthread,gevent,preload] [--usuarios 12] [--iteraciones 15]
+
+Por cada perfil levanta gunicorn con dos workers sobre una base SQLite
+temporal y lanza usuarios concurrentes, cada uno con su propia sesión, que
+alternan lecturas y escrituras:
+
+- cada página debe saludar al usuario que la pidió y a ningún otro (el
+  usuario de Flask-Login no se mezcla entre hilos ni greenlets);
+- el mensaje flash de "Paciente creado" llega a quien lo creó;
+- el paciente recién creado aparece en la búsqueda de la petición
+  siguiente y, al terminar, la base tiene exactamente los pacientes creados
+  (la sesión de SQLAlchemy se confirma y se libera en cada petición);
+- un PDF encolado en un worker se puede consultar (y descargar) desde
+  cualquiera: su estado nunca responde 404 y el trabajo termina, aunque sea
+  con error si WeasyPrint no está instalado.
+
+Informa peticiones por segundo y latencia por perfil; termina con código 1
+si alguna comprobación falla. No toca la base configurada en DATABASE_URL.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+from contextlib import redirect_stdout
+from http.cookiejar import CookieJar
+from urllib.parse import urlencode
+from urllib.error import HTTPError
+from urllib.request import build_opener, HTTPCookieProcessor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CLAVE = 'clave-concurrencia'
+
+
+def _nombre(i):
+    return f'Concurrencia {i:02d}'
+
+
+def _percentiles(tiempos):
+    tiempos = sorted(tiempos)
+    return {
+        'mediana_ms': round(statistics.median(tiempos) * 1000, 3),
+        'p95_ms': round(tiempos[max(int(len(tiempos) * 0.95) - 1, 0)] * 1000, 3),
+    }
+
+
+def preparar_bd(ruta, usuarios):
+    """Esquema, datos iniciales y `usuarios` recepcionistas con contraseña ya cambiada"""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + ruta
+    from werkzeug.security import generate_password_hash
+    from app import create_app, db
+    from app.comandos import inicializar_bd
+    from app.models import Rol, Usuario
+
+    app = create_app()
+    with app.app_context(), redirect_stdout(sys.stderr):
+        inicializar_bd()
+        rol_id = db.session.scalar(db.select(Rol.id).where(Rol.nombre == 'recepcionista'))
+        clave = generate_password_hash(CLAVE)
+        db.session.add_all(
+            Usuario(nombre=_nombre(i), email=f'concurrencia{i:02d}@bench.ipsfulano.com', password=clave,
+                    rol_id=rol_id, password_cambiada=True)
+            for i in range(usuarios)
+        )
+        db.session.commit()
+    return app
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _csrf(html):
+    return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', html).group(1)
+
+
+def _trabajo_pdf(abrir, base, i, errores, espera):
+    """
+    Encola el reporte de pacientes y consulta su estado hasta que termina
+    (cada consulta abre otra conexión); falla si pasan `espera` segundos.
+    """
+    with abrir(base + '/reporte/pacientes.pdf', timeout=60) as respuesta:
+        trabajo = respuesta.geturl().rsplit('/', 1)[-1]
+    limite = time.monotonic() + espera
+    while True:
+        try:
+            with abrir(f'{base}/pdf/trabajo/{trabajo}/estado', timeout=60) as respuesta:
+                estado = json.load(respuesta)
+        except HTTPError as e:
+            errores.append(f'{_nombre(i)}: el estado del PDF {trabajo} respondió {e.code}')
+            return
+        if estado['estado'] in ('terminado', 'error'):
+            break
+        if time.monotonic() > limite:
+            errores.append(f'{_nombre(i)}: el PDF {trabajo} no terminó en {espera} s')
+            return
+        time.sleep(0.25)
+    if estado['url']:
+        with abrir(base + estado['url'], timeout=60) as respuesta:
+            if not respuesta.read(5).startswith(b'%PDF'):
+                errores.append(f'{_nombre(i)}: la descarga del PDF {trabajo} no es un PDF')
+
+
+def _usuario(base, i, prefijo, iteraciones, espera_pdf, tiempos, errores):
+    """Un usuario: inicia sesión, genera un PDF y repite dashboard → crear paciente → buscarlo"""
+    abrir = build_opener(HTTPCookieProcessor(CookieJar())).open
+
+    def pedir(ruta, datos=None):
+        inicio = time.perf_counter()
+        with abrir(base + ruta, data=urlencode(datos).encode() if datos else None, timeout=60) as respuesta:
+            cuerpo = respuesta.read().decode('utf-8')
+        tiempos.append(time.perf_counter() - inicio)
+        return cuerpo
+
+    try:
+        pedir('/', {'csrf_token': _csrf(pedir('/')), 'email': f'concurrencia{i:02d}@bench.ipsfulano.com', 'password': CLAVE})
+        _trabajo_pdf(abrir, base, i, errores, espera_pdf)
+        for n in range(iteraciones):
+            saludos = re.findall(r'Hola, (Concurrencia \d+)', pedir('/dashboard'))
+            if saludos != [_nombre(i)]:
+                errores.append(f'{_nombre(i)} recibió la página de {saludos}')
+
+            identificacion = f'{prefijo}{i:03d}{n:04d}'
+            cuerpo = pedir('/paciente/nuevo', {
+                'csrf_token': _csrf(pedir('/paciente/nuevo')),
+                'nombre': f'Paciente {identificacion}', 'identificacion': identificacion,
+                'sexo': 'Femenino', 'fecha_nacimiento': '1990-01-01',
+            })
+            if 'Paciente creado exitosamente' not in cuerpo:
+                errores.append(f'{_nombre(i)} no recibió la confirmación del paciente {identificacion}')
+            if f'<td>{identificacion}</td>' not in pedir(f'/pacientes?q={identificacion}'):
+                errores.append(f'{_nombre(i)} no ve el paciente {identificacion} recién creado')
+    except Exception as e:
+        errores.append(f'{_nombre(i)}: {e!r}')
+
+
+def ejecutar_perfil(app, ruta_bd, perfil, prefijo, usuarios, iteraciones, workers=2):
+    from app import db
+    from app.models import Paciente
+
+    puerto = _puerto_libre()
+    base = f'http://127.0.0.1:{puerto}'
+    # Los PDF de todos los usuarios se encolan a la vez: el último espera
+    # ceil(usuarios / PDF_MAX_CONCURRENTES) tandas de hasta PDF_TIMEOUT cada una
+    pdf_concurrentes = int(os.environ.get('PDF_MAX_CONCURRENTES', 2))
+    pdf_timeout = int(os.environ.get('PDF_TIMEOUT', 120))
+    espera_pdf = (-(-usuarios // pdf_concurrentes) + 1) * pdf_timeout
+    entorno = dict(os.environ, GUNICORN_PERFIL=perfil, WEB_CONCURRENCY=str(workers),
+                   GUNICORN_BIND=f'127.0.0.1:{puerto}', DATABASE_URL='sqlite:///' + ruta_bd,
+                   PDF_MAX_CONCURRENTES=str(pdf_concurrentes), PDF_TIMEOUT=str(pdf_timeout))
+    registro = tempfile.TemporaryFile()
+    servidor = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'run:app'], cwd=RAIZ, env=entorno,
+                                stdout=registro, stderr=subprocess.STDOUT)
+    try:
+        limite = time.monotonic() + 30
+        while True:
+            try:
+                with build_opener().open(base + '/salud', timeout=2):
+                    break
+            except OSError:
+                if servidor.poll() is not None or time.monotonic() > limite:
+                    registro.seek(0)
+                    raise RuntimeError(f'gunicorn ({perfil}) no arrancó:\n{registro.read().decode()[-2000:]}')
+                time.sleep(0.2)
+
+        tiempos, errores = [], []
+        hilos = [
+            threading.Thread(target=_usuario, args=(base, i, prefijo, iteraciones, espera_pdf, tiempos, errores))
+            for i in range(usuarios)
+        ]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+    finally:
+        servidor.terminate()
+        servidor.wait(timeout=30)
+
+    with app.app_context():
+        creados = db.session.scalar(
+            db.select(db.func.count(Paciente.id)).where(Paciente.identificacion.like(f'{prefijo}%'))
+        )
+    if creados != usuarios * iteraciones:
+        errores.append(f'Se esperaban {usuarios * iteraciones} pacientes y hay {creados}')
+
+    return dict(
+        _percentiles(tiempos) if tiempos else {},
+        peticiones=len(tiempos),
+        peticiones_por_segundo=round(len(tiempos) / duracion, 1),
+        errores=errores[:20],
+        total_errores=len(errores),
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--perfiles', default='gthread,gevent,preload')
+    parser.add_argument('--usuarios', type=int, default=12, help='Usuarios concurrentes')
+    parser.add_argument('--iteraciones', type=int, default=15, help='Ciclos lectura/escritura por usuario')
+    args = parser.parse_args()
+
+    ruta_bd = os.path.join(tempfile.mkdtemp(), 'concurrencia.db')
+    app = preparar_bd(ruta_bd, args.usuarios)
+    resultados = {}
+    for numero, perfil in enumerate(args.perfiles.split(','), start=1):
+        if perfil == 'gevent':
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                resultados[perfil] = {'omitido': 'el paquete gevent no está instalado'}
+                continue
+        resultados[perfil] = ejecutar_perfil(app, ruta_bd, perfil, str(numero), args.usuarios, args.iteraciones)
+
+    print(json.dumps(resultados, indent=2, ensure_ascii=False))
+    sys.exit(1 if any(r.get('total_errores') for r in resultados.values()) else 0)
@@ -0,0 +1,144 @@
+"""
+Benchmark del motor de versiones de historia clínica (app/versiones.py)
+frente a guardar la copia completa en cada versión.
+
+Uso:
+    python bench/versiones_historia.py [--versiones 500] [--lineas 400] [--lecturas 200]
+
+Crea una base SQLite temporal; no toca la base configurada en DATABASE_URL.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def _texto_inicial(lineas, rnd):
+    palabras = ['paciente', 'refiere', 'dolor', 'control', 'tratamiento', 'diagnóstico',
+                'presión', 'arterial', 'normal', 'evolución', 'favorable', 'indica']
+    return ''.join(' '.join(rnd.choices(palabras, k=10)) + '\n' for _ in range(lineas))
+
+
+def _editar(texto, rnd):
+    """Una edición típica: se agregan unas líneas al final y se corrige alguna existente"""
+    lineas = texto.splitlines(keepends=True)
+    for _ in range(rnd.randint(0, 2)):
+        i = rnd.randrange(len(lineas))
+        lineas[i] = lineas[i].rstrip('\n') + ' (corregido)\n'
+    lineas.extend(f'Nota {len(lineas)}: control sin novedad\n' for _ in range(rnd.randint(1, 4)))
+    return ''.join(lineas)
+
+
+def _percentiles(tiempos):
+    tiempos = sorted(tiempos)
+    return {
+        'mediana_ms': round(statistics.median(tiempos) * 1000, 3),
+        'p95_ms': round(tiempos[int(len(tiempos) * 0.95) - 1] * 1000, 3),
+    }
+
+
+def ejecutar(versiones=500, lineas=400, lecturas=200, semilla=1):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    from app import create_app, db
+    from app.comandos import migrar_bd
+    from app.models import Rol, Usuario, Paciente, HistoriaClinica, HistoriaVersion
+    from app.versiones import registrar_version, contenido_version, cache_versiones
+
+    app = create_app()
+    rnd = random.Random(semilla)
+    with app.app_context():
+        migrar_bd()
+        rol = Rol(nombre='medico')
+        db.session.add(rol)
+        db.session.flush()
+        usuario = Usuario(nombre='Bench', email='bench@local', password='x', rol_id=rol.id)
+        paciente = Paciente(nombre='Paciente Bench', identificacion='BENCH-1')
+        db.session.add_all([usuario, paciente])
+        db.session.flush()
+        historia = HistoriaClinica(paciente_id=paciente.id)
+        db.session.add(historia)
+        db.session.commit()
+
+        # Escritura: mismo historial de ediciones con ambos enfoques
+        textos = []
+        texto = _texto_inicial(lineas, rnd)
+        inicio = time.perf_counter()
+        for _ in range(versiones):
+            textos.append(texto)
+            registrar_version(historia, texto, usuario.id)
+            db.session.commit()
+            texto = _editar(texto, rnd)
+        escritura = time.perf_counter() - inicio
+
+        caracteres_completo = sum(len(t) for t in textos)
+        caracteres_delta = db.session.scalar(db.select(db.func.sum(
+            db.func.length(db.func.coalesce(HistoriaVersion.contenido, '')) +
+            db.func.length(db.func.coalesce(HistoriaVersion.delta, ''))
+        )))
+        completas = db.session.scalar(db.select(db.func.count(HistoriaVersion.id)).where(HistoriaVersion.es_completa == True))
+
+        # Lectura: la copia completa es una lectura por clave; el delta reconstruye
+        numeros = [rnd.randint(1, versiones) for _ in range(lecturas)]
+        tiempos_frio = []
+        for numero in numeros:
+            cache_versiones.vaciar()
+            t = time.perf_counter()
+            contenido = contenido_version(historia.id, numero)
+            tiempos_frio.append(time.perf_counter() - t)
+            assert contenido == textos[numero - 1], f'versión {numero} mal reconstruida'
+
+        # Relectura de versiones que ya están en la caché
+        recientes = numeros[-app.config['HISTORIA_VERSIONES_CACHE']:]
+        for numero in recientes:
+            contenido_version(historia.id, numero)
+        tiempos_cache = []
+        for numero in recientes:
+            t = time.perf_counter()
+            contenido_version(historia.id, numero)
+            tiempos_cache.append(time.perf_counter() - t)
+
+        # Referencia: leer una copia completa guardada en una columna
+        tabla = db.Table('bench_copia', db.MetaData(), db.Column('numero', db.Integer, primary_key=True),
+                         db.Column('contenido', db.Text))
+        tabla.create(db.engine)
+        db.session.execute(tabla.insert(), [{'numero': i + 1, 'contenido': t} for i, t in enumerate(textos)])
+        db.session.commit()
+        tiempos_copia = []
+        for numero in numeros:
+            t = time.perf_counter()
+            db.session.execute(db.select(tabla.c.contenido).where(tabla.c.numero == numero)).scalar()
+            tiempos_copia.append(time.perf_counter() - t)
+
+    return {
+        'versiones': versiones,
+        'lineas_iniciales': lineas,
+        'puntos_de_control': completas,
+        'almacenamiento': {
+            'copia_completa_kcaracteres': round(caracteres_completo / 1000, 1),
+            'delta_kcaracteres': round(caracteres_delta / 1000, 1),
+            'ahorro': round(1 - caracteres_delta / caracteres_completo, 3),
+        },
+        'escritura_ms_por_version': round(escritura / versiones * 1000, 3),
+        'lectura': {
+            'copia_completa': _percentiles(tiempos_copia),
+            'delta_sin_cache': _percentiles(tiempos_frio),
+            'delta_con_cache': _percentiles(tiempos_cache),
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--versiones', type=int, default=500)
+    parser.add_argument('--lineas', type=int, default=400)
+    parser.add_argument('--lecturas', type=int, default=200)
+    args = parser.parse_args()
+
+    import json
+    print(json.dumps(ejecutar(args.versiones, args.lineas, args.lecturas), indent=2, ensure_ascii=False))
@@ -26,4 +26,13 @@ apt-get update && apt-get install -y \
 echo "📦 Instalando dependencias de Python..."
 pip install -r requirements.txt
 
+# Bootstrap, Font Awesome y SweetAlert2 servidos por la app (sin CDN al cargar las páginas)
+echo "🎨 Preparando archivos estáticos..."
+flask --app run:app ips descargar-estaticos
+flask --app run:app ips compilar-estaticos
+
+# Crear tablas, índices y datos iniciales (una sola vez, no en cada worker)
+echo "🗄️  Inicializando base de datos..."
+flask --app run:app ips inicializar
+
 echo "✅ Build completado exitosamente"
\ No newline at end of file
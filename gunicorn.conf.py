@@ -0,0 +1,184 @@
+"""
+Configuración de gunicorn (se carga sola desde la raíz del proyecto).
+
+Perfiles (GUNICORN_PERFIL):
+    gthread  (por defecto) workers con hilos: una petición lenta (un PDF,
+             un listado grande) ocupa un hilo y no el worker completo.
+    gevent   workers con greenlets y psycopg2 cooperativo; para muchas
+             conexiones concurrentes que pasan el tiempo esperando a la base.
+             Requiere el paquete `gevent` (no está en requirements.txt).
+    preload  gthread con la aplicación cargada una vez en el proceso maestro
+             antes del fork; los workers comparten esa memoria (copy-on-write).
+
+Los workers se calculan con los núcleos y la memoria disponibles (respetando
+los límites del contenedor) y cada uno se reinicia tras un número de
+peticiones con variación aleatoria, para contener fugas de memoria sin
+reiniciarlos todos a la vez.
+
+Variables de entorno:
+    WEB_CONCURRENCY                 workers (por defecto según núcleos y memoria)
+    GUNICORN_THREADS                hilos por worker en gthread/preload (4)
+    GUNICORN_CONEXIONES             greenlets por worker en gevent (100)
+    GUNICORN_MB_POR_WORKER          memoria que se reserva por worker (256)
+    GUNICORN_MAX_REQUESTS           peticiones antes de reiniciar un worker (1000, 0 = nunca)
+    GUNICORN_MAX_REQUESTS_JITTER    variación de lo anterior (10 %)
+    GUNICORN_TIMEOUT                segundos sin respuesta antes de matar un worker (60)
+
+Con más de un worker la cola de PDF usa siempre PDF_COLA_BACKEND=db: con
+'memoria' el estado de un trabajo solo existe en el worker que lo creó.
+"""
+import os
+import math
+
+PERFILES = ('gthread', 'gevent', 'preload')
+
+perfil = os.environ.get('GUNICORN_PERFIL', 'gthread')
+if perfil not in PERFILES:
+    raise RuntimeError(f'GUNICORN_PERFIL debe ser uno de {", ".join(PERFILES)}, no {perfil!r}')
+
+
+# ============================================
+# RECURSOS DISPONIBLES
+# ============================================
+def _leer(ruta):
+    try:
+        with open(ruta) as archivo:
+            return archivo.read().strip()
+    except OSError:
+        return None
+
+
+def nucleos():
+    """Núcleos utilizables: cuota de CPU del cgroup, afinidad del proceso o cpu_count"""
+    cuota = _leer('/sys/fs/cgroup/cpu.max')  # cgroup v2: "cuota periodo" o "max periodo"
+    if cuota and not cuota.startswith('max'):
+        limite, periodo = (int(valor) for valor in cuota.split())
+        return max(1, math.ceil(limite / periodo))
+    limite, periodo = _leer('/sys/fs/cgroup/cpu/cpu.cfs_quota_us'), _leer('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if limite and periodo and int(limite) > 0:
+        return max(1, math.ceil(int(limite) / int(periodo)))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memoria_mb():
+    """Memoria utilizable en MB: límite del cgroup o memoria total de la máquina (None si no se sabe)"""
+    for ruta in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        limite = _leer(ruta)
+        # Sin límite, cgroup v2 dice "max" y v1 un número enorme
+        if limite and limite.isdigit() and int(limite) < 1 << 60:
+            return int(limite) // (1024 * 1024)
+    for linea in (_leer('/proc/meminfo') or '').splitlines():
+        if linea.startswith('MemTotal:'):
+            return int(linea.split()[1]) // 1024
+    return None
+
+
+def calcular_workers(perfil, cpus, memoria, mb_por_worker):
+    """
+    gthread/preload: 2 × núcleos + 1 (los hilos cubren la espera de E/S);
+    gevent: uno por núcleo (cada uno atiende cientos de greenlets).
+    En ambos casos sin pasar de lo que cabe en memoria.
+    """
+    workers = cpus if perfil == 'gevent' else 2 * cpus + 1
+    if memoria:
+        workers = min(workers, memoria // mb_por_worker)
+    return max(1, workers)
+
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+bind = os.environ.get('GUNICORN_BIND', f'0.0.0.0:{os.environ.get("PORT", "8000")}')
+proc_name = 'ips-fulano'
+
+workers = int(os.environ.get('WEB_CONCURRENCY') or calcular_workers(
+    perfil, nucleos(), memoria_mb(), int(os.environ.get('GUNICORN_MB_POR_WORKER', 256))
+))
+
+# El estado y la descarga de un PDF pueden llegar a cualquier worker
+cola_pdf_memoria = workers > 1 and os.environ.get('PDF_COLA_BACKEND', 'db') != 'db'
+if cola_pdf_memoria:
+    os.environ['PDF_COLA_BACKEND'] = 'db'
+
+if perfil == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GUNICORN_CONEXIONES', 100))
+    # Los greenlets esperan su turno en el pool en lugar de abrir una conexión cada uno
+    os.environ.setdefault('DB_POOL_SIZE', '10')
+    os.environ.setdefault('DB_MAX_OVERFLOW', '10')
+else:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+    # Una conexión por hilo: ningún hilo espera el pool en condiciones normales
+    os.environ.setdefault('DB_POOL_SIZE', str(threads))
+
+preload_app = perfil == 'preload'
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# El latido de los workers en memoria y no en el disco del contenedor
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+# ============================================
+# HOOKS
+# ============================================
+def _psycopg2_cooperativo():
+    """
+    Hace que psycopg2 ceda el control a otros greenlets mientras espera a la
+    base (lo mismo que psycogreen.gevent.patch_psycopg).
+    """
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return
+    from gevent.socket import wait_read, wait_write
+
+    def esperar(conexion, timeout=None):
+        while True:
+            estado = conexion.poll()
+            if estado == extensions.POLL_OK:
+                return
+            if estado == extensions.POLL_READ:
+                wait_read(conexion.fileno(), timeout=timeout)
+            elif estado == extensions.POLL_WRITE:
+                wait_write(conexion.fileno(), timeout=timeout)
+            else:
+                raise extensions.OperationalError(f'Estado inesperado de poll(): {estado!r}')
+
+    extensions.set_wait_callback(esperar)
+
+
+def when_ready(server):
+    server.log.info('Perfil %s: %d workers%s', perfil, workers,
+                    f', {worker_connections} conexiones' if perfil == 'gevent' else f' × {threads} hilos')
+    if cola_pdf_memoria:
+        server.log.warning('PDF_COLA_BACKEND=memoria no sirve con %d workers; se usa db', workers)
+    if preload_app:
+        # WeasyPrint se importa en el primer PDF; en el maestro queda compartido por todos los workers
+        try:
+            import weasyprint  # noqa: F401
+        except (ImportError, OSError) as e:
+            server.log.warning('WeasyPrint no se precargó: %s', e)
+        # Los objetos creados hasta aquí no los recorre el GC: sus páginas no se copian en los workers
+        import gc
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if perfil == 'gevent':
+        _psycopg2_cooperativo()
+    if preload_app:
+        # Las conexiones abiertas en el maestro no se comparten: cada worker abre las suyas
+        from app import db
+        with worker.app.wsgi().app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
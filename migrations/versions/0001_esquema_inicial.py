@@ -0,0 +1,121 @@
+"""Esquema inicial (el que creaba db.create_all())
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00
+
+Las bases existentes creadas con db.create_all() se marcan en esta
+revisión (`flask ips inicializar` lo hace automáticamente) y continúan
+desde la siguiente.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'rol',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nombre', sa.String(length=50), nullable=False),
+        sa.Column('descripcion', sa.String(length=200), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('nombre')
+    )
+    op.create_table(
+        'paciente',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nombre', sa.String(length=100), nullable=False),
+        sa.Column('identificacion', sa.String(length=20), nullable=False),
+        sa.Column('telefono', sa.String(length=15), nullable=True),
+        sa.Column('email', sa.String(length=100), nullable=True),
+        sa.Column('direccion', sa.String(length=200), nullable=True),
+        sa.Column('fecha_nacimiento', sa.Date(), nullable=True),
+        sa.Column('sexo', sa.String(length=20), nullable=True),
+        sa.Column('activo', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('identificacion')
+    )
+    op.create_table(
+        'especialidad',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nombre', sa.String(length=100), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('nombre')
+    )
+    op.create_table(
+        'usuario',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nombre', sa.String(length=100), nullable=False),
+        sa.Column('email', sa.String(length=100), nullable=False),
+        sa.Column('password', sa.String(length=200), nullable=False),
+        sa.Column('rol_id', sa.Integer(), nullable=False),
+        sa.Column('activo', sa.Boolean(), nullable=True),
+        sa.Column('password_cambiada', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['rol_id'], ['rol.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email')
+    )
+    op.create_table(
+        'historia_clinica',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('paciente_id', sa.Integer(), nullable=False),
+        sa.Column('contenido', sa.Text(), nullable=True),
+        sa.Column('ultima_actualizacion', sa.DateTime(), nullable=True),
+        sa.Column('actualizado_por_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['actualizado_por_id'], ['usuario.id']),
+        sa.ForeignKeyConstraint(['paciente_id'], ['paciente.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'cita',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('paciente_id', sa.Integer(), nullable=False),
+        sa.Column('medico_id', sa.Integer(), nullable=False),
+        sa.Column('especialidad_id', sa.Integer(), nullable=False),
+        sa.Column('fecha', sa.DateTime(), nullable=False),
+        sa.Column('estado', sa.String(length=20), nullable=True),
+        sa.ForeignKeyConstraint(['especialidad_id'], ['especialidad.id']),
+        sa.ForeignKeyConstraint(['medico_id'], ['usuario.id']),
+        sa.ForeignKeyConstraint(['paciente_id'], ['paciente.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'historia_entrada',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('historia_id', sa.Integer(), nullable=False),
+        sa.Column('autor_id', sa.Integer(), nullable=False),
+        sa.Column('contenido', sa.Text(), nullable=False),
+        sa.Column('fecha', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['autor_id'], ['usuario.id']),
+        sa.ForeignKeyConstraint(['historia_id'], ['historia_clinica.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'historia_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('historia_id', sa.Integer(), nullable=False),
+        sa.Column('contenido', sa.Text(), nullable=False),
+        sa.Column('actualizado_por_id', sa.Integer(), nullable=False),
+        sa.Column('fecha', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['actualizado_por_id'], ['usuario.id']),
+        sa.ForeignKeyConstraint(['historia_id'], ['historia_clinica.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('historia_version')
+    op.drop_table('historia_entrada')
+    op.drop_table('cita')
+    op.drop_table('historia_clinica')
+    op.drop_table('usuario')
+    op.drop_table('especialidad')
+    op.drop_table('paciente')
+    op.drop_table('rol')
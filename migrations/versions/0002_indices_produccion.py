@@ -0,0 +1,100 @@
+"""Índices de producción para claves foráneas y filtros frecuentes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:30:00
+
+Incluye también lo que antes agregaba create_app() sobre bases existentes
+(columna paciente.nombre_normalizado y tabla trabajo_pdf). Cada paso
+comprueba si el objeto ya existe, así aplica igual sobre una base nueva,
+una creada con create_all() o una que ya tenía parte de estos índices.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+# (nombre, tabla, columnas, opciones) en el orden de las consultas de routes.py
+INDICES = [
+    # Listado de pacientes (keyset por nombre, id) y búsqueda por prefijo
+    ('ix_paciente_activo_nombre_id', 'paciente', ['activo', 'nombre', 'id'], {}),
+    ('ix_paciente_nombre_normalizado', 'paciente', ['nombre_normalizado'],
+     {'postgresql_ops': {'nombre_normalizado': 'varchar_pattern_ops'}}),
+    ('ix_paciente_identificacion_prefijo', 'paciente', ['identificacion'],
+     {'postgresql_ops': {'identificacion': 'varchar_pattern_ops'}}),
+    ('ix_usuario_rol_id', 'usuario', ['rol_id'], {}),
+    ('ix_historia_clinica_paciente_id', 'historia_clinica', ['paciente_id'], {}),
+    ('ix_historia_clinica_actualizado_por_id', 'historia_clinica', ['actualizado_por_id'], {}),
+    # WHERE historia_id = ? ORDER BY fecha DESC
+    ('ix_historia_entrada_historia_fecha', 'historia_entrada', ['historia_id', sa.text('fecha DESC')], {}),
+    ('ix_historia_entrada_autor_id', 'historia_entrada', ['autor_id'], {}),
+    ('ix_historia_entrada_fecha', 'historia_entrada', ['fecha'], {}),
+    ('ix_historia_version_historia_fecha', 'historia_version', ['historia_id', 'fecha'], {}),
+    ('ix_historia_version_actualizado_por_id', 'historia_version', ['actualizado_por_id'], {}),
+    # Listado de citas: rango de fechas + estado + médico
+    ('ix_cita_fecha_estado_medico', 'cita', ['fecha', 'estado', 'medico_id'], {}),
+    ('ix_cita_medico_fecha', 'cita', ['medico_id', 'fecha'], {}),
+    ('ix_cita_paciente_fecha', 'cita', ['paciente_id', 'fecha'], {}),
+    ('ix_cita_especialidad_id', 'cita', ['especialidad_id'], {}),
+    ('ix_cita_estado', 'cita', ['estado'], {}),
+    ('ix_trabajo_pdf_creado', 'trabajo_pdf', ['creado'], {}),
+    ('ix_trabajo_pdf_usuario_id', 'trabajo_pdf', ['usuario_id'], {}),
+]
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def upgrade():
+    inspector = _inspector()
+
+    columnas = [c['name'] for c in inspector.get_columns('paciente')]
+    if 'nombre_normalizado' not in columnas:
+        with op.batch_alter_table('paciente') as batch_op:
+            batch_op.add_column(sa.Column('nombre_normalizado', sa.String(length=100), nullable=True))
+
+    if not inspector.has_table('trabajo_pdf'):
+        op.create_table(
+            'trabajo_pdf',
+            sa.Column('id', sa.String(length=32), nullable=False),
+            sa.Column('usuario_id', sa.Integer(), nullable=True),
+            sa.Column('nombre_archivo', sa.String(length=200), nullable=False),
+            sa.Column('descarga', sa.Boolean(), nullable=True),
+            sa.Column('estado', sa.String(length=20), nullable=True),
+            sa.Column('progreso', sa.Integer(), nullable=True),
+            sa.Column('error', sa.String(length=300), nullable=True),
+            sa.Column('creado', sa.DateTime(), nullable=True),
+            sa.Column('terminado', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['usuario_id'], ['usuario.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    inspector = _inspector()
+    existentes = {}
+    for nombre, tabla, columnas, opciones in INDICES:
+        if tabla not in existentes:
+            existentes[tabla] = {i['name'] for i in inspector.get_indexes(tabla)}
+        if nombre not in existentes[tabla]:
+            op.create_index(nombre, tabla, columnas, unique=False, **opciones)
+
+
+def downgrade():
+    for nombre, tabla, columnas, opciones in reversed(INDICES):
+        op.drop_index(nombre, table_name=tabla)
+    op.drop_table('trabajo_pdf')
+    # Índices de texto de app/busqueda.py que dependen de nombre_normalizado
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in ('paciente_fts_ai', 'paciente_fts_ad', 'paciente_fts_au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS paciente_fts')
+    else:
+        op.execute('DROP INDEX IF EXISTS ix_paciente_nombre_trgm')
+    with op.batch_alter_table('paciente') as batch_op:
+        batch_op.drop_column('nombre_normalizado')
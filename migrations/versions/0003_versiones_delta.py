@@ -0,0 +1,54 @@
+"""Versiones de historia como deltas con puntos de control
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00
+
+Las versiones existentes quedan numeradas por historia (fecha, id) y
+marcadas como copias completas; `flask ips compactar-versiones` las
+convierte luego en deltas.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('historia_version') as batch_op:
+        batch_op.add_column(sa.Column('numero', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('es_completa', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('delta', sa.Text(), nullable=True))
+        batch_op.alter_column('contenido', existing_type=sa.Text(), nullable=True)
+
+    conexion = op.get_bind()
+    filas = conexion.execute(sa.text(
+        'SELECT id, historia_id FROM historia_version ORDER BY historia_id, fecha, id'
+    )).all()
+    numeros = {}
+    for version_id, historia_id in filas:
+        numeros[historia_id] = numeros.get(historia_id, 0) + 1
+        conexion.execute(
+            sa.text('UPDATE historia_version SET numero = :numero, es_completa = :completa WHERE id = :id'),
+            {'numero': numeros[historia_id], 'completa': True, 'id': version_id}
+        )
+
+    with op.batch_alter_table('historia_version') as batch_op:
+        batch_op.alter_column('numero', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('es_completa', existing_type=sa.Boolean(), nullable=False)
+        batch_op.create_index('ix_historia_version_historia_numero', ['historia_id', 'numero'], unique=True)
+
+
+def downgrade():
+    # Requiere que todas las versiones sean completas (no ejecutar tras compactar)
+    with op.batch_alter_table('historia_version') as batch_op:
+        batch_op.drop_index('ix_historia_version_historia_numero')
+        batch_op.alter_column('contenido', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('delta')
+        batch_op.drop_column('es_completa')
+        batch_op.drop_column('numero')
@@ -0,0 +1,65 @@
+"""Horarios de los médicos y una sola cita activa por médico y hora
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:00:00
+
+Si ya hay citas activas duplicadas (mismo médico y fecha) la migración se
+detiene y las lista: hay que cancelarlas o moverlas antes de aplicarla.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'horario_medico',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('medico_id', sa.Integer(), nullable=False),
+        sa.Column('especialidad_id', sa.Integer(), nullable=False),
+        sa.Column('dia_semana', sa.Integer(), nullable=False),
+        sa.Column('hora_inicio', sa.Time(), nullable=False),
+        sa.Column('hora_fin', sa.Time(), nullable=False),
+        sa.Column('duracion_minutos', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['especialidad_id'], ['especialidad.id']),
+        sa.ForeignKeyConstraint(['medico_id'], ['usuario.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('horario_medico') as batch_op:
+        batch_op.create_index('ix_horario_medico_medico_dia', ['medico_id', 'dia_semana'])
+        batch_op.create_index('ix_horario_medico_especialidad_dia', ['especialidad_id', 'dia_semana'])
+
+    duplicadas = op.get_bind().execute(sa.text(
+        "SELECT medico_id, fecha, COUNT(*) FROM cita WHERE estado != 'Cancelada'"
+        " GROUP BY medico_id, fecha HAVING COUNT(*) > 1 ORDER BY fecha LIMIT 20"
+    )).all()
+    if duplicadas:
+        detalle = '\n'.join(f'  médico {m}, {f}: {n} citas' for m, f, n in duplicadas)
+        raise RuntimeError(
+            'Hay citas activas duplicadas para el mismo médico y hora; '
+            f'cancélalas o muévelas y vuelve a migrar:\n{detalle}'
+        )
+
+    with op.batch_alter_table('cita') as batch_op:
+        batch_op.create_index(
+            'ix_cita_medico_fecha_activa', ['medico_id', 'fecha'], unique=True,
+            sqlite_where=sa.text("estado != 'Cancelada'"),
+            postgresql_where=sa.text("estado != 'Cancelada'")
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('cita') as batch_op:
+        batch_op.drop_index('ix_cita_medico_fecha_activa')
+
+    with op.batch_alter_table('horario_medico') as batch_op:
+        batch_op.drop_index('ix_horario_medico_especialidad_dia')
+        batch_op.drop_index('ix_horario_medico_medico_dia')
+    op.drop_table('horario_medico')
@@ -0,0 +1,69 @@
+"""Tablas de archivo de citas y entradas de historia
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 17:00:00
+
+Reciben las filas antiguas que mueve `flask ips archivar`. En PostgreSQL
+con las tablas particionadas (`flask ips particionar`) quedan vacías.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'cita_archivo',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('paciente_id', sa.Integer(), nullable=False),
+        sa.Column('medico_id', sa.Integer(), nullable=False),
+        sa.Column('especialidad_id', sa.Integer(), nullable=False),
+        sa.Column('fecha', sa.DateTime(), nullable=False),
+        sa.Column('estado', sa.String(length=20), nullable=True),
+        sa.ForeignKeyConstraint(['especialidad_id'], ['especialidad.id']),
+        sa.ForeignKeyConstraint(['medico_id'], ['usuario.id']),
+        sa.ForeignKeyConstraint(['paciente_id'], ['paciente.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('cita_archivo') as batch_op:
+        batch_op.create_index('ix_cita_archivo_fecha', ['fecha'])
+        batch_op.create_index('ix_cita_archivo_paciente_fecha', ['paciente_id', 'fecha'])
+        batch_op.create_index('ix_cita_archivo_medico_fecha', ['medico_id', 'fecha'])
+        batch_op.create_index('ix_cita_archivo_especialidad_id', ['especialidad_id'])
+
+    op.create_table(
+        'historia_entrada_archivo',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('historia_id', sa.Integer(), nullable=False),
+        sa.Column('autor_id', sa.Integer(), nullable=False),
+        sa.Column('contenido', sa.Text(), nullable=False),
+        sa.Column('fecha', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['autor_id'], ['usuario.id']),
+        sa.ForeignKeyConstraint(['historia_id'], ['historia_clinica.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('historia_entrada_archivo') as batch_op:
+        batch_op.create_index('ix_historia_entrada_archivo_historia_fecha', ['historia_id', 'fecha'])
+        batch_op.create_index('ix_historia_entrada_archivo_fecha', ['fecha'])
+        batch_op.create_index('ix_historia_entrada_archivo_autor_id', ['autor_id'])
+
+
+def downgrade():
+    # Las filas archivadas vuelven a sus tablas antes de borrar el archivo
+    op.execute(
+        'INSERT INTO historia_entrada (id, historia_id, autor_id, contenido, fecha)'
+        ' SELECT id, historia_id, autor_id, contenido, fecha FROM historia_entrada_archivo'
+    )
+    op.execute(
+        'INSERT INTO cita (id, paciente_id, medico_id, especialidad_id, fecha, estado)'
+        ' SELECT id, paciente_id, medico_id, especialidad_id, fecha, estado FROM cita_archivo'
+    )
+    op.drop_table('historia_entrada_archivo')
+    op.drop_table('cita_archivo')
@@ -0,0 +1,31 @@
+"""Hora de inicio de los trabajos PDF
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 18:00:00
+
+Con PDF_COLA_BACKEND=db los workers se reparten PDF_MAX_CONCURRENTES
+contando las filas en 'procesando'; `iniciado` permite descartar las de un
+worker que murió a mitad del trabajo.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('trabajo_pdf') as batch_op:
+        batch_op.add_column(sa.Column('iniciado', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_trabajo_pdf_estado_iniciado', ['estado', 'iniciado'])
+
+
+def downgrade():
+    with op.batch_alter_table('trabajo_pdf') as batch_op:
+        batch_op.drop_index('ix_trabajo_pdf_estado_iniciado')
+        batch_op.drop_column('iniciado')
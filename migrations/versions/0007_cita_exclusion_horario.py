@@ -0,0 +1,68 @@
+"""Duración de las citas y, en PostgreSQL, citas de un médico sin cruces
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 18:30:00
+
+El índice único (medico_id, fecha) solo impide dos citas a la misma hora;
+en PostgreSQL una restricción de exclusión sobre
+tsrange(fecha, fecha + duracion_minutos) rechaza también las que se
+cruzan empezando a horas distintas. Necesita la extensión btree_gist (para
+la igualdad de medico_id dentro del índice GiST). Si ya hay citas activas
+cruzadas la migración se detiene y las lista.
+
+SQLite no tiene restricciones de exclusión: ahí basta el bloqueo de
+bloquear_agenda (app/agenda.py).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+EXCLUSION = (
+    "EXCLUDE USING gist (medico_id WITH =,"
+    " tsrange(fecha, fecha + duracion_minutos * interval '1 minute') WITH &&)"
+    " WHERE (estado != 'Cancelada')"
+)
+
+
+def upgrade():
+    for tabla in ('cita', 'cita_archivo'):
+        with op.batch_alter_table(tabla) as batch_op:
+            batch_op.add_column(sa.Column('duracion_minutos', sa.Integer(), nullable=False, server_default='20'))
+
+    conexion = op.get_bind()
+    if conexion.dialect.name != 'postgresql':
+        return
+
+    cruzadas = conexion.execute(sa.text(
+        "SELECT a.medico_id, a.fecha, b.fecha FROM cita a JOIN cita b"
+        " ON a.medico_id = b.medico_id AND a.id < b.id"
+        " AND tsrange(a.fecha, a.fecha + a.duracion_minutos * interval '1 minute')"
+        " && tsrange(b.fecha, b.fecha + b.duracion_minutos * interval '1 minute')"
+        " WHERE a.estado != 'Cancelada' AND b.estado != 'Cancelada'"
+        " ORDER BY a.fecha LIMIT 20"
+    )).all()
+    if cruzadas:
+        detalle = '\n'.join(f'  médico {m}: {a} y {b}' for m, a, b in cruzadas)
+        raise RuntimeError(
+            'Hay citas activas que se cruzan para el mismo médico; '
+            f'cancélalas o muévelas y vuelve a migrar:\n{detalle}'
+        )
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.execute(f'ALTER TABLE cita ADD CONSTRAINT ex_cita_medico_horario {EXCLUSION}')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE cita DROP CONSTRAINT IF EXISTS ex_cita_medico_horario')
+    for tabla in ('cita_archivo', 'cita'):
+        with op.batch_alter_table(tabla) as batch_op:
+            batch_op.drop_column('duracion_minutos')
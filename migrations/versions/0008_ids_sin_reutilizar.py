@@ -0,0 +1,63 @@
+"""AUTOINCREMENT en cita e historia_entrada (SQLite)
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 19:00:00
+
+Sin AUTOINCREMENT SQLite da a la fila nueva max(id) + 1: tras archivar y
+eliminar las filas de id más alto, una cita o entrada nueva podía repetir
+el id de una archivada. Con AUTOINCREMENT los ids no se reutilizan nunca;
+la secuencia arranca después del mayor id de la tabla y de su archivo.
+
+SQLite no permite agregarlo con ALTER TABLE: la tabla se recrea y se
+vuelven a crear sus índices y triggers (p. ej. los del índice FTS5 de
+historia_entrada). En PostgreSQL los ids salen de secuencias y no cambia nada.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+TABLAS = (('cita', 'cita_archivo'), ('historia_entrada', 'historia_entrada_archivo'))
+
+
+def _recrear(tabla, autoincrement):
+    conexion = op.get_bind()
+    # Los índices se vuelven a crear con su SQL original: la reflexión pierde el DESC
+    objetos = conexion.execute(sa.text(
+        "SELECT type, name, sql FROM sqlite_master"
+        " WHERE type IN ('index', 'trigger') AND tbl_name = :tabla AND sql IS NOT NULL"
+    ), {'tabla': tabla}).all()
+    with op.batch_alter_table(tabla, recreate='always', table_kwargs={'sqlite_autoincrement': autoincrement}):
+        pass
+    for tipo, nombre, sql in objetos:
+        if tipo == 'index':
+            conexion.exec_driver_sql(f'DROP INDEX IF EXISTS {nombre}')
+        conexion.exec_driver_sql(sql)
+
+
+def upgrade():
+    conexion = op.get_bind()
+    if conexion.dialect.name != 'sqlite':
+        return
+    for tabla, archivo in TABLAS:
+        _recrear(tabla, True)
+        maximo = conexion.scalar(sa.text(
+            f'SELECT max(id) FROM (SELECT max(id) AS id FROM {tabla} UNION ALL SELECT max(id) FROM {archivo})'
+        ))
+        conexion.execute(sa.text('DELETE FROM sqlite_sequence WHERE name = :tabla'), {'tabla': tabla})
+        conexion.execute(sa.text('INSERT INTO sqlite_sequence (name, seq) VALUES (:tabla, :maximo)'),
+                         {'tabla': tabla, 'maximo': maximo or 0})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for tabla, _ in TABLAS:
+        _recrear(tabla, False)
@@ -0,0 +1,31 @@
+"""Versiones por entrada de la historia
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 21:00:00
+
+Editar o eliminar una entrada versiona solo el texto de esa entrada
+(historia_version.entrada_id) en lugar de reconstruir y comparar la
+historia completa; las versiones existentes quedan con entrada_id NULL.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('historia_version') as batch_op:
+        batch_op.add_column(sa.Column('entrada_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_historia_version_historia_entrada', ['historia_id', 'entrada_id', 'numero'])
+
+
+def downgrade():
+    with op.batch_alter_table('historia_version') as batch_op:
+        batch_op.drop_index('ix_historia_version_historia_entrada')
+        batch_op.drop_column('entrada_id')
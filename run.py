@@ -3,4 +3,8 @@ from app import create_app
 app = create_app()
 
 if __name__ == '__main__':
+    # En desarrollo se prepara la base al arrancar; en producción usar `flask ips inicializar`
+    from app.comandos import inicializar_bd
+    with app.app_context():
+        inicializar_bd()
     app.run(debug=True)
\ No newline at end of file